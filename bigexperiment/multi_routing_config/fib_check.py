@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Offline check of the multi routing configuration forwarding tables.
+#
+# Builds an LPM index for every switch and configuration, either from the
+# routes the controller installs (routes.py) or from the tables read back
+# from the running switches, and looks for loops and unreachable hosts over
+# the whole destination space without sending a packet.
+#
+import argparse
+import os
+import sys
+import time
+
+# Import P4Runtime lib from parent utils dir
+# Probably there's a better way of doing this.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 './utils/'))
+from p4runtime_lib.aggregate import aggregate_routes
+from p4runtime_lib.fib import FibModel, LpmIndex
+from p4runtime_lib.topology import Topology
+
+from routes import DSCP, ROUTES, TABLES
+
+
+def desiredTables(aggregate):
+    tables = {}
+    for sw, sw_routes in ROUTES.items():
+        tables[sw] = {}
+        for config, table_name in TABLES.items():
+            routes = sw_routes[config]
+            if aggregate != 'off':
+                routes = aggregate_routes(routes, unrouted_is_free=(aggregate == 'loose'))
+            tables[sw][table_name] = LpmIndex(routes)
+    return tables
+
+
+def liveTables(p4info_file_path, topo, switch_ports_path):
+    # grpc is only needed when reading from the switches
+    import p4runtime_lib.bmv2
+    import p4runtime_lib.helper
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections
+    from allocator import read_switch_ports
+
+    p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    switch_ports = read_switch_ports(switch_ports_path)
+    tables = {}
+    try:
+        for sw in sorted(topo.switches, key=lambda s: int(s[1:])):
+            n = int(sw[1:])
+            ports = switch_ports.get(sw, {})
+            conn = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+                name=sw,
+                address='127.0.0.1:%d' % ports.get('grpc_port', 50050 + n),
+                device_id=ports.get('device_id', n - 1))
+            tables[sw] = {}
+            for table_name in TABLES.values():
+                table_id = p4info_helper.get_tables_id(table_name)
+                tables[sw][table_name] = LpmIndex.from_table_entries(
+                    p4info_helper, conn.ReadTableEntries(table_id), table_name)
+    finally:
+        ShutdownAllSwitchConnections()
+    return tables
+
+
+def printReport(config, report, elapsed):
+    print("Configuration %s: %d address classes checked in %.3fs" % (
+        config, report['classes'], elapsed))
+    for outcome, count in sorted(report['counts'].items()):
+        print("  %-10s %d addresses" % (outcome, count))
+    for sw, start, size in report['loops'][:10]:
+        print("  LOOP from %s for %d addresses starting at %d.%d.%d.%d" % (
+            (sw, size) + tuple((start >> s) & 0xff for s in (24, 16, 8, 0))))
+    for sw, host, outcome, path in report['unreachable']:
+        print("  %s cannot reach %s: %s via %s" % (sw, host, outcome, ' '.join(path)))
+
+
+def main(args):
+    topo = Topology.from_file(args.topo)
+    if args.live:
+        tables = liveTables(args.p4info, topo, args.switch_ports)
+    else:
+        tables = desiredTables(args.aggregate)
+    model = FibModel(topo, tables, dict((DSCP[c], t) for c, t in TABLES.items()))
+
+    if args.trace:
+        src_sw, dst = args.trace
+        outcome, path = model.trace(src_sw, dst, args.dscp)
+        print("%s -> %s (DSCP %d): %s via %s" % (src_sw, dst, args.dscp, outcome, ' '.join(path)))
+        return 0
+
+    failed = False
+    for config in sorted(TABLES):
+        start = time.time()
+        report = model.check(DSCP[config])
+        printReport(config, report, time.time() - start)
+        failed = failed or bool(report['loops'] or report['unreachable'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline MRC forwarding table check')
+    parser.add_argument('--topo', help='Topology JSON file used by run_exercise.py',
+                        type=str, action="store", required=False,
+                        default='./topo/topology.json')
+    parser.add_argument('--live', help='check the tables read from the running switches',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c, for --live',
+                        type=str, action="store", required=False,
+                        default='./build/mrc.p4.p4info.txt')
+    parser.add_argument('--switch-ports', help='ports and device ids of the switches, for --live',
+                        type=str, action="store", required=False,
+                        default='./logs/switches.json')
+    parser.add_argument('--aggregate', help='aggregation applied to routes.py, as in controller.py',
+                        type=str, action="store", required=False, default='exact',
+                        choices=['off', 'exact', 'loose'])
+    parser.add_argument('--trace', help='only trace one packet entering SWITCH towards ADDRESS',
+                        nargs=2, metavar=('SWITCH', 'ADDRESS'), required=False, default=None)
+    parser.add_argument('--dscp', help='DSCP of the traced packet',
+                        type=int, action="store", required=False, default=0)
+    args = parser.parse_args()
+
+    if args.live and not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    sys.exit(main(args))
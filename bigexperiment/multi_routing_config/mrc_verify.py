@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Reachability and loop verifier for the multi routing configurations.
+#
+# For every configuration (DSCP 0/4/8) and every single switch-to-switch
+# link failure, checks that each host reaches each other host without
+# loops. Packets sent onto the failed link are lost. A failure is
+# recoverable when every host pair is still delivered by at least one
+# configuration, which is what MRC relies on: affected traffic is moved to
+# a configuration that avoids the link.
+#
+# Per configuration and destination host, the forwarding state is a
+# next-hop array over all nodes; one row per failure scenario is resolved
+# at once by pointer doubling (p4runtime_lib.fib.follow), and destinations
+# are spread over worker processes.
+#
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# Import P4Runtime lib from parent utils dir
+# Probably there's a better way of doing this.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 './utils/'))
+import numpy as np
+
+from p4runtime_lib.fib import FibModel, LOOP, follow
+from p4runtime_lib.topology import Topology
+
+from fib_check import desiredTables, liveTables
+from routes import DSCP, TABLES
+
+LINK_DOWN = 'link_down'
+
+# set in every worker by initWorker()
+_failures = None
+
+
+def switchLinks(topo):
+    return sorted(set(tuple(sorted((sw, n), key=lambda s: int(s[1:])))
+                      for sw in topo.sw_ports for n in topo.sw_ports[sw]),
+                  key=lambda l: (int(l[0][1:]), int(l[1][1:])))
+
+
+def initWorker(failures):
+    global _failures
+    _failures = failures
+
+
+def checkDestination(task):
+    """ Resolves one (configuration, destination) next-hop array under
+        every failure. Returns (config, dst id, problems) where problems
+        maps a failure row to the [(switch id, outcome id)] that do not
+        deliver; rows the failure leaves unchanged are left out and share
+        the problems of row 0. """
+    config, dst, next_nodes = task
+    fu, fv, n_sw, link_down, loop = _failures
+    # only failures of links this destination's traffic uses change anything
+    cut_u = next_nodes[fu[1:]] == fv[1:]
+    cut_v = next_nodes[fv[1:]] == fu[1:]
+    changed = np.nonzero(cut_u | cut_v)[0] + 1
+    rows = np.tile(next_nodes, (len(changed) + 1, 1))
+    rows[np.arange(1, len(changed) + 1), fu[changed]] = np.where(
+        cut_u[changed - 1], link_down, next_nodes[fu[changed]])
+    rows[np.arange(1, len(changed) + 1), fv[changed]] = np.where(
+        cut_v[changed - 1], link_down, next_nodes[fv[changed]])
+    reach = follow(rows, n_sw, loop)[:, :n_sw]
+    row_ids = np.concatenate(([0], changed))
+    problems = {}
+    bad_rows, bad_sw = np.nonzero(reach != dst)
+    for r, sw, outcome in zip(bad_rows.tolist(), bad_sw.tolist(),
+                              reach[bad_rows, bad_sw].tolist()):
+        problems.setdefault(int(row_ids[r]), []).append((sw, outcome))
+    return config, dst, row_ids.tolist(), problems
+
+
+def verify(model, configs, processes=None):
+    """ Returns (failures, problems): failures[0] is None (no failure) and
+        the others are switch links; problems maps (config, failure row) to
+        a list of (src host, dst host, outcome). """
+    topo = model.topo
+    nodes = model.node_names() + [LINK_DOWN]
+    node_id = dict((n, i) for i, n in enumerate(nodes))
+    n_sw = len(model.switch_names)
+    failures = [None] + switchLinks(topo)
+    fu = np.array([-1] + [node_id[u] for u, _ in failures[1:]], dtype=np.int32)
+    fv = np.array([-1] + [node_id[v] for _, v in failures[1:]], dtype=np.int32)
+    tasks = []
+    for config in configs:
+        for host in model.host_names:
+            next_nodes = np.append(model.next_hop_array(topo.host_ip(host), DSCP[config]),
+                                   np.int32(node_id[LINK_DOWN]))
+            tasks.append((config, node_id[host], next_nodes))
+
+    shared = (fu, fv, n_sw, node_id[LINK_DOWN], node_id[LOOP])
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        initWorker(shared)
+        results = map(checkDestination, tasks)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=initWorker, initargs=(shared,))
+        results = pool.imap_unordered(checkDestination, tasks, chunksize=8)
+
+    # hosts sending through each switch
+    senders = {}
+    for host in model.host_names:
+        senders.setdefault(node_id[topo.host_switch(host)[0]], []).append(host)
+    problems = {}
+    for config, dst, changed, bad in results:
+        base = bad.get(0, [])
+        changed = set(changed)
+        rows = range(len(failures)) if base else changed
+        for row in rows:
+            for sw, outcome in bad.get(row, [] if row in changed else base):
+                for src in senders.get(sw, []):
+                    problems.setdefault((config, row), []).append((src, nodes[dst], nodes[outcome]))
+    if processes != 1:
+        pool.close()
+        pool.join()
+    return failures, problems
+
+
+def main(args):
+    topo = Topology.from_file(args.topo)
+    if args.live:
+        tables = liveTables(args.p4info, topo, args.switch_ports)
+    else:
+        tables = desiredTables(args.aggregate)
+    model = FibModel(topo, tables, dict((DSCP[c], t) for c, t in TABLES.items()))
+    configs = sorted(TABLES)
+
+    start = time.time()
+    failures, problems = verify(model, configs, args.processes)
+    elapsed = time.time() - start
+    print("Checked %d configurations x %d hosts x %d failure cases in %.3fs" % (
+        len(configs), len(model.host_names), len(failures), elapsed))
+
+    failed = False
+    for config in configs:
+        bad = problems.get((config, 0), [])
+        if bad:
+            failed = True
+            print("Configuration %s fails without any failure:" % config)
+            for src, dst, outcome in bad[:args.max_examples]:
+                print("  %s -> %s: %s" % (src, dst, outcome))
+
+    uncovered = 0
+    for row, link in enumerate(failures):
+        if row == 0:
+            continue
+        # pairs no configuration delivers with the link down
+        lost = None
+        for config in configs:
+            pairs = set((src, dst) for src, dst, _ in problems.get((config, row), []))
+            lost = pairs if lost is None else lost & pairs
+        if not lost:
+            if args.verbose:
+                working = [c for c in configs if not problems.get((c, row))]
+                print("Link %s-%s down: every pair recovers (all pairs: %s)" % (
+                    link[0], link[1], ', '.join(working) or 'no single configuration'))
+            continue
+        uncovered += 1
+        failed = True
+        print("Link %s-%s down: %d host pairs cannot be delivered by any configuration" % (
+            link[0], link[1], len(lost)))
+        for src, dst in sorted(lost)[:args.max_examples]:
+            outcomes = dict((c, o) for c in configs
+                            for s, d, o in problems[(c, row)] if (s, d) == (src, dst))
+            print("  %s -> %s: %s" % (src, dst, ', '.join(
+                '%s %s' % (c, outcomes[c]) for c in configs)))
+    print("%d of %d single link failures recoverable by switching configuration" % (
+        len(failures) - 1 - uncovered, len(failures) - 1))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MRC reachability and loop verifier')
+    parser.add_argument('--topo', help='Topology JSON file used by run_exercise.py',
+                        type=str, action="store", required=False,
+                        default='./topo/topology.json')
+    parser.add_argument('--live', help='verify the tables read from the running switches',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--p4info', help='p4info proto in text format from p4c, for --live',
+                        type=str, action="store", required=False,
+                        default='./build/mrc.p4.p4info.txt')
+    parser.add_argument('--switch-ports', help='ports and device ids of the switches, for --live',
+                        type=str, action="store", required=False,
+                        default='./logs/switches.json')
+    parser.add_argument('--aggregate', help='aggregation applied to routes.py, as in controller.py',
+                        type=str, action="store", required=False, default='exact',
+                        choices=['off', 'exact', 'loose'])
+    parser.add_argument('--processes', help='worker processes (default: one per CPU)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--max-examples', help='counterexamples printed per case',
+                        type=int, action="store", required=False, default=5)
+    parser.add_argument('--verbose', help='also list the recoverable failures',
+                        action="store_true", required=False, default=False)
+    args = parser.parse_args()
+
+    if args.live and not os.path.exists(args.p4info):
+        parser.print_help()
+        print("\np4info file not found: %s\nHave you run 'make'?" % args.p4info)
+        parser.exit(1)
+    sys.exit(main(args))
@@ -0,0 +1,185 @@
+#
+# Routes of the multi routing configuration controller.
+#
+# Each switch has one routing table per configuration: A (ipv4_lpm, DSCP 0),
+# B (ipv4_lpm2, DSCP 4) and C (ipv4_lpm3, DSCP 8). Every table maps
+# (ip, prefix_len) to the (dstAddr, port) parameters of ipv4_forward.
+#
+
+TABLES = {
+    'A': "MyIngress.ipv4_lpm",
+    'B': "MyIngress.ipv4_lpm2",
+    'C': "MyIngress.ipv4_lpm3",
+}
+
+# 配置对应的 DSCP 值
+DSCP = {
+    'A': 0,
+    'B': 4,
+    'C': 8,
+}
+
+ROUTES = {
+    # s1 流规则下发
+    's1': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:11", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:03:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.6.6", 32): ("08:00:00:00:03:01", 2),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:11", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:03:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:03:01", 2),
+            ("10.0.5.5", 32): ("08:00:00:00:03:01", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:03:01", 2),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:11", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:03:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:02:01", 1),
+            ("10.0.6.6", 32): ("08:00:00:00:02:01", 1),
+        },
+    },
+    # s2 流规则下发
+    's2': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:01", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:02:22", 4),
+            ("10.0.3.3", 32): ("08:00:00:00:03:02", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:05:03", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:05:03", 3),
+            ("10.0.6.6", 32): ("08:00:00:00:03:02", 2),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:01", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:02:22", 4),
+            ("10.0.3.3", 32): ("08:00:00:00:03:02", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:03:02", 2),
+            ("10.0.5.5", 32): ("08:00:00:00:03:02", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:03:02", 2),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:01", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:02:22", 4),
+            ("10.0.3.3", 32): ("08:00:00:00:01:01", 1),
+            ("10.0.4.4", 32): ("08:00:00:00:05:03", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:05:03", 3),
+            ("10.0.6.6", 32): ("08:00:00:00:05:03", 3),
+        },
+    },
+    # s3 流规则下发
+    's3': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:02", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:02:02", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:03:33", 4),
+            ("10.0.4.4", 32): ("08:00:00:00:06:03", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:02:02", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:06:03", 3),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:02", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:02:02", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:03:33", 4),
+            ("10.0.4.4", 32): ("08:00:00:00:06:03", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:06:03", 3),
+            ("10.0.6.6", 32): ("08:00:00:00:06:03", 3),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:01:02", 1),
+            ("10.0.2.2", 32): ("08:00:00:00:01:02", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:03:33", 4),
+            ("10.0.4.4", 32): ("08:00:00:00:06:03", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:06:03", 3),
+            ("10.0.6.6", 32): ("08:00:00:00:06:03", 3),
+        },
+    },
+    # s4 流规则下发
+    's4': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.2.2", 32): ("08:00:00:00:05:01", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:44", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:05:01", 1),
+            ("10.0.6.6", 32): ("08:00:00:00:06:01", 2),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.2.2", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:44", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:05:01", 1),
+            ("10.0.6.6", 32): ("08:00:00:00:06:01", 2),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.2.2", 32): ("08:00:00:00:05:01", 1),
+            ("10.0.3.3", 32): ("08:00:00:00:06:01", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:44", 3),
+            ("10.0.5.5", 32): ("08:00:00:00:05:01", 1),
+            ("10.0.6.6", 32): ("08:00:00:00:06:01", 2),
+        },
+    },
+    # s5 流规则下发
+    's5': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:02:03", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:02:03", 3),
+            ("10.0.3.3", 32): ("08:00:00:00:06:02", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:01", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:55", 4),
+            ("10.0.6.6", 32): ("08:00:00:00:06:02", 2),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:06:02", 2),
+            ("10.0.2.2", 32): ("08:00:00:00:06:02", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:06:02", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:01", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:55", 4),
+            ("10.0.6.6", 32): ("08:00:00:00:06:02", 2),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:02:03", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:02:03", 3),
+            ("10.0.3.3", 32): ("08:00:00:00:06:02", 2),
+            ("10.0.4.4", 32): ("08:00:00:00:04:01", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:55", 4),
+            ("10.0.6.6", 32): ("08:00:00:00:06:02", 2),
+        },
+    },
+    # s6 流规则下发
+    's6': {
+        'A': {
+            ("10.0.1.1", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:05:02", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.4.4", 32): ("08:00:00:00:04:02", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:02", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:06:66", 4),
+        },
+        'B': {
+            ("10.0.1.1", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.3.3", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.4.4", 32): ("08:00:00:00:04:02", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:02", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:06:66", 4),
+        },
+        'C': {
+            ("10.0.1.1", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.2.2", 32): ("08:00:00:00:05:02", 2),
+            ("10.0.3.3", 32): ("08:00:00:00:03:03", 3),
+            ("10.0.4.4", 32): ("08:00:00:00:04:02", 1),
+            ("10.0.5.5", 32): ("08:00:00:00:05:02", 2),
+            ("10.0.6.6", 32): ("08:00:00:00:06:66", 4),
+        },
+    },
+}
@@ -0,0 +1,156 @@
+#
+# Collision-free allocation of switch ports and device ids.
+#
+# Every port or device id handed out is reserved by holding an exclusive
+# flock on a lock file named after it (P4_ALLOC_DIR, default /tmp/p4-alloc).
+# The locks belong to the process and go away with it, however it ends, so
+# exercises running side by side never get the same gRPC or Thrift port,
+# device id or nanomsg socket (named after the device id), and nothing has
+# to be cleaned up after a crash. Ports are also probed with a bind, which
+# catches programs that do not use the lock files; nothing enumerates the
+# sockets of the whole system.
+#
+import errno
+import fcntl
+import json
+import os
+import socket
+import threading
+
+DEFAULT_LOCK_DIR = '/tmp/p4-alloc'
+GRPC_BASE_PORT = 50051
+THRIFT_BASE_PORT = 9090
+MAX_PORT = 65535
+MAX_DEVICE_ID = 1 << 16
+
+
+def port_free(port, host='0.0.0.0'):
+    """ True if a TCP socket can be bound to `port` right now. """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        # ignores connections of an earlier switch lingering in TIME_WAIT,
+        # but not a listening socket
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        probe.bind((host, port))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class Allocator(object):
+    """ Hands out the lowest free port or device id at or above a base,
+        each kind continuing from where it left off. """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir or os.environ.get('P4_ALLOC_DIR') or DEFAULT_LOCK_DIR
+        self.lock = threading.Lock()
+        self.held = {}
+        self.cursors = {}
+
+    def _try_lock(self, name):
+        if not os.path.isdir(self.lock_dir):
+            try:
+                os.makedirs(self.lock_dir)
+                # shared by every user that runs exercises
+                os.chmod(self.lock_dir, 0o1777)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd = os.open(os.path.join(self.lock_dir, name), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.held[name] = fd
+        return True
+
+    def _allocate(self, kind, base, limit, usable=None):
+        with self.lock:
+            value = max(base, self.cursors.get((kind, base), base))
+            while value <= limit:
+                name = '%s-%d' % (kind, value)
+                if name not in self.held and self._try_lock(name):
+                    if usable is None or usable(value):
+                        self.cursors[(kind, base)] = value + 1
+                        return value
+                    self.release(kind, value)
+                value += 1
+        raise RuntimeError('no free %s at or above %d' % (kind, base))
+
+    def port(self, base):
+        """ Reserves a TCP port >= `base`. """
+        return self._allocate('port', base, MAX_PORT, port_free)
+
+    def port_range(self, count, base):
+        """ Reserves `count` consecutive TCP ports >= `base` and returns the
+            first one. """
+        with self.lock:
+            first = base
+            while first + count - 1 <= MAX_PORT:
+                reserved = []
+                for port in range(first, first + count):
+                    name = 'port-%d' % port
+                    if name in self.held or not self._try_lock(name):
+                        break
+                    reserved.append(port)
+                    if not port_free(port):
+                        break
+                else:
+                    return first
+                for taken in reserved:
+                    self.release('port', taken)
+                # no range containing the port that failed can work
+                first = port + 1
+        raise RuntimeError('no %d free consecutive ports at or above %d' % (count, base))
+
+    def reserve(self, kind, value):
+        """ Reserves a value chosen by the caller, e.g. a port given on the
+            command line. Returns False if someone else holds it. """
+        with self.lock:
+            name = '%s-%d' % (kind, value)
+            return name in self.held or self._try_lock(name)
+
+    def device_id(self, base=0):
+        """ Reserves a device id >= `base`. """
+        return self._allocate('device', base, MAX_DEVICE_ID)
+
+    def release(self, kind, value):
+        fd = self.held.pop('%s-%d' % (kind, value), None)
+        if fd is not None:
+            os.close(fd)
+
+    def release_all(self):
+        with self.lock:
+            for fd in self.held.values():
+                os.close(fd)
+            self.held = {}
+            self.cursors = {}
+
+
+# shared by all switches of the process
+ALLOCATOR = Allocator()
+
+
+def write_switch_ports(path, switches):
+    """ Records the ports and device ids given to Mininet `switches`, so
+        that controllers can find the switches of a run that did not get
+        the default ones. """
+    ports = {}
+    for sw in switches:
+        ports[sw.name] = dict((key, getattr(sw, key)) for key in
+                              ('grpc_port', 'thrift_port', 'device_id')
+                              if getattr(sw, key, None) is not None)
+    with open(path, 'w') as f:
+        json.dump(ports, f, indent=2, sort_keys=True)
+
+
+def read_switch_ports(path):
+    """ The {switch: {'grpc_port', 'thrift_port', 'device_id'}} written by
+        write_switch_ports(), or {} if there is no such file. """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
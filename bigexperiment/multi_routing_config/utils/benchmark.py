@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+#
+# Controller stack benchmarks against fake P4Runtime switches.
+#
+# The switches are p4runtime_lib.fake_server instances running in this
+# process, so neither BMv2 nor p4c is needed for the micro benchmarks: they
+# use a generated p4info. Controller startup is measured for every exercise
+# controller whose build/ output exists, with the controller in its own
+# process talking to fake switches on the usual 5005x ports.
+#
+# Cold import times are taken from `python -X importtime` in a fresh
+# process per module, which also tells whether grpc got imported.
+#
+# Results are written as JSON; with --baseline, a previous result file,
+# the run fails when a metric got worse by more than --tolerance.
+#
+import argparse
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# grpc and protobuf are imported where needed, so --imports-only runs
+# without them
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.normpath(os.path.join(UTILS_DIR, '../../..'))
+
+TABLE = "MyIngress.ipv4_lpm"
+ACTION = "MyIngress.ipv4_forward"
+
+# (name, script relative to the repository, p4 program name)
+CONTROLLERS = [
+    ('ex2-tunnel', 'ex2/mycontroller.py', 'advanced_tunnel'),
+    ('ex2-tunnel-all', 'ex2/mycontroller_all.py', 'advanced_tunnel'),
+    ('ex3-ecn', 'ex3/ecnruntime/mycontroller.py', 'ecn'),
+    ('ex3-mri', 'ex3/mriruntime/mycontroller.py', 'mri'),
+    ('ex4-loadbalance', 'ex4/loadbalanceruntime/controller.py', 'load_balance'),
+    ('ex4-qos', 'ex4/qosruntime/controller.py', 'qos'),
+    ('ex5-firewall', 'ex5/firewallruntime/controller.py', 'firewall'),
+    ('mrc', 'bigexperiment/multi_routing_config/controller.py', 'mrc'),
+]
+
+# (module, whether it may import grpc)
+IMPORTS = [
+    ('p4runtime_lib', False),
+    ('p4runtime_lib.simple_controller', False),
+    ('p4runtime_lib.runtime_bin', False),
+    ('p4runtime_lib.aggregate', False),
+    ('p4runtime_lib.fib', False),
+    ('p4runtime_lib.helper', False),
+    ('p4runtime_lib.bmv2', True),
+]
+
+
+def writeP4Info(path, extra_tables):
+    """ Writes a text p4info with the LPM table used by the benchmarks and
+        `extra_tables` more, so that the load time is representative. """
+    import google.protobuf.text_format
+    from p4.config.v1 import p4info_pb2
+
+    p4info = p4info_pb2.P4Info()
+    action = p4info.actions.add()
+    action.preamble.id = 16799317
+    action.preamble.name = ACTION
+    action.preamble.alias = "ipv4_forward"
+    for i, (name, bitwidth) in enumerate((("dstAddr", 48), ("port", 9))):
+        param = action.params.add()
+        param.id = i + 1
+        param.name = name
+        param.bitwidth = bitwidth
+    for n in range(extra_tables + 1):
+        table = p4info.tables.add()
+        table.preamble.id = 33574068 + n
+        table.preamble.name = TABLE if n == 0 else "MyIngress.table_%d" % n
+        table.preamble.alias = table.preamble.name.split('.')[-1]
+        field = table.match_fields.add()
+        field.id = 1
+        field.name = "hdr.ipv4.dstAddr"
+        field.bitwidth = 32
+        field.match_type = p4info_pb2.MatchField.LPM
+        table.action_refs.add().id = action.preamble.id
+        table.size = 1024
+    with open(path, 'w') as f:
+        f.write(google.protobuf.text_format.MessageToString(p4info))
+
+
+def routeEntries(p4info_helper, count):
+    for i in range(count):
+        yield p4info_helper.buildTableEntry(
+            table_name=TABLE,
+            match_fields={"hdr.ipv4.dstAddr": ("10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255), 32)},
+            action_name=ACTION,
+            action_params={"dstAddr": "08:00:00:00:01:11", "port": i % 8 + 1})
+
+
+def timed(function, repeat=1):
+    """ Best of `repeat` runs, in seconds, and the last result. """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def record(results, name, value, unit, higher_is_better, **extra):
+    results[name] = dict(value=value, unit=unit, higher_is_better=higher_is_better, **extra)
+    print("  %-42s %12.2f %s" % (name, value, unit))
+
+
+def importTime(module, env):
+    """ Cumulative import time of `module` in microseconds and the set of
+        top-level packages imported along with it. """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          check=True)
+    cumulative = None
+    packages = set()
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative = int(total)
+    return cumulative, packages
+
+
+def importBenchmarks(args, results):
+    """ Returns the modules that imported grpc although they should not. """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([UTILS_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    violations = []
+    for module, grpc_allowed in IMPORTS:
+        try:
+            # the first run may write .pyc files, keep the best of the others
+            runs = [importTime(module, env) for _ in range(args.import_runs + 1)][1:]
+        except subprocess.CalledProcessError as e:
+            print("  %-42s failed: %s" % ('import_' + module, e.stderr.decode().strip()[-200:]))
+            continue
+        best = min(us for us, _ in runs)
+        imports_grpc = 'grpc' in runs[0][1]
+        record(results, 'import_' + module, best / 1000.0, 'ms', False, imports_grpc=imports_grpc)
+        if imports_grpc and not grpc_allowed:
+            violations.append(module)
+    return violations
+
+
+def microBenchmarks(args, workdir, results):
+    import p4runtime_lib.bmv2
+    import p4runtime_lib.helper
+    from p4runtime_lib.fake_server import FakeSwitchServer
+    from p4runtime_lib.switch import ShutdownAllSwitchConnections, connections
+
+    p4info_path = os.path.join(workdir, 'bench.p4info.txt')
+    bmv2_json_path = os.path.join(workdir, 'bench.json')
+    writeP4Info(p4info_path, args.extra_tables)
+    with open(bmv2_json_path, 'w') as f:
+        f.write('{}')
+
+    elapsed, p4info_helper = timed(lambda: p4runtime_lib.helper.P4InfoHelper(p4info_path), 5)
+    record(results, 'p4info_load', elapsed * 1000, 'ms', False, tables=args.extra_tables + 1)
+
+    n = args.entries
+    elapsed, _ = timed(lambda: sum(1 for _ in routeEntries(p4info_helper, n)), 3)
+    record(results, 'build_table_entry', n / elapsed, 'entries/s', True, n=n)
+
+    server = FakeSwitchServer(latency=args.latency).start()
+    try:
+        sw = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            name='bench', address=server.address, device_id=0)
+        sw.MasterArbitrationUpdate()
+        elapsed, _ = timed(lambda: sw.SetForwardingPipelineConfig(
+            p4info=p4info_helper.p4info, bmv2_json_file_path=bmv2_json_path))
+        record(results, 'set_pipeline_config', elapsed * 1000, 'ms', False)
+
+        # entries are built first so that only the RPCs are timed
+        single = list(routeEntries(p4info_helper, args.single_entries))
+        elapsed, _ = timed(lambda: [sw.WriteTableEntry(e) for e in single])
+        record(results, 'write_table_entry', len(single) / elapsed, 'entries/s', True,
+               n=len(single))
+
+        sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                       bmv2_json_file_path=bmv2_json_path)
+        entries = list(routeEntries(p4info_helper, n))
+        elapsed, _ = timed(lambda: sw.WriteTableEntries(entries, batch_size=args.batch_size))
+        record(results, 'write_table_entries_batch', n / elapsed, 'entries/s', True,
+               n=n, batch_size=args.batch_size)
+
+        table_id = p4info_helper.get_tables_id(TABLE)
+        elapsed, read = timed(lambda: sum(len(r.entities) for r in sw.ReadTableEntries(table_id)), 3)
+        if read != n:
+            raise AssertionError("read back %d entries, wrote %d" % (read, n))
+        record(results, 'read_table_entries', n / elapsed, 'entries/s', True, n=n)
+    finally:
+        ShutdownAllSwitchConnections()
+        del connections[:]
+        server.stop()
+
+
+def controllerStartup(args, results):
+    """ Time from launching each controller until its last RPC. Controllers
+        that keep running (e.g. to poll counters) are stopped once the
+        switches have been idle for --idle seconds. """
+    from p4runtime_lib.fake_server import start_fake_switches
+
+    servers = start_fake_switches(args.switches, latency=args.latency)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([UTILS_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    try:
+        for name, script, program in CONTROLLERS:
+            if args.controllers and name not in args.controllers:
+                continue
+            script_dir = os.path.dirname(os.path.join(REPO_DIR, script))
+            p4info = os.path.join(script_dir, 'build', '%s.p4.p4info.txt' % program)
+            bmv2_json = os.path.join(script_dir, 'build', '%s.json' % program)
+            if not os.path.exists(p4info) or not os.path.exists(bmv2_json):
+                print("  %-42s skipped, run 'make' in %s first" % (
+                    'startup_' + name, os.path.relpath(script_dir, REPO_DIR)))
+                continue
+            if not os.path.isdir(os.path.join(script_dir, 'logs')):
+                os.mkdir(os.path.join(script_dir, 'logs'))
+            for server in servers:
+                server.servicer.last_rpc = None
+            start = time.time()
+            proc = subprocess.Popen([sys.executable, os.path.basename(script),
+                                     '--p4info', p4info, '--bmv2-json', bmv2_json],
+                                    cwd=script_dir, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            while proc.poll() is None:
+                time.sleep(0.05)
+                last = max([s.servicer.last_rpc or start for s in servers])
+                if time.time() - last > args.idle:
+                    proc.send_signal(signal.SIGINT)
+                    break
+            _, stderr = proc.communicate()
+            last = max([s.servicer.last_rpc or start for s in servers])
+            if proc.returncode not in (0, -signal.SIGINT):
+                print("  %-42s failed: %s" % ('startup_' + name, stderr.decode().strip()[-200:]))
+                continue
+            record(results, 'startup_' + name, (last - start) * 1000, 'ms', False,
+                   entries=sum(s.servicer.entry_count() for s in servers))
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def compare(results, baseline, tolerance):
+    """ Returns the metrics worse than in `baseline` by more than
+        `tolerance` (a fraction). """
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None or not old['value']:
+            continue
+        change = (result['value'] - old['value']) / old['value']
+        if result['higher_is_better']:
+            change = -change
+        if change > tolerance:
+            regressions.append((name, old['value'], result['value'], result['unit']))
+    return regressions
+
+
+def main(args):
+    results = {}
+    print("Cold imports (python -X importtime):")
+    violations = importBenchmarks(args, results)
+    for module in violations:
+        print("REGRESSION %s imports grpc" % module)
+    if args.imports_only:
+        return writeReport(args, results, violations)
+
+    print("Micro benchmarks (fake switch latency %.1f ms):" % (args.latency * 1000))
+    workdir = tempfile.mkdtemp(prefix='p4bench-')
+    try:
+        microBenchmarks(args, workdir, results)
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+    if args.switches:
+        print("Controller startup:")
+        controllerStartup(args, results)
+    return writeReport(args, results, violations)
+
+
+def writeReport(args, results, violations):
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'baseline')),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Results written to %s" % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, unit in regressions:
+            print("REGRESSION %s: %.2f -> %.2f %s" % (name, old, new, unit))
+        if regressions:
+            return 1
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='P4Runtime controller benchmarks')
+    parser.add_argument('--output', help='JSON file the results are written to',
+                        type=str, action="store", required=False, default='benchmark.json')
+    parser.add_argument('--baseline', help='earlier results to compare against',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--tolerance', help='allowed slowdown against the baseline, as a fraction',
+                        type=float, action="store", required=False, default=0.2)
+    parser.add_argument('--latency', help='seconds each fake switch sleeps per RPC',
+                        type=float, action="store", required=False, default=0.0)
+    parser.add_argument('--entries', help='table entries built, written in batches and read back',
+                        type=int, action="store", required=False, default=20000)
+    parser.add_argument('--single-entries', help='table entries written one RPC at a time',
+                        type=int, action="store", required=False, default=1000)
+    parser.add_argument('--batch-size', help='updates per WriteRequest for the batch benchmark',
+                        type=int, action="store", required=False, default=1024)
+    parser.add_argument('--extra-tables', help='tables added to the generated p4info',
+                        type=int, action="store", required=False, default=50)
+    parser.add_argument('--switches', help='fake switches started for the controllers, 0 to skip them',
+                        type=int, action="store", required=False, default=8)
+    parser.add_argument('--controllers', help='only these controllers (default: all)',
+                        type=str, nargs='*', required=False, default=None)
+    parser.add_argument('--import-runs', help='fresh interpreters per import measurement',
+                        type=int, action="store", required=False, default=3)
+    parser.add_argument('--imports-only', help='only measure import times',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--idle', help='seconds without RPCs after which a controller is done',
+                        type=float, action="store", required=False, default=1.0)
+    args = parser.parse_args()
+    sys.exit(main(args))
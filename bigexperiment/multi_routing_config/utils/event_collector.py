@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# BMv2 event log collector.
+#
+# Subscribes to the nanomsg event log of every switch of a run
+# (--nanolog, see p4runtime_lib.eventlog) and keeps per-table hit and miss
+# counts, per-action counts and packet latency percentiles in memory, so
+# that switches can run without --log-console (run_exercise.py
+# --no-log-console) in performance runs and still be watched. The figures
+# are printed periodically and served as JSON over HTTP on localhost; with
+# --trace, the events of a sample of the packets are written as JSON lines.
+#
+import argparse
+import sys
+import threading
+import time
+
+from allocator import read_switch_ports
+from p4runtime_lib.eventlog import EventLogCollector, event_address, program_names, subscribe
+from p4runtime_lib.http_api import serve
+
+
+def addresses(args):
+    if args.address:
+        return args.address
+    switch_ports = read_switch_ports(args.switch_ports)
+    return [event_address(ports['device_id'])
+            for _, ports in sorted(switch_ports.items()) if 'device_id' in ports]
+
+
+def main(args):
+    sources = addresses(args)
+    if not sources:
+        print("No switches in %s, is the exercise running?" % args.switch_ports)
+        return 1
+    tables, actions = program_names(args.switch_json) if args.switch_json else ({}, {})
+    trace = open(args.trace, 'w') if args.trace else None
+    collector = EventLogCollector(tables, actions, trace, args.sample)
+    if args.http_port:
+        serve({'/': collector.snapshot}, args.http_port)
+        print("Serving event figures on http://127.0.0.1:%d/" % args.http_port)
+
+    deadline = time.time() + args.duration if args.duration else None
+
+    def report():
+        while True:
+            time.sleep(args.interval)
+            collector.print_summary()
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    print("Subscribed to %s" % ' '.join(sources))
+    try:
+        collector.run(subscribe(sources, stop=lambda: deadline and time.time() > deadline))
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    finally:
+        if trace is not None:
+            trace.close()
+    collector.print_summary()
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BMv2 event log collector')
+    parser.add_argument('--switch-ports', help='switches.json written by run_exercise.py, '
+                        'for the device id, and so the event socket, of every switch',
+                        type=str, action="store", default='logs/switches.json')
+    parser.add_argument('-a', '--address', help='event socket to subscribe to instead '
+                        '(e.g. ipc:///tmp/bm-0-log.ipc); may be repeated',
+                        type=str, action="append", default=None)
+    parser.add_argument('-j', '--switch-json', help='BMv2 JSON of the program, for table and action names',
+                        type=str, action="store", default=None)
+    parser.add_argument('--trace', help='write the events of sampled packets to this file',
+                        type=str, action="store", default=None)
+    parser.add_argument('--sample', help='trace one packet in SAMPLE (by packet id)',
+                        type=int, action="store", default=100)
+    parser.add_argument('--http-port', help='serve figures on this localhost port (0 disables)',
+                        type=int, action="store", default=0)
+    parser.add_argument('--interval', help='seconds between printed summaries',
+                        type=float, action="store", default=5.0)
+    parser.add_argument('--duration', help='stop after this many seconds (0: until interrupted)',
+                        type=float, action="store", default=0)
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Persistent exercise sessions.
+#
+# `run_exercise.py --session SOCKET` brings the network up once and then,
+# instead of the Mininet CLI, serves requests on a Unix socket. The
+# switches and hosts stay up between requests: `reload` pushes the
+# (recompiled) pipeline to every switch with SetForwardingPipelineConfig,
+# deletes the remaining table entries and installs the runtime rules again,
+# which takes about a second where a new run takes tens of seconds.
+#
+# Requests and replies are one JSON object per line. This file is also the
+# client:
+#
+#   exercise_session.py SOCKET status
+#   exercise_session.py SOCKET reload [-j build/x.json] [--p4info build/x.p4.p4info.txt]
+#   exercise_session.py SOCKET host h1 ping -c 1 10.0.2.2
+#   exercise_session.py SOCKET stop
+#
+import contextlib
+import io
+import json
+import os
+import shlex
+import socket
+import sys
+import time
+import traceback
+
+COMMANDS = ('status', 'reload', 'host', 'stop')
+# seconds a client may take to send its request or read the reply
+CLIENT_TIMEOUT = 10
+
+
+class SessionServer(object):
+    """ Serves the requests of session clients for an ExerciseRunner whose
+        network is up. Requests are handled one at a time in the calling
+        thread, the one that owns the Mininet nodes. """
+
+    def __init__(self, runner, path):
+        self.runner = runner
+        self.path = path
+        self.started = time.time()
+        self.reloads = 0
+        self.running = False
+
+    def serve(self):
+        """ Handles requests until a client sends `stop`. """
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.path)
+            os.chmod(self.path, 0o660)
+            server.listen(4)
+            self.running = True
+            while self.running:
+                conn, _ = server.accept()
+                # a stalled client must not hold up the others, or stop
+                conn.settimeout(CLIENT_TIMEOUT)
+                try:
+                    with conn, conn.makefile('rwb') as stream:
+                        line = stream.readline()
+                        if line:
+                            reply = self.handle(line)
+                            stream.write(json.dumps(reply).encode('utf-8') + b'\n')
+                except OSError as e:
+                    # timed out, or the client went away
+                    print("Session client dropped: %s" % e)
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, line):
+        start = time.time()
+        output = io.StringIO()
+        try:
+            request = json.loads(line.decode('utf-8'))
+            command = request.pop('command', None)
+            if command not in COMMANDS:
+                raise ValueError('unknown command %r, expected one of %s'
+                                 % (command, ', '.join(COMMANDS)))
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                result = getattr(self, 'do_' + command)(**request)
+            reply = {'ok': True, 'result': result}
+        except Exception as e:
+            traceback.print_exc(file=output)
+            reply = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+        reply['output'] = output.getvalue()
+        reply['elapsed'] = time.time() - start
+        return reply
+
+    def do_status(self):
+        return {
+            'switches': len(self.runner.switches),
+            'hosts': len(self.runner.hosts),
+            'switch_json': self.runner.switch_json,
+            'uptime': time.time() - self.started,
+            'reloads': self.reloads,
+        }
+
+    def do_reload(self, switch_json=None, p4info=None):
+        self.runner.reload(switch_json, p4info)
+        self.reloads += 1
+        return {'switches': len(self.runner.switches)}
+
+    def do_host(self, host, cmd):
+        node = self.runner.net.get(host)
+        if node is None:
+            raise ValueError('no host %s' % host)
+        return node.cmd(cmd)
+
+    def do_stop(self):
+        self.running = False
+        return None
+
+
+def request(path, command, timeout=None, **args):
+    """ Sends one request to the session at `path` and returns the reply. """
+    args['command'] = command
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    with client:
+        client.connect(path)
+        with client.makefile('rwb') as stream:
+            stream.write(json.dumps(args).encode('utf-8') + b'\n')
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise IOError('session %s closed the connection' % path)
+    return json.loads(line.decode('utf-8'))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Send a command to a running exercise session')
+    parser.add_argument('socket', help='session socket given to run_exercise.py --session',
+                        type=str)
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    commands.add_parser('status', help='network size, uptime and reload count')
+    reload_parser = commands.add_parser('reload', help='push the pipeline and rules again')
+    reload_parser.add_argument('-j', '--switch-json', help='BMv2 JSON to push instead of the current one',
+                               type=str, action="store", required=False, default=None)
+    reload_parser.add_argument('--p4info', help='p4info of that JSON (default: next to it)',
+                               type=str, action="store", required=False, default=None)
+    host_parser = commands.add_parser('host', help='run a shell command on a host')
+    host_parser.add_argument('host', help='host name', type=str)
+    host_parser.add_argument('cmd', help='command and its arguments',
+                             type=str, nargs=argparse.REMAINDER)
+    commands.add_parser('stop', help='tear the network down and end the session')
+    args = parser.parse_args()
+
+    params = {}
+    if args.command == 'reload':
+        if args.switch_json:
+            params['switch_json'] = os.path.abspath(args.switch_json)
+        if args.p4info:
+            params['p4info'] = os.path.abspath(args.p4info)
+    elif args.command == 'host':
+        if not args.cmd:
+            parser.error('host needs a command')
+        params['host'] = args.host
+        params['cmd'] = shlex.join(args.cmd)
+
+    reply = request(args.socket, args.command, **params)
+    sys.stdout.write(reply['output'])
+    if not reply['ok']:
+        print(reply['error'], file=sys.stderr)
+        return 1
+    result = reply['result']
+    if isinstance(result, str):
+        sys.stdout.write(result)
+    elif result is not None:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    print('%s done in %.2fs' % (args.command, reply['elapsed']), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,7 @@
+import os
+import shutil
 import subprocess
+import tempfile
 
 from shortest_path import ShortestPath
 
@@ -52,42 +55,7 @@ class AppController:
             #    'table_set_default forward _drop',
             #    'table_set_default ipv4_lpm _drop']
 
-        for host_name in self.topo._host_links:
-            h = self.net.get(host_name)
-            for link in list(self.topo._host_links[host_name].values()):
-                sw = link['sw']
-                #entries[sw].append('table_add send_frame rewrite_mac %d => %s' % (link['sw_port'], link['sw_mac']))
-                #entries[sw].append('table_add forward set_dmac %s => %s' % (link['host_ip'], link['host_mac']))
-                #entries[sw].append('table_add ipv4_lpm set_nhop %s/32 => %s %d' % (link['host_ip'], link['host_ip'], link['sw_port']))
-                iface = h.intfNames()[link['idx']]
-                # use mininet to set ip and mac to let it know the change
-                h.setIP(link['host_ip'], 24)
-                h.setMAC(link['host_mac'])
-                #h.cmd('ifconfig %s %s hw ether %s' % (iface, link['host_ip'], link['host_mac']))
-                h.cmd('arp -i %s -s %s %s' % (iface, link['sw_ip'], link['sw_mac']))
-                h.cmd('ethtool --offload %s rx off tx off' % iface)
-                h.cmd('ip route add %s dev %s' % (link['sw_ip'], iface))
-            h.setDefaultRoute("via %s" % link['sw_ip'])
-
-        for h in self.net.hosts:
-            h_link = list(self.topo._host_links[h.name].values())[0]
-            for sw in self.net.switches:
-                path = shortestpath.get(sw.name, h.name, exclude=lambda n: n[0]=='h')
-                if not path: continue
-                if not path[1][0] == 's': continue # next hop is a switch
-                sw_link = self.topo._sw_links[sw.name][path[1]]
-                #entries[sw.name].append('table_add send_frame rewrite_mac %d => %s' % (sw_link[0]['port'], sw_link[0]['mac']))
-                #entries[sw.name].append('table_add forward set_dmac %s => %s' % (h_link['host_ip'], sw_link[1]['mac']))
-                #entries[sw.name].append('table_add ipv4_lpm set_nhop %s/32 => %s %d' % (h_link['host_ip'], h_link['host_ip'], sw_link[0]['port']))
-
-            for h2 in self.net.hosts:
-                if h == h2: continue
-                path = shortestpath.get(h.name, h2.name, exclude=lambda n: n[0]=='h')
-                if not path: continue
-                h_link = self.topo._host_links[h.name][path[1]]
-                h2_link = list(self.topo._host_links[h2.name].values())[0]
-                h.cmd('ip route add %s via %s' % (h2_link['host_ip'], h_link['sw_ip']))
-
+        self.configure_hosts(shortestpath)
 
         print("**********")
         print("Configuring entries in p4 tables")
@@ -100,5 +68,56 @@ class AppController:
         print("Configuration complete.")
         print("**********")
 
+    def host_batch(self, h, next_hops):
+        """ Returns the `ip -batch` lines that set up host `h`: addresses,
+            static ARP entries and a route to every other host through the
+            first switch of a shortest path, read from `next_hops`
+            (destination host -> ShortestPath.nextHops()). """
+        lines = []
+        links = list(self.topo._host_links[h.name].values())
+        for link in links:
+            iface = h.intfNames()[link['idx']]
+            # keep mininet's view of the interface in sync, as setIP/setMAC would
+            intf = h.intf(iface)
+            intf.ip, intf.prefixLen, intf.mac = link['host_ip'], 24, link['host_mac']
+            lines.append('addr flush dev %s' % iface)
+            lines.append('addr add %s/24 dev %s' % (link['host_ip'], iface))
+            lines.append('link set dev %s address %s' % (iface, link['host_mac']))
+            lines.append('neigh replace %s lladdr %s dev %s nud permanent' % (link['sw_ip'], link['sw_mac'], iface))
+            lines.append('route replace %s dev %s' % (link['sw_ip'], iface))
+        lines.append('route replace default via %s' % links[-1]['sw_ip'])
+
+        for h2 in self.net.hosts:
+            if h == h2: continue
+            first_sw = next_hops[h2.name].get(h.name)
+            if first_sw is None: continue
+            h_link = self.topo._host_links[h.name][first_sw]
+            h2_link = list(self.topo._host_links[h2.name].values())[0]
+            lines.append('route replace %s via %s' % (h2_link['host_ip'], h_link['sw_ip']))
+        return lines
+
+    def configure_hosts(self, shortestpath):
+        """ Writes one batch file per host and applies all of them at once,
+            one shell round trip per host, instead of a command per route. """
+        is_host = lambda n: n[0] == 'h'
+        # all-pairs next hops, one breadth-first search per destination host
+        next_hops = dict((h.name, shortestpath.nextHops(h.name, exclude=is_host))
+                         for h in self.net.hosts)
+        batch_dir = tempfile.mkdtemp(prefix='p4app-hosts-')
+        try:
+            for h in self.net.hosts:
+                batch_file = os.path.join(batch_dir, '%s.batch' % h.name)
+                with open(batch_file, 'w') as f:
+                    f.write('\n'.join(self.host_batch(h, next_hops)) + '\n')
+                offload = ' ; '.join('ethtool --offload %s rx off tx off >/dev/null' % iface
+                                     for iface in h.intfNames() if iface != 'lo')
+                h.sendCmd('ip -force -batch %s 2>&1 ; %s' % (batch_file, offload))
+            errors = [(h.name, h.waitOutput().strip()) for h in self.net.hosts]
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        for host_name, output in errors:
+            if output:
+                print('%s: %s' % (host_name, output))
+
     def stop(self):
         pass
@@ -1,3 +1,5 @@
+from collections import deque
+
 class ShortestPath:
 
     def __init__(self, edges=[]):
@@ -16,6 +18,21 @@ class ShortestPath:
         # Shortest path from a to b
         return self._recPath(a, b, [], exclude)
 
+    def nextHops(self, b, exclude=lambda node: False):
+        # Next hop towards b of every node that can reach it, from a single
+        # breadth-first search, so the hops of all sources come at once.
+        # Nodes for which exclude() holds are reached but not passed through.
+        hops = {b: None}
+        queue = deque([b])
+        while queue:
+            node = queue.popleft()
+            for neighbor in self.neighbors.get(node, []):
+                if neighbor in hops: continue
+                hops[neighbor] = node
+                if not exclude(neighbor):
+                    queue.append(neighbor)
+        return hops
+
     def _recPath(self, a, b, visited, exclude):
         if a == b: return [a]
         new_visited = visited + [a]
@@ -76,3 +93,14 @@ if __name__ == '__main__':
     assert sp.get(1, 7) == None
     assert sp.get(7, 2) == None
 
+    for a in range(1, 9):
+        for b in range(1, 9):
+            path = sp.get(a, b)
+            hops = sp.nextHops(b)
+            if path is None:
+                assert a not in hops
+                continue
+            hop_path = [a]
+            while hop_path[-1] != b: hop_path.append(hops[hop_path[-1]])
+            assert len(hop_path) == len(path)
+
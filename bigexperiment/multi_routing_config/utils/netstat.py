@@ -13,9 +13,13 @@
 # limitations under the License.
 #
 
-import psutil
-def check_listening_on_port(port):
-    for c in psutil.net_connections(kind='inet'):
-        if c.status == 'LISTEN' and c.laddr[1] == port:
-            return True
-    return False
+import socket
+
+def check_listening_on_port(port, host='127.0.0.1'):
+    """ True if something accepts TCP connections on `port`. Probes the one
+        port instead of enumerating every socket of the system. """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        return probe.connect_ex((host, port)) == 0
+    finally:
+        probe.close()
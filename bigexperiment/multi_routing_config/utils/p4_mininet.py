@@ -19,31 +19,82 @@ from mininet.log import setLogLevel, info, error, debug
 from mininet.moduledeps import pathCheck
 from sys import exit
 import os
+import re
+import signal
+import subprocess
 import tempfile
 import socket
+import time
 from time import sleep
 
 from netstat import check_listening_on_port
+from allocator import ALLOCATOR, THRIFT_BASE_PORT
 
 SWITCH_START_TIMEOUT = 10 # seconds
+SWITCH_STOP_TIMEOUT = 2 # seconds, before switches are killed
+
+# printed by a host script for each command that failed
+FAILED_MARK = '__p4host_failed__'
+
+HOST_SETUP_COMMANDS = ["/sbin/ethtool --offload eth0 %s off" % off for off in ["rx", "tx", "sg"]] + [
+    # disable IPv6
+    "sysctl -w net.ipv6.conf.all.disable_ipv6=1",
+    "sysctl -w net.ipv6.conf.default.disable_ipv6=1",
+    "sysctl -w net.ipv6.conf.lo.disable_ipv6=1",
+]
+
+def host_script(commands):
+    """ Joins shell commands into one command line, so that a host runs
+        them all in a single round trip through its shell. Each command
+        that fails prints its index and exit status, see script_failures().
+    """
+    parts = []
+    for n, command in enumerate(commands):
+        command = command.strip().rstrip(';').rstrip()
+        # a trailing & already terminates the command inside the braces
+        end = ' ' if command.endswith('&') else '; '
+        parts.append('{ %s%s} || echo "%s %d $?"' % (command, end, FAILED_MARK, n))
+    return '; '.join(parts)
+
+def script_failures(commands, output):
+    """ [(command, exit status)] of the commands of host_script(commands)
+        that failed, read from the script's output. """
+    failures = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == FAILED_MARK:
+            failures.append((commands[int(fields[1])], int(fields[2])))
+    return failures
 
 class P4Host(Host):
+    setup_commands = HOST_SETUP_COMMANDS
+
     def config(self, **params):
         r = super(Host, self).config(**params)
 
         self.defaultIntf().rename("eth0")
 
-        for off in ["rx", "tx", "sg"]:
-            cmd = "/sbin/ethtool --offload eth0 %s off" % off
-            self.cmd(cmd)
-
-        # disable IPv6
-        self.cmd("sysctl -w net.ipv6.conf.all.disable_ipv6=1")
-        self.cmd("sysctl -w net.ipv6.conf.default.disable_ipv6=1")
-        self.cmd("sysctl -w net.ipv6.conf.lo.disable_ipv6=1")
+        # Sent without waiting for the output, so that the hosts set
+        # themselves up while Mininet configures the next one. The output is
+        # collected before the next command (sendCmd) or by finish_setup().
+        self.setup_failures = []
+        self.sendCmd(host_script(self.setup_commands))
+        self.setup_pending = True
 
         return r
 
+    def finish_setup(self):
+        """ Waits for the setup commands sent by config() and returns the
+            [(command, exit status)] of those that failed. """
+        if getattr(self, 'setup_pending', False):
+            self.setup_pending = False
+            self.setup_failures = script_failures(self.setup_commands, self.waitOutput())
+        return getattr(self, 'setup_failures', [])
+
+    def sendCmd(self, *args, **kwargs):
+        self.finish_setup()
+        return super(P4Host, self).sendCmd(*args, **kwargs)
+
     def describe(self):
         print("**********")
         print(self.name)
@@ -56,7 +107,6 @@ class P4Host(Host):
 
 class P4Switch(Switch):
     """P4 virtual switch"""
-    device_id = 0
 
     def __init__(self, name, sw_path = None, json_path = None,
                  thrift_port = None,
@@ -79,12 +129,7 @@ class P4Switch(Switch):
         self.sw_path = sw_path
         self.json_path = json_path
         self.verbose = verbose
-        logfile = "/tmp/p4s.{}.log".format(self.name)
-        self.output = open(logfile, 'w')
-        self.thrift_port = thrift_port
-        if check_listening_on_port(self.thrift_port):
-            error('%s cannot bind port %d because it is bound by another process\n' % (self.name, self.grpc_port))
-            exit(1)
+        self.thrift_port = self.reserve_port(thrift_port, THRIFT_BASE_PORT)
         self.pcap_dump = pcap_dump
         self.enable_debugger = enable_debugger
         self.log_console = log_console
@@ -92,14 +137,37 @@ class P4Switch(Switch):
             self.log_file = log_file
         else:
             self.log_file = "/tmp/p4s.{}.log".format(self.name)
-        if device_id is not None:
-            self.device_id = device_id
-            P4Switch.device_id = max(P4Switch.device_id, device_id)
-        else:
-            self.device_id = P4Switch.device_id
-            P4Switch.device_id += 1
+        self.device_id = self.reserve_device_id(device_id)
         self.nanomsg = "ipc:///tmp/bm-{}-log.ipc".format(self.device_id)
 
+    def reserve_port(self, port, base):
+        """ Reserves `port`, or the next free port >= `base` if it is None,
+            for this switch, so that concurrent runs never share one. """
+        if port is None:
+            return ALLOCATOR.port(base)
+        if not ALLOCATOR.reserve('port', port) or check_listening_on_port(port):
+            error('%s cannot bind port %d because it is bound by another process\n' % (self.name, port))
+            exit(1)
+        return port
+
+    def reserve_device_id(self, device_id):
+        """ Same as reserve_port() for the device id, which also names the
+            switch's nanomsg socket. """
+        if device_id is None:
+            return ALLOCATOR.device_id()
+        if not ALLOCATOR.reserve('device', device_id):
+            error('%s cannot use device id %d because another run uses it\n' % (self.name, device_id))
+            exit(1)
+        return device_id
+
+    def release_reservations(self):
+        """ Gives the ports and device id of a stopped switch back. """
+        for port in (getattr(self, 'thrift_port', None), getattr(self, 'grpc_port', None)):
+            if port is not None:
+                ALLOCATOR.release('port', port)
+        if getattr(self, 'device_id', None) is not None:
+            ALLOCATOR.release('device', self.device_id)
+
     @classmethod
     def setup(cls):
         pass
@@ -114,7 +182,7 @@ class P4Switch(Switch):
                 return False
             if check_listening_on_port(self.thrift_port):
                 return True
-            sleep(0.5)
+            sleep(0.05)
 
     def start(self, controllers):
         "Start up a new P4 switch"
@@ -130,7 +198,6 @@ class P4Switch(Switch):
         if self.nanomsg:
             args.extend(['--nanolog', self.nanomsg])
         args.extend(['--device-id', str(self.device_id)])
-        P4Switch.device_id += 1
         args.append(self.json_path)
         if self.enable_debugger:
             args.append("--debugger")
@@ -144,17 +211,18 @@ class P4Switch(Switch):
             self.cmd(' '.join(args) + ' >' + self.log_file + ' 2>&1 & echo $! >> ' + f.name)
             pid = int(f.read())
         debug("P4 switch {} PID is {}.\n".format(self.name, pid))
+        self.pid = pid
         if not self.check_switch_started(pid):
             error("P4 switch {} did not start correctly.\n".format(self.name))
             exit(1)
         info("P4 switch {} has been started.\n".format(self.name))
 
-    def stop(self):
+    def stop(self, deleteIntfs=True):
         "Terminate P4 switch."
-        self.output.flush()
-        self.cmd('kill %' + self.sw_path)
-        self.cmd('wait')
-        self.deleteIntfs()
+        stop_processes([getattr(self, 'pid', None)])
+        self.release_reservations()
+        if deleteIntfs:
+            self.deleteIntfs()
 
     def attach(self, intf):
         "Connect a data port"
@@ -163,3 +231,98 @@ class P4Switch(Switch):
     def detach(self, intf):
         "Disconnect a data port"
         assert(0)
+
+
+def _alive(pid):
+    """ False once the process has exited, zombies included. """
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (IOError, IndexError):
+        return False
+
+def _signal(pid, sig):
+    # switches started in the background of a Mininet shell lead their own
+    # process group, which takes any helper processes down with them
+    try:
+        if os.getpgid(pid) == pid:
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except OSError:
+        pass
+
+def stop_processes(pids, grace=SWITCH_STOP_TIMEOUT):
+    """ Sends SIGTERM to all `pids` at once, waits up to `grace` seconds
+        for all of them together and kills those still running. Returns the
+        pids that had to be killed. """
+    pids = [pid for pid in pids if pid and _alive(pid)]
+    for pid in pids:
+        _signal(pid, signal.SIGTERM)
+    deadline = time.time() + grace
+    while pids and time.time() < deadline:
+        sleep(0.05)
+        pids = [pid for pid in pids if _alive(pid)]
+    for pid in pids:
+        _signal(pid, signal.SIGKILL)
+    return pids
+
+def delete_interfaces(names):
+    """ Deletes root namespace interfaces (and their veth peers) with a
+        single ip -batch call. """
+    if names:
+        batch = ''.join('link delete dev %s\n' % name for name in names)
+        subprocess.run(['ip', '-force', '-batch', '-'], input=batch.encode(),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def teardown(net, grace=SWITCH_STOP_TIMEOUT):
+    """ Faster Mininet.stop() for networks of P4 switches. Every BMv2
+        process is signalled at once and waited for together, all switch
+        interfaces, and with them the host ends of the links, go in one
+        ip -batch call, and only then are the node shells terminated. """
+    info('*** Stopping %i switches\n' % len(net.switches))
+    for controller in net.controllers:
+        controller.stop()
+    killed = stop_processes([getattr(sw, 'pid', None) for sw in net.switches], grace)
+    if killed:
+        info('*** Killed %i switches after %is\n' % (len(killed), grace))
+    delete_interfaces([intf.name for sw in net.switches for intf in sw.intfList()
+                       if intf.name != 'lo'])
+    for node in net.hosts + net.switches:
+        node.terminate()
+    for sw in net.switches:
+        if isinstance(sw, P4Switch):
+            sw.release_reservations()
+    info('*** Done\n')
+
+def cleanup(sw_names=('simple_switch_grpc', 'simple_switch'), grace=SWITCH_STOP_TIMEOUT):
+    """ Removes what an interrupted run left behind, the part of `mn -c`
+        these exercises need, in one pass: BMv2 processes and Mininet host
+        shells are stopped together and leftover switch interfaces are
+        deleted in one ip -batch call. """
+    switches = []
+    shells = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/cmdline' % entry, 'rb') as f:
+                cmdline = f.read().split(b'\0')
+        except IOError:
+            continue
+        if os.path.basename(cmdline[0]).decode('utf-8', 'replace') in sw_names:
+            switches.append(int(entry))
+        elif any(arg.startswith(b'mininet:') for arg in cmdline):
+            shells.append(int(entry))
+    stop_processes(switches, grace)
+    # interactive shells ignore SIGTERM
+    stop_processes(shells, 0)
+    links = subprocess.run(['ip', '-o', 'link', 'show'], stdout=subprocess.PIPE).stdout
+    names = re.findall(r'^\d+: (s\d+-eth\d+)[@:]', links.decode('utf-8', 'replace'), re.M)
+    delete_interfaces(names)
+    print('Stopped %d switches and %d host shells, deleted %d interfaces' % (
+        len(switches), len(shells), len(names)))
+
+if __name__ == '__main__':
+    # used by `make stop`
+    cleanup()
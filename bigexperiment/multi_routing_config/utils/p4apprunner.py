@@ -17,10 +17,16 @@
 
 import argparse
 from collections import OrderedDict
+import hashlib
 import json
 import os
+import shlex
+import shutil
 import sys
 import tarfile
+import tempfile
+
+import p4c_cache
 
 parser = argparse.ArgumentParser(description='p4apprunner')
 parser.add_argument('--build-dir', help='Directory to build in.',
@@ -43,13 +49,19 @@ def log(*items):
 def log_error(*items):
     print(*items, file=sys.stderr)
 
+# refuse absolute paths, links out of the tree and device files where
+# tarfile supports it (3.12, and backported to earlier releases)
+EXTRACT_ARGS = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+
 def run_command(command):
     log('>', command)
     return os.WEXITSTATUS(os.system(command))
 
 class Manifest:
-    def __init__(self, program_file, language, target, target_config):
+    def __init__(self, program_file, language, target, target_config, programs=None):
         self.program_file = program_file
+        # all programs of the package; the first one is run
+        self.programs = programs or [program_file]
         self.language = language
         self.target = target
         self.target_config = target_config
@@ -61,6 +73,13 @@ def read_manifest(manifest_file):
         log_error('No program defined in manifest.')
         sys.exit(1)
     program_file = manifest['program']
+    programs = None
+    if isinstance(program_file, list):
+        if len(program_file) < 1:
+            log_error('No program defined in manifest.')
+            sys.exit(1)
+        programs = program_file
+        program_file = programs[0]
 
     if 'language' not in manifest:
         log_error('No language defined in manifest.')
@@ -82,7 +101,8 @@ def read_manifest(manifest_file):
         log_error('Target not found in manifest:', chosen_target)
         sys.exit(1)
 
-    return Manifest(program_file, language, chosen_target, manifest['targets'][chosen_target])
+    return Manifest(program_file, language, chosen_target, manifest['targets'][chosen_target],
+                    programs)
 
 
 def run_compile_bmv2(manifest):
@@ -94,12 +114,12 @@ def run_compile_bmv2(manifest):
         for command in commands:
             run_command(command)
 
-    compiler_args = []
+    compiler_args = ['p4c-bm2-ss']
 
     if manifest.language == 'p4-14':
-        compiler_args.append('--p4v 14')
+        compiler_args.extend(['--p4v', '14'])
     elif manifest.language == 'p4-16':
-        compiler_args.append('--p4v 16')
+        compiler_args.extend(['--p4v', '16'])
     else:
         log_error('Unknown language:', manifest.language)
         sys.exit(1)
@@ -109,13 +129,18 @@ def run_compile_bmv2(manifest):
         if not isinstance(flags, list):
             log_error('compiler-flags should be a list:', flags)
             sys.exit(1)
-        compiler_args.extend(flags)
-
-    # Compile the program.
+        for flag in flags:
+            compiler_args.extend(shlex.split(flag))
+
+    # Compile the programs, in parallel when there are several. Unchanged
+    # programs are restored from the compile cache (p4c_cache.py).
+    commands = []
+    for program in manifest.programs:
+        commands.append(compiler_args + [program, '-o', program + '.json'])
+        log('>', ' '.join(shlex.quote(arg) for arg in commands[-1]))
+    results = p4c_cache.compile_many(commands, log=log)
+    rv = next((result for result, _ in results if result != 0), 0)
     output_file = manifest.program_file + '.json'
-    compiler_args.append('"%s"' % manifest.program_file)
-    compiler_args.append('-o "%s"' % output_file)
-    rv = run_command('p4c-bm2-ss %s' % ' '.join(compiler_args))
 
     if 'run-after-compile' in manifest.target_config:
         commands = manifest.target_config['run-after-compile']
@@ -253,8 +278,8 @@ def run_stf(manifest):
     # Run the program using the BMV2 STF interpreter.
     stf_args = []
     stf_args.append('-v')
-    stf_args.append(os.path.join(args.build_dir, output_file))
-    stf_args.append(os.path.join(args.build_dir, stf_file))
+    stf_args.append(os.path.join(os.getcwd(), output_file))
+    stf_args.append(os.path.join(os.getcwd(), stf_file))
 
     program = '"%s/stf/bmv2stf.py"' % sys.path[0]
     rv = run_command('python3 %s %s' % (program, ' '.join(stf_args)))
@@ -279,20 +304,62 @@ def run_custom(manifest):
         sys.exit(1)
     return rv
 
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_package_manifest(app):
+    # Reads the manifest out of the archive, decompressing it only up to
+    # the manifest member.
+    wanted = os.path.normpath(args.manifest)
+    with tarfile.open(app, 'r|*') as tar:
+        for member in tar:
+            if member.isfile() and os.path.normpath(member.name) == wanted:
+                return read_manifest(tar.extractfile(member))
+    log_error('No manifest in package:', args.manifest)
+    sys.exit(1)
+
+def extract_package(app):
+    # Extracts the package into a directory named after the archive's hash,
+    # unless an earlier launch already did. Members are extracted one at a
+    # time as the archive is read, into a temporary directory that is
+    # renamed into place, so an existing directory is always complete.
+    directory = os.path.abspath('p4app-%s' % file_digest(app)[:16])
+    if os.path.isdir(directory):
+        log('Package unchanged, reusing', directory)
+        return directory
+
+    log('Extracting package to', directory)
+    tmp = tempfile.mkdtemp(prefix='.p4app-', dir=os.path.dirname(directory))
+    try:
+        with tarfile.open(app, 'r|*') as tar:
+            for member in tar:
+                tar.extract(member, tmp, **EXTRACT_ARGS)
+        os.chmod(tmp, 0o755)
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # extracted meanwhile by a concurrent launch of the same package
+        if not os.path.isdir(directory):
+            raise
+    return directory
+
 def main():
     log('Entering build directory.')
     os.chdir(args.build_dir)
 
-    # A '.p4app' package is really just a '.tar.gz' archive. Extract it so we
-    # can process its contents.
-    log('Extracting package.')
-    tar = tarfile.open(args.app)
-    tar.extractall()
-    tar.close()
-
+    # A '.p4app' package is really just a '.tar.gz' archive. Check its
+    # manifest before extracting anything.
     log('Reading package manifest.')
-    with open(args.manifest, 'r') as manifest_file:
-        manifest = read_manifest(manifest_file)
+    manifest = read_package_manifest(args.app)
+
+    # The compiled programs are kept in the extracted tree and the compile
+    # cache, so launching an unchanged package again neither extracts nor
+    # compiles.
+    os.chdir(extract_package(args.app))
 
     # Dispatch to the backend implementation for this target.
     backend = manifest.target
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Content-addressed cache in front of the P4 compiler.
+#
+# Used as a drop-in prefix of a p4c command line:
+#
+#   p4c_cache.py p4c-bm2-ss --p4v 16 --p4runtime-files build/x.p4.p4info.txt -o build/x.json x.p4
+#
+# The key is a hash of the compiler version, the command line (with the
+# output paths left out), and the source with every file it #includes. On
+# a hit the BMv2 JSON and p4info stored for that key are copied to the
+# requested outputs and the compiler is not run. On a miss the compiler is
+# run as given and its outputs are stored. Includes that cannot be found
+# next to the source or in -I directories (core.p4, v1model.p4) come with
+# the compiler and are covered by its version.
+#
+# P4C_CACHE_DIR sets the cache directory (default ~/.cache/p4c) and
+# P4C_CACHE=0 turns the cache off.
+#
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'p4c')
+INCLUDE_RE = re.compile(rb'^\s*#\s*include\s*([<"])([^>"]+)[>"]', re.M)
+
+# p4c options whose value is the next argument
+VALUE_OPTIONS = set([
+    '-o', '-I', '-D', '-U', '-T', '--p4v', '--std', '--target', '--arch',
+    '--p4runtime-files', '--p4runtime-file', '--p4runtime-format',
+    '--p4runtime-entries-files', '--pp', '--toJSON', '--top4',
+    '--dump', '--emit-externs', '--Wdisable', '--Wwarn', '--Werror',
+])
+OUTPUT_OPTIONS = set(['-o', '--p4runtime-files', '--p4runtime-file',
+                      '--p4runtime-entries-files'])
+
+
+def cache_dir():
+    return os.environ.get('P4C_CACHE_DIR') or DEFAULT_CACHE_DIR
+
+
+def parse_command(command):
+    """ Splits a p4c command line into (source, include dirs, outputs,
+        normalized argument list). Returns None when it cannot tell which
+        file is compiled or where the outputs go. """
+    source = None
+    include_dirs = []
+    outputs = []
+    normalized = [command[0]]
+    args = command[1:]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in VALUE_OPTIONS and i + 1 < len(args):
+            value = args[i + 1]
+            i += 2
+        elif arg.startswith('-') and '=' in arg and arg.split('=', 1)[0] in VALUE_OPTIONS:
+            arg, value = arg.split('=', 1)
+            i += 1
+        elif arg.startswith(('-o', '-I')) and len(arg) > 2 and not arg.startswith('--'):
+            arg, value = arg[:2], arg[2:]
+            i += 1
+        else:
+            i += 1
+            if not arg.startswith('-'):
+                if source is not None:
+                    return None
+                source = arg
+                normalized.append('<source>')
+            else:
+                normalized.append(arg)
+            continue
+        if arg in OUTPUT_OPTIONS:
+            for path in value.split(','):
+                outputs.append(path)
+            normalized.extend([arg, '<output>'])
+        else:
+            if arg == '-I':
+                include_dirs.append(value)
+            normalized.extend([arg, value])
+    if source is None or not outputs:
+        return None
+    return source, include_dirs, outputs, normalized
+
+
+def source_closure(source, include_dirs):
+    """ [(name, sha256)] of the source and every include found locally,
+        and names of the includes that were not. """
+    files = []
+    missing = set()
+    seen = set()
+    pending = [(source, source)]
+    while pending:
+        name, path = pending.pop()
+        real = os.path.realpath(path)
+        if real in seen:
+            continue
+        seen.add(real)
+        with open(path, 'rb') as f:
+            data = f.read()
+        files.append((name, hashlib.sha256(data).hexdigest()))
+        here = os.path.dirname(path)
+        for quote, include in INCLUDE_RE.findall(data):
+            include = include.decode('utf-8')
+            dirs = ([here] if quote == b'"' else []) + include_dirs
+            for d in dirs:
+                candidate = os.path.join(d, include)
+                if os.path.isfile(candidate):
+                    pending.append((include, candidate))
+                    break
+            else:
+                missing.add(include)
+    return sorted(files), sorted(missing)
+
+
+def compiler_version(compiler, directory):
+    """ `compiler --version`, remembered per compiler binary (path, size and
+        mtime) so that cache hits do not start the compiler at all. """
+    binary = shutil.which(compiler) or compiler
+    st = os.stat(binary)
+    stamp = '%s:%d:%d' % (os.path.realpath(binary), st.st_size, st.st_mtime_ns)
+    versions_file = os.path.join(directory, 'compilers.json')
+    try:
+        with open(versions_file) as f:
+            versions = json.load(f)
+    except (IOError, ValueError):
+        versions = {}
+    if stamp not in versions:
+        out = subprocess.run([binary, '--version'], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, check=False).stdout
+        versions[stamp] = out.decode('utf-8', 'replace').strip()
+        # compile_many() threads may get here at once on a cold cache
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='compilers.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(versions, f, indent=2, sort_keys=True)
+        os.replace(tmp, versions_file)
+    return versions[stamp]
+
+
+def cache_key(command, parsed, directory):
+    source, include_dirs, _, normalized = parsed
+    files, missing = source_closure(source, include_dirs)
+    h = hashlib.sha256()
+    h.update(compiler_version(command[0], directory).encode('utf-8'))
+    h.update(json.dumps([normalized, files, missing]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def cached_compile(command, directory=None, log=print):
+    """ Runs the p4c `command` (a list) unless its outputs are cached.
+        Returns (exit status, True on a cache hit). """
+    parsed = parse_command(command)
+    if os.environ.get('P4C_CACHE') == '0' or parsed is None:
+        return subprocess.call(command), False
+    directory = directory or cache_dir()
+    os.makedirs(directory, exist_ok=True)
+    outputs = parsed[2]
+    try:
+        key = cache_key(command, parsed, directory)
+    except OSError as e:
+        log('p4c cache: %s, compiling without it' % e)
+        return subprocess.call(command), False
+    entry = os.path.join(directory, key[:2], key)
+
+    # make -j may compile before the build directory is created
+    for output in outputs:
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    if os.path.isdir(entry):
+        for n, output in enumerate(outputs):
+            shutil.copyfile(os.path.join(entry, 'out%d' % n), output)
+        log('p4c cache hit for %s (%s)' % (parsed[0], key[:12]))
+        return 0, True
+
+    rv = subprocess.call(command)
+    if rv == 0 and all(os.path.isfile(output) for output in outputs):
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry))
+        for n, output in enumerate(outputs):
+            shutil.copyfile(output, os.path.join(tmp, 'out%d' % n))
+        with open(os.path.join(tmp, 'command.json'), 'w') as f:
+            json.dump(command, f)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored meanwhile by a parallel build of the same program
+            shutil.rmtree(tmp)
+    return rv, False
+
+
+def compile_many(commands, jobs=None, directory=None, log=print):
+    """ cached_compile() for several programs at once, `jobs` (default:
+        one per CPU) compilers running in parallel. Returns the results in
+        the order of `commands`. """
+    jobs = jobs or os.cpu_count() or 1
+    if len(commands) == 1 or jobs == 1:
+        return [cached_compile(c, directory, log) for c in commands]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(lambda c: cached_compile(c, directory, log), commands))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: %s P4C [ARGS...]" % sys.argv[0], file=sys.stderr)
+        sys.exit(2)
+    rv, _ = cached_compile(sys.argv[1:])
+    sys.exit(rv)
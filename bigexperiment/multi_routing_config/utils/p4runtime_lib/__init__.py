@@ -0,0 +1,26 @@
+#
+# P4Runtime helper library used by the exercise controllers.
+#
+# Importing the package loads nothing else: submodules are imported on
+# first attribute access (p4runtime_lib.helper, p4runtime_lib.bmv2, ...),
+# so that tools which only generate or check rules never pay for grpc.
+# Only switch, bmv2, error_utils, metrics and fake_server import grpc; helper
+# imports protobuf.
+#
+import importlib
+
+__all__ = [
+    'aggregate', 'bmv2', 'capture', 'convert', 'error_utils', 'eventlog',
+    'fake_server', 'fib', 'helper', 'http_api', 'json_stream', 'lpm_routes', 'metrics',
+    'runtime_bin', 'simple_controller', 'stats', 'switch', 'topogen', 'topology', 'tracing',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
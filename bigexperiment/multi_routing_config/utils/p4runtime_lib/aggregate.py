@@ -0,0 +1,97 @@
+#
+# IPv4 route aggregation for LPM tables.
+#
+# aggregate_routes() rewrites a route set into the smallest set of prefixes
+# with the same longest-prefix-match result, using the ORTC algorithm
+# (Draves et al., "Constructing Optimal IP Routing Tables"): the routes are
+# put in a binary trie, each node gets the set of next hops that would let
+# its subtree be forwarded with the fewest entries (intersection of its
+# children's sets when not empty, their union otherwise), and entries are
+# then only emitted where the next hop inherited from above is not in that
+# set. Siblings with the same next hop collapse into their parent and
+# prefixes covered by a shorter one with the same next hop disappear.
+#
+import socket
+import struct
+
+NO_ROUTE = 0
+
+
+def _parse(ip, length):
+    value = struct.unpack('!I', socket.inet_aton(ip))[0]
+    return value & ((0xffffffff << (32 - length)) & 0xffffffff)
+
+
+def aggregate_routes(routes, unrouted_is_free=False):
+    """ Aggregates `routes`, a dict of (ip, prefix_len) -> action where the
+        action is any hashable value, e.g. a (dstAddr, port) tuple.
+
+        Returns a dict of (ip, prefix_len) -> action giving every address
+        the same action as `routes` did. An action of None marks a prefix
+        that must miss, i.e. be installed with NoAction, because a shorter
+        aggregate covers it. With `unrouted_is_free`, addresses no route
+        covers may be given any action, which allows much more merging
+        when nothing is expected to be sent to them.
+    """
+    actions = [None]
+    ids = {}
+    # node: [next hop id or -1, zero child, one child, next hop set]
+    root = [-1, None, None, None]
+    for (ip, length), action in routes.items():
+        nh = ids.get(action)
+        if nh is None:
+            nh = ids[action] = len(actions)
+            actions.append(action)
+        value = _parse(ip, length)
+        node = root
+        for depth in range(length):
+            bit = 1 + ((value >> (31 - depth)) & 1)
+            if node[bit] is None:
+                node[bit] = [-1, None, None, None]
+            node = node[bit]
+        node[0] = nh
+
+    _next_hop_sets(root, NO_ROUTE, unrouted_is_free)
+    entries = []
+    _select(root, NO_ROUTE, 0, 0, entries)
+    result = {}
+    for value, length, nh in sorted(entries):
+        result[(socket.inet_ntoa(struct.pack('!I', value)), length)] = actions[nh]
+    return result
+
+
+def _next_hop_sets(node, inherited, unrouted_is_free):
+    """ Post-order pass; a set of None stands for "any next hop". """
+    nh = node[0] if node[0] >= 0 else inherited
+    zero, one = node[1], node[2]
+    if zero is None and one is None:
+        node[3] = None if (nh == NO_ROUTE and unrouted_is_free) else frozenset((nh,))
+        return
+    # every internal node gets two children, the missing one inherits
+    if zero is None:
+        zero = node[1] = [-1, None, None, None]
+    if one is None:
+        one = node[2] = [-1, None, None, None]
+    _next_hop_sets(zero, nh, unrouted_is_free)
+    _next_hop_sets(one, nh, unrouted_is_free)
+    a, b = zero[3], one[3]
+    if a is None:
+        node[3] = b
+    elif b is None:
+        node[3] = a
+    else:
+        node[3] = (a & b) or (a | b)
+
+
+def _select(node, inherited, value, length, entries):
+    """ Pre-order pass emitting (value, length, next hop id) entries. """
+    nh_set = node[3]
+    if nh_set is None or inherited in nh_set:
+        nh = inherited
+    else:
+        nh = min(nh_set)
+        entries.append((value, length, nh))
+    if node[1] is not None:
+        _select(node[1], nh, value, length + 1, entries)
+    if node[2] is not None:
+        _select(node[2], nh, value | (1 << (31 - length)), length + 1, entries)
@@ -0,0 +1,83 @@
+#
+# Packet sources for the telemetry collectors.
+#
+# Both readers yield (buffer, length) pairs where buffer is a memoryview;
+# callers parse frames in place with struct.unpack_from and must not keep
+# a buffer past the next iteration.
+#
+import mmap
+import socket
+import struct
+
+ETH_P_ALL = 0x0003
+# Large enough for any frame on a Mininet veth with offloads disabled
+SNAPLEN = 65535
+
+PCAP_GLOBAL_HDR_LEN = 24
+PCAP_LINKTYPE_ETHERNET = 1
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<',  # microsecond resolution, little endian
+    b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<',  # nanosecond resolution
+    b'\xa1\xb2\x3c\x4d': '>',
+}
+
+
+def open_raw_socket(iface, proto=ETH_P_ALL):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(proto))
+    sock.bind((iface, 0))
+    return sock
+
+
+def read_pcap(path):
+    """ Yields (buffer, length) for every frame of a pcap file. The file is
+        memory-mapped and each frame is a memoryview slice of the mapping. """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    try:
+        endian = PCAP_MAGIC.get(bytes(view[:4]))
+        if endian is None:
+            raise Exception("%s is not a pcap file" % path)
+        linktype = struct.unpack_from(endian + 'I', view, 20)[0]
+        if linktype != PCAP_LINKTYPE_ETHERNET:
+            raise Exception("%s: unsupported link type %d" % (path, linktype))
+        record = struct.Struct(endian + 'IIII')
+        offset = PCAP_GLOBAL_HDR_LEN
+        while offset + record.size <= len(view):
+            _, _, caplen, _ = record.unpack_from(view, offset)
+            offset += record.size
+            if offset + caplen > len(view):
+                # the capture was cut short in the middle of this frame
+                break
+            frame = view[offset:offset + caplen]
+            try:
+                yield frame, caplen
+            finally:
+                # the mapping cannot be closed while a view of it is alive
+                frame.release()
+            offset += caplen
+    finally:
+        view.release()
+        data.close()
+
+
+def read_iface(iface, sock=None, proto=ETH_P_ALL, outgoing_only=False):
+    """ Yields (buffer, length) for every frame received on `iface`. The
+        same preallocated buffer is reused for every frame. With
+        `outgoing_only`, only frames sent out of `iface` are yielded. """
+    if sock is None:
+        sock = open_raw_socket(iface, proto)
+    buf = bytearray(SNAPLEN)
+    view = memoryview(buf)
+    try:
+        while True:
+            if outgoing_only:
+                length, addr = sock.recvfrom_into(buf)
+                if addr[2] != socket.PACKET_OUTGOING:
+                    continue
+            else:
+                length = sock.recv_into(buf)
+            yield view, length
+    finally:
+        sock.close()
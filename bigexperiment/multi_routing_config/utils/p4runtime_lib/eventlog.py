@@ -0,0 +1,269 @@
+#
+# BMv2 event log decoding and aggregation.
+#
+# A switch started with --nanolog ADDRESS publishes one binary message per
+# event on a nanomsg PUB socket: packet in and out, parser and deparser
+# steps, table hits and misses, actions executed... Each message is a
+# packed header (event type, switch id, context id, packet id, copy id)
+# followed by the fields of its type, the layout bmv2's own
+# tools/nanomsg_client.py reads. EventLogCollector keeps per-table hit and
+# miss counts, per-action counts and per-packet latency in fixed memory,
+# which is what the --log-console text traces were mostly read for, and
+# can write a sample of the packets' events as JSON lines.
+#
+# Decoding needs nothing; subscribe() needs the nnpy nanomsg binding, the
+# one bmv2 installs with its tools.
+#
+import json
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .stats import Histogram
+
+# type, switch_id, cxt_id, sig, id, copy_id
+HEADER = struct.Struct('<iiiQQQ')
+
+PACKET_IN = 0
+PACKET_OUT = 1
+CONDITION_EVAL = 11
+TABLE_HIT = 12
+TABLE_MISS = 13
+ACTION_EXECUTE = 14
+CONFIG_CHANGE = 999
+
+# type -> (name, body, field names)
+EVENTS = {
+    PACKET_IN: ('packet_in', struct.Struct('<i'), ('port',)),
+    PACKET_OUT: ('packet_out', struct.Struct('<i'), ('port',)),
+    2: ('parser_start', struct.Struct('<i'), ('parser_id',)),
+    3: ('parser_done', struct.Struct('<i'), ('parser_id',)),
+    4: ('parser_extract', struct.Struct('<i'), ('header_id',)),
+    5: ('deparser_start', struct.Struct('<i'), ('deparser_id',)),
+    6: ('deparser_done', struct.Struct('<i'), ('deparser_id',)),
+    7: ('deparser_emit', struct.Struct('<i'), ('header_id',)),
+    8: ('checksum_update', struct.Struct('<i'), ('checksum_id',)),
+    9: ('pipeline_start', struct.Struct('<i'), ('pipeline_id',)),
+    10: ('pipeline_done', struct.Struct('<i'), ('pipeline_id',)),
+    CONDITION_EVAL: ('condition_eval', struct.Struct('<iB'), ('condition_id', 'result')),
+    TABLE_HIT: ('table_hit', struct.Struct('<ii'), ('table_id', 'entry_handle')),
+    TABLE_MISS: ('table_miss', struct.Struct('<i'), ('table_id',)),
+    ACTION_EXECUTE: ('action_execute', struct.Struct('<i'), ('action_id',)),
+    CONFIG_CHANGE: ('config_change', struct.Struct('<'), ()),
+}
+
+# packets between their packet_in and first packet_out that are tracked;
+# beyond that the oldest is given up on and counted as dropped
+MAX_PENDING = 65536
+# packets gone out whose start time is kept for the packet_out of their
+# other copies
+MAX_DEPARTED = 4096
+
+
+def event_address(device_id):
+    """ The --nanolog address P4Switch gives the switch with `device_id`. """
+    return 'ipc:///tmp/bm-%d-log.ipc' % device_id
+
+
+def decode(msg):
+    """ (type, switch_id, cxt_id, packet_id, copy_id, fields) of an event
+        message, fields being the tuple of its type's values; None for a
+        type this module does not know or a truncated message. """
+    if len(msg) < HEADER.size:
+        return None
+    event_type, switch_id, cxt_id, _, packet_id, copy_id = HEADER.unpack_from(msg)
+    event = EVENTS.get(event_type)
+    if event is None or len(msg) < HEADER.size + event[1].size:
+        return None
+    return (event_type, switch_id, cxt_id, packet_id, copy_id,
+            event[1].unpack_from(msg, HEADER.size))
+
+
+def program_names(bmv2_json):
+    """ ({table id: name}, {action id: name}) of a compiled BMv2 program. """
+    with open(bmv2_json) as f:
+        program = json.load(f)
+    tables = {}
+    for pipeline in program.get('pipelines', []):
+        for table in pipeline.get('tables', []):
+            tables[table['id']] = table['name']
+    actions = dict((action['id'], action['name']) for action in program.get('actions', []))
+    return tables, actions
+
+
+def subscribe(addresses, stop=None, poll=0.5):
+    """ Yields the messages published on the nanomsg `addresses`, one
+        socket subscribed to all of them, until stop() returns True. It is
+        called every `poll` seconds when no message arrives. """
+    import nnpy
+
+    sub = nnpy.Socket(nnpy.AF_SP, nnpy.SUB)
+    try:
+        for address in addresses:
+            sub.connect(address)
+        sub.setsockopt(nnpy.SUB, nnpy.SUB_SUBSCRIBE, '')
+        sub.setsockopt(nnpy.SOL_SOCKET, nnpy.RCVTIMEO, int(poll * 1000))
+        while stop is None or not stop():
+            try:
+                msg = sub.recv()
+            except nnpy.errors.NNError:
+                # receive timeout, see if we should stop
+                continue
+            yield msg
+    finally:
+        sub.close()
+
+
+class EventLogCollector(object):
+    """ Aggregates BMv2 events into per-switch counts and a latency
+        histogram, and writes the events of one packet in every
+        `sample` to `trace` (a file object), one JSON object per line.
+
+        Latency is the time between the packet's packet_in and each of its
+        packet_out messages reaching the collector. BMv2 events carry no
+        timestamp, so it includes the nanomsg delivery, which is the same
+        for both ends and small next to the pipeline under load.
+
+        BMv2 sends no event for a packet it drops, so a packet is counted
+        as dropped when it is evicted: packets are kept in `pending` from
+        their packet_in to their first packet_out, and when a packet_in
+        finds MAX_PENDING there the oldest is evicted. A packet still in
+        flight then is counted as dropped too, and its packet_out gets no
+        latency sample. Once out, a packet stays in `departed`, the last
+        MAX_DEPARTED of them, for the packet_out of its clones and
+        multicast copies.
+
+        add_message() and snapshot() may be called from different threads.
+    """
+
+    def __init__(self, tables=None, actions=None, trace=None, sample=0,
+                 quantiles=(0.5, 0.9, 0.99)):
+        self.tables = tables or {}
+        self.actions = actions or {}
+        self.trace = trace
+        self.sample = sample
+        self.quantiles = quantiles
+        self.lock = threading.Lock()
+        self.switches = {}
+        self.pending = OrderedDict()
+        self.departed = OrderedDict()
+        self.latency = Histogram()
+        self.events = 0
+        self.unknown = 0
+        self.started = time.time()
+        # traces get wall clock times, latencies use perf_counter()
+        self.clock_offset = time.time() - time.perf_counter()
+
+    def _switch(self, switch_id):
+        counts = self.switches.get(switch_id)
+        if counts is None:
+            counts = self.switches[switch_id] = {
+                'packets_in': 0, 'packets_out': 0, 'dropped': 0,
+                'hits': {}, 'misses': {}, 'actions': {},
+                'latency': Histogram(),
+            }
+        return counts
+
+    def add_message(self, msg, now=None):
+        event = decode(msg)
+        if now is None:
+            now = time.perf_counter()
+        with self.lock:
+            self._count(event, now)
+        if (event is not None and self.trace is not None and self.sample
+                and event[3] % self.sample == 0):
+            self.write_event(now, event)
+
+    def _count(self, event, now):
+        if event is None:
+            self.unknown += 1
+            return
+        self.events += 1
+        event_type, switch_id, cxt_id, packet_id, copy_id, fields = event
+        counts = self._switch(switch_id)
+        if event_type == TABLE_HIT:
+            counts['hits'][fields[0]] = counts['hits'].get(fields[0], 0) + 1
+        elif event_type == TABLE_MISS:
+            counts['misses'][fields[0]] = counts['misses'].get(fields[0], 0) + 1
+        elif event_type == ACTION_EXECUTE:
+            counts['actions'][fields[0]] = counts['actions'].get(fields[0], 0) + 1
+        elif event_type == PACKET_IN:
+            counts['packets_in'] += 1
+            self.pending[(switch_id, cxt_id, packet_id)] = now
+            if len(self.pending) > MAX_PENDING:
+                key, _ = self.pending.popitem(last=False)
+                self._switch(key[0])['dropped'] += 1
+        elif event_type == PACKET_OUT:
+            counts['packets_out'] += 1
+            key = (switch_id, cxt_id, packet_id)
+            start = self.pending.pop(key, None)
+            if start is not None:
+                self.departed[key] = start
+                if len(self.departed) > MAX_DEPARTED:
+                    self.departed.popitem(last=False)
+            else:
+                # clones and multicast copies share the start of the packet
+                start = self.departed.get(key)
+            if start is not None:
+                micros = int((now - start) * 1e6)
+                counts['latency'].record(micros)
+                self.latency.record(micros)
+
+    def write_event(self, now, event):
+        event_type, switch_id, cxt_id, packet_id, copy_id, fields = event
+        name, _, field_names = EVENTS[event_type]
+        record = {'time': now + self.clock_offset, 'switch': switch_id, 'context': cxt_id,
+                  'packet': packet_id, 'copy': copy_id, 'event': name}
+        record.update(zip(field_names, fields))
+        if 'table_id' in record:
+            record['table'] = self.tables.get(record['table_id'])
+        if 'action_id' in record:
+            record['action'] = self.actions.get(record['action_id'])
+        self.trace.write(json.dumps(record) + '\n')
+
+    def run(self, messages):
+        for msg in messages:
+            self.add_message(msg)
+
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        elapsed = time.time() - self.started
+        switches = {}
+        for switch_id, counts in sorted(self.switches.items()):
+            table_ids = set(counts['hits']) | set(counts['misses'])
+            switches['%d' % switch_id] = {
+                'packets_in': counts['packets_in'],
+                'packets_out': counts['packets_out'],
+                'dropped': counts['dropped'],
+                'tables': dict((self.tables.get(table_id, '%d' % table_id), {
+                    'hits': counts['hits'].get(table_id, 0),
+                    'misses': counts['misses'].get(table_id, 0),
+                }) for table_id in sorted(table_ids)),
+                'actions': dict((self.actions.get(action_id, '%d' % action_id), count)
+                                for action_id, count in sorted(counts['actions'].items())),
+                'latency_us': counts['latency'].summary(self.quantiles),
+            }
+        return {
+            'events': self.events,
+            'unknown': self.unknown,
+            'events_per_second': self.events / elapsed if elapsed else 0.0,
+            'latency_us': self.latency.summary(self.quantiles),
+            'switches': switches,
+        }
+
+    def print_summary(self):
+        snapshot = self.snapshot()
+        print('\n----- BMv2 events (%d, %.0f/s) -----' % (
+            snapshot['events'], snapshot['events_per_second']))
+        for switch_id, counts in snapshot['switches'].items():
+            latency = counts['latency_us']
+            print('device %s: %d in, %d out, latency p50=%s p99=%s us' % (
+                switch_id, counts['packets_in'], counts['packets_out'],
+                latency.get('p50'), latency.get('p99')))
+            for table, table_counts in sorted(counts['tables'].items()):
+                print('  %-32s %8d hits %8d misses' % (
+                    table, table_counts['hits'], table_counts['misses']))
@@ -0,0 +1,202 @@
+#
+# In-process stand-in for the BMv2 P4Runtime server.
+#
+# Implements StreamChannel arbitration, SetForwardingPipelineConfig, Write
+# and Read against in-memory tables so the controller stack can be run and
+# measured without simple_switch_grpc. Nothing is checked against the
+# p4info: entries are keyed on their table id, match and priority only.
+# `latency` seconds are slept in every unary RPC to mimic a real switch.
+#
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from p4.v1 import p4runtime_pb2
+from p4.v1 import p4runtime_pb2_grpc
+
+READ_BATCH_SIZE = 1024
+
+
+def match_key(table_entry):
+    """ Identity of an entry within its table, as P4Runtime defines it. """
+    return (table_entry.table_id, table_entry.priority,
+            tuple(sorted(m.SerializeToString() for m in table_entry.match)))
+
+
+class FakeP4Runtime(p4runtime_pb2_grpc.P4RuntimeServicer):
+
+    def __init__(self, device_id=0, latency=0.0):
+        self.device_id = device_id
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.config = None
+        self.election_id = None
+        self.tables = {}
+        self.default_actions = {}
+        self.pre_entries = {}
+        self.rpc_counts = {}
+        self.update_count = 0
+        self.last_rpc = None
+
+    def _rpc(self, name):
+        with self.lock:
+            self.rpc_counts[name] = self.rpc_counts.get(name, 0) + 1
+            self.last_rpc = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _check_device(self, request, context):
+        if request.device_id != self.device_id:
+            context.abort(grpc.StatusCode.NOT_FOUND,
+                          "device %d not found" % request.device_id)
+
+    def StreamChannel(self, request_iterator, context):
+        for request in request_iterator:
+            self._rpc('StreamChannel')
+            if request.HasField('arbitration'):
+                self.election_id = (request.arbitration.election_id.high,
+                                    request.arbitration.election_id.low)
+                response = p4runtime_pb2.StreamMessageResponse()
+                response.arbitration.CopyFrom(request.arbitration)
+                response.arbitration.status.code = grpc.StatusCode.OK.value[0]
+                yield response
+
+    def SetForwardingPipelineConfig(self, request, context):
+        self._rpc('SetForwardingPipelineConfig')
+        self._check_device(request, context)
+        with self.lock:
+            self.config = request.config
+            self.tables = {}
+            self.default_actions = {}
+            self.pre_entries = {}
+        return p4runtime_pb2.SetForwardingPipelineConfigResponse()
+
+    def GetForwardingPipelineConfig(self, request, context):
+        self._rpc('GetForwardingPipelineConfig')
+        self._check_device(request, context)
+        response = p4runtime_pb2.GetForwardingPipelineConfigResponse()
+        if self.config is not None:
+            response.config.CopyFrom(self.config)
+        return response
+
+    def Write(self, request, context):
+        """ Applies the updates in order; the first failing one aborts the
+            RPC with its status, the ones before it stay applied. """
+        self._rpc('Write')
+        self._check_device(request, context)
+        if self.config is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "no forwarding pipeline config")
+        error = None
+        with self.lock:
+            for update in request.updates:
+                error = self._apply(update)
+                if error is not None:
+                    break
+                self.update_count += 1
+        if error is not None:
+            context.abort(*error)
+        return p4runtime_pb2.WriteResponse()
+
+    def _apply(self, update):
+        entity = update.entity
+        which = entity.WhichOneof('entity')
+        if which == 'table_entry':
+            table_entry = entity.table_entry
+            if table_entry.is_default_action:
+                if update.type != p4runtime_pb2.Update.MODIFY:
+                    return (grpc.StatusCode.INVALID_ARGUMENT,
+                            "default action can only be modified")
+                self.default_actions[table_entry.table_id] = table_entry
+                return None
+            table = self.tables.setdefault(table_entry.table_id, {})
+            key = match_key(table_entry)
+        elif which == 'packet_replication_engine_entry':
+            pre = entity.packet_replication_engine_entry
+            kind = pre.WhichOneof('type')
+            if kind == 'multicast_group_entry':
+                key = (kind, pre.multicast_group_entry.multicast_group_id)
+            else:
+                key = (kind, pre.clone_session_entry.session_id)
+            table, table_entry = self.pre_entries, pre
+        else:
+            return (grpc.StatusCode.UNIMPLEMENTED, "%s updates are not supported" % which)
+
+        if update.type == p4runtime_pb2.Update.INSERT:
+            if key in table:
+                return (grpc.StatusCode.ALREADY_EXISTS, "entry already exists")
+            table[key] = table_entry
+        elif update.type == p4runtime_pb2.Update.MODIFY:
+            if key not in table:
+                return (grpc.StatusCode.NOT_FOUND, "entry not found")
+            table[key] = table_entry
+        elif update.type == p4runtime_pb2.Update.DELETE:
+            if table.pop(key, None) is None:
+                return (grpc.StatusCode.NOT_FOUND, "entry not found")
+        else:
+            return (grpc.StatusCode.INVALID_ARGUMENT, "unspecified update type")
+        return None
+
+    def Read(self, request, context):
+        self._rpc('Read')
+        self._check_device(request, context)
+        with self.lock:
+            entities = []
+            for entity in request.entities:
+                which = entity.WhichOneof('entity')
+                if which == 'table_entry':
+                    table_id = entity.table_entry.table_id
+                    for tid in sorted(self.tables):
+                        if table_id in (0, tid):
+                            entities.extend(('table_entry', e) for e in self.tables[tid].values())
+                elif which == 'counter_entry':
+                    # counters are not simulated, they read as zero
+                    entities.append(('counter_entry', entity.counter_entry))
+                else:
+                    context.abort(grpc.StatusCode.UNIMPLEMENTED,
+                                  "reading %s is not supported" % which)
+        for start in range(0, len(entities), READ_BATCH_SIZE):
+            response = p4runtime_pb2.ReadResponse()
+            for which, message in entities[start:start + READ_BATCH_SIZE]:
+                getattr(response.entities.add(), which).CopyFrom(message)
+            yield response
+
+    def Capabilities(self, request, context):
+        self._rpc('Capabilities')
+        response = p4runtime_pb2.CapabilitiesResponse()
+        response.p4runtime_api_version = '1.0.0'
+        return response
+
+    def entry_count(self):
+        with self.lock:
+            return sum(len(t) for t in self.tables.values())
+
+
+class FakeSwitchServer(object):
+    """ One gRPC server per fake switch, like one simple_switch_grpc
+        process each. """
+
+    def __init__(self, device_id=0, latency=0.0, address='127.0.0.1:0', workers=4):
+        self.servicer = FakeP4Runtime(device_id=device_id, latency=latency)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        p4runtime_pb2_grpc.add_P4RuntimeServicer_to_server(self.servicer, self.server)
+        self.port = self.server.add_insecure_port(address)
+        if self.port == 0:
+            raise IOError("could not bind %s" % address)
+        self.address = '%s:%d' % (address.rsplit(':', 1)[0], self.port)
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self, grace=None):
+        self.server.stop(grace)
+
+
+def start_fake_switches(count, base_port=50051, latency=0.0):
+    """ Starts `count` fake switches on base_port, base_port + 1, ... with
+        device ids 0, 1, ..., the ports and ids the exercise controllers
+        connect to. """
+    return [FakeSwitchServer(device_id=n, latency=latency,
+                             address='127.0.0.1:%d' % (base_port + n)).start()
+            for n in range(count)]
@@ -0,0 +1,337 @@
+#
+# Offline model of the IPv4 forwarding state of a network.
+#
+# LpmIndex flattens one LPM table into sorted, disjoint address intervals,
+# so a longest-prefix lookup is a binary search and a batch of lookups is
+# one numpy.searchsorted call. FibModel puts one index per switch and table
+# together with the topology and follows packets from switch to switch,
+# choosing the table by DSCP the way mrc.p4 does, to find loops and
+# blackholes without sending any traffic.
+#
+# numpy is optional for LpmIndex and FibModel.check(): without it they
+# work one lookup at a time. follow() and FibModel.next_hop_array(), which
+# the MRC verifier builds on, need it.
+#
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .convert import decodeIPv4, decodeMac, decodeNum, encodeIPv4
+
+ADDRESS_SPACE = 1 << 32
+MISS = -1
+# action of entries that drop packets, as opposed to None for a miss
+DROP = 'drop'
+
+BLACKHOLE = 'blackhole'
+DROPPED = 'dropped'
+LOOP = 'loop'
+
+
+def prefix_range(ip, length):
+    """ First address and address count of ip/length. """
+    size = 1 << (32 - length)
+    start = decodeNum(encodeIPv4(ip)) & ~(size - 1)
+    return start, size
+
+
+class LpmIndex(object):
+    """ One LPM table as disjoint intervals: starts[i] is the first address
+        of interval i and slots[i] the index in `actions` of the route it
+        hits, MISS where no route does. Building is O(n log n) in the number
+        of routes; memory is two 4-byte words per interval. """
+
+    def __init__(self, routes):
+        self.actions = []
+        ids = {}
+        prefixes = []
+        for (ip, length), action in routes.items():
+            slot = ids.get(action)
+            if slot is None:
+                slot = ids[action] = len(self.actions)
+                self.actions.append(action)
+            start, size = prefix_range(ip, length)
+            prefixes.append((start, -size, slot))
+        # shorter prefixes first at the same start, so the stack is nested
+        prefixes.sort()
+
+        self.starts = array('I')
+        self.slots = array('i')
+        stack = []
+        for start, neg_size, slot in prefixes:
+            while stack and stack[-1][0] <= start:
+                end = stack.pop()[0]
+                self._emit(end, stack[-1][1] if stack else MISS)
+            stack.append((start - neg_size, slot))
+            self._emit(start, slot)
+        while stack:
+            end = stack.pop()[0]
+            self._emit(end, stack[-1][1] if stack else MISS)
+        if not self.starts or self.starts[0] != 0:
+            self.starts.insert(0, 0)
+            self.slots.insert(0, MISS)
+        self._np = None
+
+    def _emit(self, start, slot):
+        if start >= ADDRESS_SPACE:
+            return
+        if self.starts and self.starts[-1] == start:
+            self.starts.pop()
+            self.slots.pop()
+        if self.slots and self.slots[-1] == slot:
+            return
+        self.starts.append(start)
+        self.slots.append(slot)
+
+    @classmethod
+    def from_table_entries(cls, p4info_helper, responses, table_name):
+        """ Builds the index from ReadTableEntries() responses. Actions are
+            the tuple of their parameters (MACs as strings, numbers as
+            ints), None for NoAction and DROP for drop. """
+        table_id = p4info_helper.get_tables_id(table_name)
+        routes = {}
+        for response in responses:
+            for entity in response.entities:
+                entry = entity.table_entry
+                if entry.table_id != table_id or entry.is_default_action:
+                    continue
+                if entry.match:
+                    lpm = entry.match[0].lpm
+                    # values may come back without their leading zero bytes
+                    value = int.from_bytes(lpm.value, 'big')
+                    prefix = (decodeIPv4(value.to_bytes(4, 'big')), lpm.prefix_len)
+                else:
+                    # /0 entries have their match field left out
+                    prefix = ('0.0.0.0', 0)
+                action = entry.action.action
+                name = p4info_helper.get_actions_name(action.action_id)
+                if name.endswith('NoAction'):
+                    routes[prefix] = None
+                elif name.endswith('drop'):
+                    routes[prefix] = DROP
+                else:
+                    params = []
+                    for p in action.params:
+                        info = p4info_helper.get_action_param(name, id=p.param_id)
+                        if info.bitwidth == 48:
+                            params.append(decodeMac(p.value.rjust(6, b'\0')))
+                        else:
+                            params.append(decodeNum(p.value))
+                    routes[prefix] = tuple(params)
+        return cls(routes)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, addr):
+        """ Action of the route `addr` (an int) hits, None on a miss. """
+        slot = self.slots[bisect_right(self.starts, addr) - 1]
+        return self.actions[slot] if slot != MISS else None
+
+    def lookup_slots(self, addrs):
+        """ Slots hit by every address of `addrs`, a numpy uint32 array
+            (or any sequence of ints without numpy). """
+        if np is None:
+            return [self.slots[bisect_right(self.starts, a) - 1] for a in addrs]
+        if self._np is None:
+            self._np = (np.frombuffer(self.starts, dtype=np.uint32),
+                        np.frombuffer(self.slots, dtype=np.int32))
+        starts, slots = self._np
+        return slots[np.searchsorted(starts, addrs, side='right') - 1]
+
+    def lookup_many(self, addrs):
+        return [self.actions[s] if s != MISS else None for s in self.lookup_slots(addrs)]
+
+
+def follow(next_nodes, n_switches, loop_id):
+    """ Where packets starting at every node end up, for one next-hop array
+        or a 2-D stack of them (one per row). Pointer doubling: after k
+        rounds every node points 2**k hops ahead, so log2(n_switches)
+        rounds settle every path; nodes still on a switch are looping. """
+    if np is None:
+        raise ImportError("numpy is required for follow")
+    shape = next_nodes.shape
+    reach = next_nodes.reshape(-1, shape[-1])
+    # row offsets into the flattened stack, so one take() moves all rows
+    offsets = np.arange(0, reach.size, shape[-1], dtype=reach.dtype).reshape(-1, 1)
+    steps = 1
+    while steps < n_switches:
+        reach = np.take(reach, reach + offsets)
+        steps *= 2
+    reach = reach.copy().reshape(shape)
+    reach[reach < n_switches] = loop_id
+    return reach
+
+
+class FibModel(object):
+    """
+        Attributes:
+            topo        : Topology
+            tables      : dict<string, dict<string, LpmIndex>> // sw -> table -> index
+            dscp_tables : dict<int, string> // DSCP -> table applied, others apply none
+
+        Actions are expected to carry the egress port as their last
+        parameter, like ipv4_forward(dstAddr, port).
+    """
+
+    def __init__(self, topo, tables, dscp_tables):
+        self.topo = topo
+        self.tables = tables
+        self.dscp_tables = dscp_tables
+        self.switch_names = sorted(topo.switches, key=lambda sw: (len(sw), sw))
+        self.host_names = sorted(topo.host_links)
+        # sw -> port -> neighbouring switch or host
+        self.out = dict((sw, {}) for sw in self.switch_names)
+        for sw, ports in topo.sw_ports.items():
+            for neighbor, port in ports.items():
+                self.out[sw][port] = neighbor
+        for host, (sw, port) in topo.host_links.items():
+            self.out[sw][port] = host
+
+    def next_node(self, sw, action):
+        if action is None:
+            return BLACKHOLE
+        if action == DROP:
+            return DROPPED
+        return self.out[sw].get(action[-1], BLACKHOLE)
+
+    def trace(self, src_sw, dst, dscp=0):
+        """ Follows a packet to `dst` (dotted quad or int) entering at
+            `src_sw`. Returns (outcome, switches crossed), the outcome being
+            the host it reaches, BLACKHOLE, DROPPED or LOOP. """
+        if not isinstance(dst, int):
+            dst = decodeNum(encodeIPv4(dst))
+        table = self.dscp_tables.get(dscp)
+        path = [src_sw]
+        seen = set(path)
+        while True:
+            sw = path[-1]
+            index = self.tables.get(sw, {}).get(table)
+            if index is None:
+                return BLACKHOLE, path
+            node = self.next_node(sw, index.lookup(dst))
+            if node not in self.out:
+                return node, path
+            if node in seen:
+                path.append(node)
+                return LOOP, path
+            seen.add(node)
+            path.append(node)
+
+    def node_names(self):
+        """ Node ids used by the array methods: switches, then hosts, then
+            the BLACKHOLE, DROPPED and LOOP outcomes. """
+        return self.switch_names + self.host_names + [BLACKHOLE, DROPPED, LOOP]
+
+    def next_hop_array(self, dst, dscp=0):
+        """ Next node of every switch for packets to `dst`, as an int32
+            numpy array indexed by node id. Hosts and outcomes point to
+            themselves. """
+        if np is None:
+            raise ImportError("numpy is required for next_hop_array")
+        if not isinstance(dst, int):
+            dst = decodeNum(encodeIPv4(dst))
+        table = self.dscp_tables.get(dscp)
+        nodes = self.node_names()
+        node_id = dict((n, i) for i, n in enumerate(nodes))
+        next_nodes = np.arange(len(nodes), dtype=np.int32)
+        for k, sw in enumerate(self.switch_names):
+            index = self.tables.get(sw, {}).get(table)
+            action = index.lookup(dst) if index is not None else None
+            next_nodes[k] = node_id[self.next_node(sw, action)]
+        return next_nodes
+
+    def classes(self, table):
+        """ Address intervals every switch treats the same way: the union
+            of all interval boundaries of `table`. Returns (starts, sizes). """
+        bounds = set([0])
+        for sw_tables in self.tables.values():
+            if table in sw_tables:
+                bounds.update(sw_tables[table].starts)
+        starts = sorted(bounds)
+        sizes = [b - a for a, b in zip(starts, starts[1:] + [ADDRESS_SPACE])]
+        return starts, sizes
+
+    def sweep(self, dscp=0):
+        """ Traces one packet per address class from every switch. Returns
+            a list of (src_sw, outcome, class start, class size), covering
+            the whole destination space. """
+        table = self.dscp_tables.get(dscp)
+        starts, sizes = self.classes(table)
+        if np is None:
+            return [(sw, self.trace(sw, start, dscp)[0], start, size)
+                    for sw in self.switch_names
+                    for start, size in zip(starts, sizes)]
+
+        nodes = self.switch_names + self.host_names + [BLACKHOLE, DROPPED, LOOP]
+        node_id = dict((n, i) for i, n in enumerate(nodes))
+        n_sw = len(self.switch_names)
+        # all tables in one sorted array keyed by (switch << 32 | address),
+        # with the node each interval forwards to
+        keys, next_nodes = [], []
+        for k, sw in enumerate(self.switch_names):
+            index = self.tables.get(sw, {}).get(table)
+            if index is None:
+                keys.append(np.array([k << 32], dtype=np.uint64))
+                next_nodes.append(np.array([node_id[BLACKHOLE]], dtype=np.int32))
+                continue
+            ids = [node_id[self.next_node(sw, a)] for a in index.actions]
+            # the miss slot (-1) picks the last element
+            next_of_slot = np.array(ids + [node_id[BLACKHOLE]], dtype=np.int32)
+            starts_k = np.frombuffer(index.starts, dtype=np.uint32).astype(np.uint64)
+            keys.append(starts_k | np.uint64(k << 32))
+            next_nodes.append(next_of_slot[np.frombuffer(index.slots, dtype=np.int32)])
+        keys = np.concatenate(keys)
+        next_nodes = np.concatenate(next_nodes)
+
+        addrs = np.tile(np.array(starts, dtype=np.uint64), n_sw)
+        src = np.repeat(np.arange(n_sw, dtype=np.int32), len(starts))
+        cur = src.copy()
+        lanes = np.arange(len(cur))
+        # a packet still inside the network after visiting as many switches
+        # as there are is looping
+        for _ in range(n_sw):
+            if not len(lanes):
+                break
+            lane_keys = (cur[lanes].astype(np.uint64) << np.uint64(32)) | addrs[lanes]
+            cur[lanes] = next_nodes[np.searchsorted(keys, lane_keys, side='right') - 1]
+            lanes = lanes[cur[lanes] < n_sw]
+        cur[cur < n_sw] = node_id[LOOP]
+
+        size_list = sizes * n_sw
+        return [(self.switch_names[s], nodes[c], a, z)
+                for s, c, a, z in zip(src.tolist(), cur.tolist(), addrs.tolist(), size_list)]
+
+    def check(self, dscp=0):
+        """ Verifies one configuration: every switch must deliver traffic
+            for every host address to that host, and no address may loop.
+            Returns a report dict with the problems found and, for each
+            outcome, the number of addresses summed over source switches. """
+        results = self.sweep(dscp)
+        counts = {}
+        loops = []
+        for sw, outcome, start, size in results:
+            counts[outcome] = counts.get(outcome, 0) + size
+            if outcome == LOOP:
+                loops.append((sw, start, size))
+        # hosts fall in exactly one class each, read their outcome there
+        outcomes = dict(((sw, start), outcome) for sw, outcome, start, _ in results)
+        starts = sorted(set(start for _, _, start, _ in results))
+        unreachable = []
+        for host in self.host_names:
+            addr = decodeNum(encodeIPv4(self.topo.host_ip(host)))
+            start = starts[bisect_right(starts, addr) - 1]
+            for sw in self.switch_names:
+                if outcomes[(sw, start)] != host:
+                    outcome, path = self.trace(sw, addr, dscp)
+                    unreachable.append((sw, host, outcome, path))
+        return {
+            'counts': counts,
+            'loops': loops,
+            'unreachable': unreachable,
+            'classes': len(results) // max(len(self.switch_names), 1),
+        }
@@ -19,8 +19,14 @@ from p4.v1 import p4runtime_pb2
 from p4.config.v1 import p4info_pb2
 
 from .convert import encode
+from .tracing import traced
+
+def _load_args(self, p4_info_filepath, *args, **kwargs):
+    # same parameter name as __init__, for callers passing it by keyword
+    return {'file': p4_info_filepath}
 
 class P4InfoHelper(object):
+    @traced('P4InfoHelper.load', describe=_load_args)
     def __init__(self, p4_info_filepath):
         p4info = p4info_pb2.P4Info()
         # Load the p4info file into a skeleton P4Info object
@@ -0,0 +1,48 @@
+#
+# Minimal HTTP endpoint used by the collectors and controllers to publish
+# their figures on localhost.
+#
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(routes, port, address='127.0.0.1'):
+    """ Serves `routes` on http://<address>:<port>/ from a daemon thread.
+
+        `routes` maps a path to a callable taking no argument. Strings it
+        returns are sent as plain text, anything else as JSON. Returns the
+        server; call shutdown() on it to stop serving.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path)
+            if route is None:
+                self.send_error(404)
+                return
+            body = route()
+            if isinstance(body, str):
+                content_type = 'text/plain; version=0.0.4'
+                data = body.encode('utf-8')
+            else:
+                content_type = 'application/json'
+                data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,151 @@
+#
+# Incremental reader for large JSON documents such as runtime files.
+#
+# Only the document being a top-level object is assumed. Values are
+# decoded one at a time with json's C decoder on a rolling text buffer, so
+# arrays named in `stream_keys` can be walked element by element while
+# memory stays bounded by the largest single element plus one chunk.
+#
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+# what may be left of a number the chunk boundary cut: "1." of "1.5" decodes
+# as 1 with "." left over, "-2.5e" as -2.5 with "e"
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class JsonStreamError(Exception):
+    pass
+
+
+class JsonObjectStream(object):
+
+    def __init__(self, file_handle, chunk_size=CHUNK_SIZE):
+        self.file = file_handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """ Appends the next chunk, dropping what was consumed. Returns
+            False at the end of the file. """
+        if self.eof:
+            return False
+        data = self.file.read(self.chunk_size)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """ Next non-whitespace character, without consuming it. """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise JsonStreamError("unexpected end of JSON document")
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise JsonStreamError("expected %r, found %r" % (chars, c))
+        self.pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # a number cut by the chunk boundary still decodes, read on
+            if (isinstance(value, (int, float)) and NUMBER_TAIL.match(self.buf, end)
+                    and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def items(self, stream_keys=()):
+        """ Yields the (key, value) pairs of the top-level object. For keys
+            in `stream_keys` holding an array, the value is an iterator over
+            its elements; whatever is left of it is skipped before the next
+            pair is read. """
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key in stream_keys and self._peek() == '[':
+                elements = self._array()
+                yield key, elements
+                for _ in elements:
+                    pass
+            else:
+                yield key, self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def self_test():
+    """ Every document decodes the same as with json.loads() whatever the
+        chunk size, down to one byte at a time. """
+    import io
+
+    documents = [
+        '{"table_entries":[1.5]}',
+        '{"a":[-2.5e10]}',
+        '{"a": [1, -0.25, 3E+2, 4e-1, 12345678901234567890], "b": -7}',
+        '{"target": "bmv2", "table_entries": [{"match": {"hdr.ipv4.dstAddr": ["10.0.1.1", 32]},'
+        ' "action_params": {"port": 1}}, {"default_action": true, "x": null}], "n": 1.0}',
+        '{}',
+        '{"e": []}',
+    ]
+    for document in documents:
+        expected = json.loads(document)
+        for chunk_size in (1, 2, 3, 7, CHUNK_SIZE):
+            for stream_keys in ((), tuple(expected)):
+                got = {}
+                stream = JsonObjectStream(io.StringIO(document), chunk_size)
+                for key, value in stream.items(stream_keys):
+                    got[key] = list(value) if key in stream_keys and isinstance(
+                        expected[key], list) else value
+                assert got == expected, (document, chunk_size, got)
+    print("json_stream self test passed")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Incremental JSON reader')
+    parser.add_argument('--self-test', help='decode sample documents in chunks of every size',
+                        action="store_true", required=False, default=False)
+    args = parser.parse_args()
+    if not args.self_test:
+        parser.print_help()
+        parser.exit(1)
+    self_test()
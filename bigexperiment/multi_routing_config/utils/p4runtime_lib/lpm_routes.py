@@ -0,0 +1,80 @@
+#
+# IPv4 forwarding entries of the exercise controllers.
+#
+# The controllers keep their routes as (ip, prefix_len) -> parameters of
+# ipv4_forward, {"dstAddr": mac, "port": port}, merge them with
+# aggregate.py and write one LPM entry per remaining prefix. A prefix
+# whose parameters are None must miss: a shorter aggregate covers it, but
+# the addresses under it had no route.
+#
+from .aggregate import aggregate_routes
+
+FORWARD_ACTION = "MyIngress.ipv4_forward"
+
+# the three-switch triangle the ecn (ex3) and qos (ex4) exercises run on
+TRIANGLE_ROUTES = {
+    # s1 流规则下发
+    's1': {
+        ("10.0.1.1", 32): {"dstAddr": "08:00:00:00:01:01", "port": 2},
+        ("10.0.1.11", 32): {"dstAddr": "08:00:00:00:01:11", "port": 1},
+        ("10.0.2.0", 24): {"dstAddr": "08:00:00:00:02:00", "port": 3},
+        ("10.0.3.0", 24): {"dstAddr": "08:00:00:00:03:00", "port": 4},
+    },
+    # s2 流规则下发
+    's2': {
+        ("10.0.2.2", 32): {"dstAddr": "08:00:00:00:02:02", "port": 2},
+        ("10.0.2.22", 32): {"dstAddr": "08:00:00:00:02:22", "port": 1},
+        ("10.0.1.0", 24): {"dstAddr": "08:00:00:00:01:00", "port": 3},
+        ("10.0.3.0", 24): {"dstAddr": "08:00:00:00:03:00", "port": 4},
+    },
+    # s3 流规则下发
+    's3': {
+        ("10.0.3.3", 32): {"dstAddr": "08:00:00:00:01:01", "port": 1},
+        ("10.0.1.0", 32): {"dstAddr": "08:00:00:00:01:11", "port": 2},
+        ("10.0.2.0", 24): {"dstAddr": "08:00:00:00:02:00", "port": 3},
+    },
+}
+
+
+def lpm_match(prefix, field="hdr.ipv4.dstAddr"):
+    """ match_fields of the LPM entry for `prefix`. P4Runtime wants the
+        field of a /0 entry left out. """
+    if prefix[1] == 0:
+        return {}
+    return {field: list(prefix)}
+
+
+def forward_params(action):
+    """ ipv4_forward parameters of a (dstAddr, port) action, None for None. """
+    if action is None:
+        return None
+    return {"dstAddr": action[0], "port": action[1]}
+
+
+def forward_entry(p4info_helper, table_name, prefix, params, miss_action="NoAction"):
+    """ Entry of `table_name` sending `prefix` to ipv4_forward with
+        `params`. When params is None the entry gets `miss_action`, which
+        must be one of the table's actions and do what a miss does: its
+        default action. """
+    if params is None:
+        return p4info_helper.buildTableEntry(
+            table_name=table_name,
+            match_fields=lpm_match(prefix),
+            action_name=miss_action)
+    return p4info_helper.buildTableEntry(
+        table_name=table_name,
+        match_fields=lpm_match(prefix),
+        action_name=FORWARD_ACTION,
+        action_params=dict(params))
+
+
+def aggregate_forward_routes(routes, aggregate):
+    """ The routes to install, merged unless `aggregate` is 'off'; 'loose'
+        lets addresses without a route take any route. Every value is a new
+        parameter dict, or None for a prefix that must miss. """
+    if aggregate == 'off':
+        return dict((prefix, dict(params)) for prefix, params in routes.items())
+    actions = dict((prefix, (params["dstAddr"], params["port"]))
+                   for prefix, params in routes.items())
+    merged = aggregate_routes(actions, unrouted_is_free=(aggregate == 'loose'))
+    return dict((prefix, forward_params(action)) for prefix, action in merged.items())
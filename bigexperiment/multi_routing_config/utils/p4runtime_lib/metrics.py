@@ -0,0 +1,210 @@
+#
+# Per-RPC metrics for the P4Runtime client.
+#
+# MetricsInterceptor sits on every SwitchConnection channel and records,
+# per switch and per RPC method, a latency histogram, a request size
+# histogram, the number of updates written and the status codes returned.
+# The histograms are stats.Histogram (fixed memory, HDR style), so
+# recording costs a few integer operations and one lock. The figures are
+# read in process through RpcMetrics.snapshot() or in the Prometheus text
+# format through RpcMetrics.prometheus(), which serve() publishes on
+# localhost.
+#
+import threading
+import time
+
+import grpc
+
+from .http_api import serve as http_serve
+from .stats import Histogram
+
+# exposition bucket bounds; the histograms themselves are much finer
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                  0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BOUNDS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RpcStats(object):
+
+    def __init__(self):
+        self.latency_us = Histogram()
+        self.request_bytes = Histogram()
+        self.updates = 0
+        self.codes = {}
+
+    def summary(self):
+        latency = self.latency_us.summary()
+        return {
+            'calls': self.latency_us.count,
+            'latency_ms': dict((k, v / 1000.0 if v is not None and k != 'count' else v)
+                               for k, v in latency.items()),
+            'request_bytes': self.request_bytes.summary(),
+            'updates': self.updates,
+            'codes': dict(self.codes),
+        }
+
+
+def _cumulative(histogram, bounds, scale):
+    """ Counts of values <= each bound (in histogram units / scale). A
+        bucket only counts once its highest value is within the bound, so
+        counts are exact up to the histogram's resolution. """
+    counts = []
+    index = 0
+    seen = 0
+    n = len(histogram.counts)
+    for bound in bounds:
+        limit = int(bound * scale)
+        while index < n and histogram._bounds(index)[1] <= limit:
+            seen += histogram.counts[index]
+            index += 1
+        counts.append(seen)
+    return counts
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in sorted(labels.items()))
+
+
+class RpcMetrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def observe(self, switch, method, seconds, request_bytes, updates, code):
+        with self.lock:
+            stats = self.stats.get((switch, method))
+            if stats is None:
+                stats = self.stats[(switch, method)] = RpcStats()
+            stats.latency_us.record(int(seconds * 1e6))
+            stats.request_bytes.record(request_bytes)
+            stats.updates += updates
+            stats.codes[code] = stats.codes.get(code, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """ {switch: {method: summary}} """
+        with self.lock:
+            snapshot = {}
+            for (switch, method), stats in sorted(self.stats.items()):
+                snapshot.setdefault(switch, {})[method] = stats.summary()
+            return snapshot
+
+    def slowest(self, method='Write', q=0.99):
+        """ Switches sorted by their `q` latency quantile for `method`, in
+            milliseconds, slowest first. """
+        with self.lock:
+            latencies = [(stats.latency_us.quantile(q) / 1000.0, switch)
+                         for (switch, m), stats in self.stats.items()
+                         if m == method and stats.latency_us.count]
+        return [(switch, ms) for ms, switch in sorted(latencies, reverse=True)]
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            items = sorted(self.stats.items())
+            self._histogram_text(lines, items, 'p4runtime_rpc_latency_seconds',
+                                 'P4Runtime client RPC latency.', 'latency_us',
+                                 LATENCY_BOUNDS, 1e6)
+            self._histogram_text(lines, items, 'p4runtime_rpc_request_bytes',
+                                 'Serialized P4Runtime request size.', 'request_bytes',
+                                 SIZE_BOUNDS, 1)
+            lines.append('# HELP p4runtime_rpc_updates_total Updates sent in Write requests.')
+            lines.append('# TYPE p4runtime_rpc_updates_total counter')
+            for (switch, method), stats in items:
+                if stats.updates:
+                    lines.append('p4runtime_rpc_updates_total{%s} %d' % (
+                        _labels(switch=switch, method=method), stats.updates))
+            lines.append('# HELP p4runtime_rpc_completed_total RPCs completed, by status code.')
+            lines.append('# TYPE p4runtime_rpc_completed_total counter')
+            for (switch, method), stats in items:
+                for code, count in sorted(stats.codes.items()):
+                    lines.append('p4runtime_rpc_completed_total{%s} %d' % (
+                        _labels(switch=switch, method=method, code=code), count))
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_text(self, lines, items, name, help, attr, bounds, scale):
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s histogram' % name)
+        for (switch, method), stats in items:
+            histogram = getattr(stats, attr)
+            labels = _labels(switch=switch, method=method)
+            for bound, count in zip(bounds, _cumulative(histogram, bounds, scale)):
+                lines.append('%s_bucket{%s,le="%g"} %d' % (name, labels, bound, count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+            lines.append('%s_sum{%s} %g' % (name, labels, histogram.total / float(scale)))
+            lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+    def serve(self, port, address='127.0.0.1'):
+        """ Publishes /metrics (Prometheus text) and /rpc (JSON) over HTTP. """
+        return http_serve({'/metrics': self.prometheus, '/rpc': self.snapshot},
+                          port, address)
+
+
+# shared by every SwitchConnection unless told otherwise
+METRICS = RpcMetrics()
+
+
+class _TimedStream(object):
+    """ Response iterator of a server-streaming call that reports once the
+        stream ends. """
+
+    def __init__(self, call, done):
+        self._call = call
+        self._done = done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._call)
+        except StopIteration:
+            self._finish(grpc.StatusCode.OK)
+            raise
+        except grpc.RpcError as e:
+            self._finish(e.code())
+            raise
+
+    def _finish(self, code):
+        if self._done is not None:
+            self._done(code)
+            self._done = None
+
+    def __getattr__(self, attr):
+        return getattr(self._call, attr)
+
+
+class MetricsInterceptor(grpc.UnaryUnaryClientInterceptor,
+                         grpc.UnaryStreamClientInterceptor):
+    """ Records every unary and server-streaming call of one switch. The
+        StreamChannel is long-lived and left out. """
+
+    def __init__(self, metrics, switch):
+        self.metrics = metrics
+        self.switch = switch
+
+    def _recorder(self, client_call_details, request):
+        method = client_call_details.method.rsplit('/', 1)[-1]
+        size = request.ByteSize()
+        updates = len(request.updates) if hasattr(request, 'updates') else 0
+        start = time.perf_counter()
+
+        def done(code):
+            self.metrics.observe(self.switch, method, time.perf_counter() - start,
+                                 size, updates, code.name if code is not None else 'UNKNOWN')
+        return done
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        done = self._recorder(client_call_details, request)
+        outcome = continuation(client_call_details, request)
+        outcome.add_done_callback(lambda call: done(call.code()))
+        return outcome
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        done = self._recorder(client_call_details, request)
+        return _TimedStream(continuation(client_call_details, request), done)
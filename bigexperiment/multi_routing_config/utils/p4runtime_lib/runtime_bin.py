@@ -0,0 +1,261 @@
+#
+# Compiled binary form of the sX-runtime.json files.
+#
+# Names in the JSON runtime files are resolved against the p4info once, at
+# compile time, and every table entry is stored as its serialized
+# p4runtime TableEntry, so loading needs neither name lookups nor
+# convert.encode(): records are sliced out of an mmap and merged straight
+# into WriteRequests (SwitchConnection.WriteEncodedTableEntries).
+#
+# Layout, little endian:
+#   header   MAGIC, u32 entry count, u64 conf offset, u32 conf length
+#   entries  per entry: u32 length, u8 flags, serialized TableEntry
+#   conf     JSON object, the runtime file without table_entries plus
+#            'p4info_sha1' of the p4info the ids come from
+#
+# The conf goes last so that keys following table_entries in the JSON file
+# are known by the time it is written, in a single pass.
+#
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b'P4RTBIN1'
+SUFFIX = '.p4rtb'
+HEADER = struct.Struct('<8sIQI')
+RECORD = struct.Struct('<IB')
+FLAG_DEFAULT_ACTION = 0x1
+
+
+class RuntimeBinaryError(Exception):
+    pass
+
+
+def p4info_digest(p4info_fpath):
+    import hashlib
+    with open(p4info_fpath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def is_runtime_binary(file_handle):
+    """ True if the open file starts with MAGIC, whatever its mode. """
+    try:
+        return os.pread(file_handle.fileno(), len(MAGIC), 0) == MAGIC
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def write_runtime_binary(out_file, sw_conf, encoded_entries):
+    """ Writes a compiled runtime file. `encoded_entries` yields
+        (is_default_action, TableEntry bytes); `sw_conf` is only serialized
+        after it is exhausted. `out_file` must be seekable and opened in
+        binary mode. Returns the number of entries. """
+    start = out_file.tell()
+    out_file.write(HEADER.pack(MAGIC, 0, 0, 0))
+    count = 0
+    for is_default_action, data in encoded_entries:
+        flags = FLAG_DEFAULT_ACTION if is_default_action else 0
+        out_file.write(RECORD.pack(len(data), flags))
+        out_file.write(data)
+        count += 1
+    conf_offset = out_file.tell() - start
+    conf = json.dumps(sw_conf, sort_keys=True).encode('utf-8')
+    out_file.write(conf)
+    end = out_file.tell()
+    out_file.seek(start)
+    out_file.write(HEADER.pack(MAGIC, count, conf_offset, len(conf)))
+    out_file.seek(end)
+    return count
+
+
+class RuntimeBinary(object):
+    """ Read-only view of a compiled runtime file. """
+
+    def __init__(self, file_handle):
+        self.mmap = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise RuntimeBinaryError("file too short for a compiled runtime file")
+        magic, self.count, self.conf_offset, conf_len = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise RuntimeBinaryError("bad magic %r" % magic)
+        if self.conf_offset + conf_len != len(self.mmap):
+            raise RuntimeBinaryError("truncated compiled runtime file")
+        self.conf = json.loads(
+            self.mmap[self.conf_offset:self.conf_offset + conf_len].decode('utf-8'))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.mmap.close()
+
+    def encoded_entries(self):
+        """ Yields (is_default_action, TableEntry bytes) in file order. """
+        buf = self.mmap
+        unpack_from = RECORD.unpack_from
+        record_size = RECORD.size
+        offset = HEADER.size
+        for _ in range(self.count):
+            length, flags = unpack_from(buf, offset)
+            offset += record_size
+            yield bool(flags & FLAG_DEFAULT_ACTION), buf[offset:offset + length]
+            offset += length
+        if offset != self.conf_offset:
+            raise RuntimeBinaryError("entries end at %d, conf starts at %d" % (
+                offset, self.conf_offset))
+
+    def table_entries(self):
+        """ Yields the entries as TableEntry messages. """
+        from p4.v1 import p4runtime_pb2
+        for _, data in self.encoded_entries():
+            yield p4runtime_pb2.TableEntry.FromString(data)
+
+
+def compile_runtime(sw_conf_file, out_file, workdir, p4info_fpath=None):
+    """ Compiles the JSON runtime file `sw_conf_file` into `out_file`.
+        Ids come from `p4info_fpath`, by default the file's own p4info.
+        Returns the number of table entries. """
+    from .helper import P4InfoHelper
+    from .simple_controller import stream_switch_conf, buildTableEntry
+
+    sw_conf, flows = stream_switch_conf(sw_conf_file)
+    if p4info_fpath is None:
+        if 'p4info' not in sw_conf:
+            raise RuntimeBinaryError("no p4info given and none before table_entries")
+        p4info_fpath = os.path.join(workdir, sw_conf['p4info'])
+    p4info_helper = P4InfoHelper(p4info_fpath)
+
+    def encode():
+        for flow in flows:
+            table_entry = buildTableEntry(flow, p4info_helper)
+            yield table_entry.is_default_action, table_entry.SerializeToString()
+        sw_conf['p4info_sha1'] = p4info_digest(p4info_fpath)
+
+    return write_runtime_binary(out_file, sw_conf, encode())
+
+
+def check_round_trip(json_fpath, bin_fpath, workdir, p4info_fpath=None):
+    """ Compares a compiled file with its JSON source as simple_controller
+        loads each: the TableEntry messages it writes for the JSON file
+        (load_switch_conf() and buildTableEntries()) and for the compiled
+        one (the stored bytes WriteEncodedTableEntries() merges) must
+        serialize to the same bytes, with the same default action flag,
+        and the conf must match. Returns a list of differences. """
+    from itertools import zip_longest
+    from p4.v1 import p4runtime_pb2
+    from .helper import P4InfoHelper
+    from .simple_controller import load_switch_conf, buildTableEntries
+
+    problems = []
+    with open(json_fpath) as sw_conf_file:
+        sw_conf, flows = load_switch_conf(sw_conf_file)
+    with open(bin_fpath, 'rb') as bin_file:
+        runtime = RuntimeBinary(bin_file)
+    try:
+        if p4info_fpath is None:
+            p4info_fpath = os.path.join(workdir, runtime.conf['p4info'])
+        p4info_helper = P4InfoHelper(p4info_fpath)
+        if runtime.conf.get('p4info_sha1') != p4info_digest(p4info_fpath):
+            problems.append("compiled for another p4info")
+        json_count = bin_count = 0
+        pairs = zip_longest(buildTableEntries(flows, p4info_helper, verbose=False),
+                            runtime.encoded_entries())
+        for n, (table_entry, record) in enumerate(pairs):
+            if table_entry is not None:
+                json_count += 1
+            if record is not None:
+                bin_count += 1
+            if table_entry is None or record is None:
+                continue
+            is_default_action, data = record
+            expected = table_entry.SerializeToString(deterministic=True)
+            # as it goes out once merged into a WriteRequest
+            compiled = p4runtime_pb2.TableEntry.FromString(bytes(data))
+            if (compiled.SerializeToString(deterministic=True) != expected
+                    or is_default_action != table_entry.is_default_action):
+                problems.append("entry %d differs: %r" % (n, flows[n]))
+        if json_count != bin_count:
+            problems.append("%d entries in JSON, %d compiled" % (json_count, bin_count))
+        conf = dict(runtime.conf)
+        conf.pop('p4info_sha1', None)
+        if conf != sw_conf:
+            problems.append("conf differs: %r != %r" % (conf, sw_conf))
+    finally:
+        runtime.close()
+    return problems
+
+
+def self_test():
+    """ Round trip of the container format alone, without p4runtime. """
+    import io
+    import random
+    import tempfile
+
+    rng = random.Random(1)
+    records = [(rng.random() < 0.1, bytes(rng.getrandbits(8) for _ in range(rng.randrange(300))))
+               for _ in range(1000)]
+    conf = {'target': 'bmv2', 'p4info': 'build/x.p4info.txt', 'bmv2_json': 'build/x.json',
+            'multicast_group_entries': [{'multicast_group_id': 1, 'replicas': []}]}
+    with tempfile.TemporaryFile() as f:
+        assert write_runtime_binary(f, conf, iter(records)) == len(records)
+        f.seek(0)
+        assert is_runtime_binary(f)
+        runtime = RuntimeBinary(f)
+        assert runtime.conf == conf and len(runtime) == len(records)
+        assert list(runtime.encoded_entries()) == records
+        runtime.close()
+        f.truncate(f.seek(0, io.SEEK_END) - 1)
+        try:
+            RuntimeBinary(f)
+            raise AssertionError("truncated file accepted")
+        except RuntimeBinaryError:
+            pass
+    assert not is_runtime_binary(io.StringIO('{"target": "bmv2"}'))
+    print("runtime_bin self test passed")
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Compile runtime JSON files for fast loading')
+    parser.add_argument('runtime_json', help='runtime configuration files (JSON) to compile',
+                        type=str, nargs='*')
+    parser.add_argument('-p', '--p4info', help='p4info file to resolve names with '
+                        '(default: the one named in each file)',
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('-o', '--output', help='output file, for a single input '
+                        '(default: input with %s suffix)' % SUFFIX,
+                        type=str, action="store", required=False, default=None)
+    parser.add_argument('--check', help='verify that the compiled file makes simple_controller '
+                        'write the same table entries as the JSON source (exit status 1 if not)',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--self-test', help='only test the file format, needs no p4info',
+                        action="store_true", required=False, default=False)
+    args = parser.parse_args()
+
+    if args.self_test:
+        self_test()
+        sys.exit(0)
+    if not args.runtime_json or (args.output and len(args.runtime_json) > 1):
+        parser.print_help()
+        parser.exit(1)
+
+    failed = False
+    for json_fpath in args.runtime_json:
+        bin_fpath = args.output or os.path.splitext(json_fpath)[0] + SUFFIX
+        start = time.time()
+        with open(json_fpath) as sw_conf_file, open(bin_fpath, 'wb') as out_file:
+            count = compile_runtime(sw_conf_file, out_file, os.getcwd(), args.p4info)
+        print("%s -> %s: %d entries in %.2fs, %d -> %d bytes" % (
+            json_fpath, bin_fpath, count, time.time() - start,
+            os.path.getsize(json_fpath), os.path.getsize(bin_fpath)))
+        if args.check:
+            problems = check_round_trip(json_fpath, bin_fpath, os.getcwd(), args.p4info)
+            for problem in problems[:10]:
+                print("  " + problem)
+            failed = failed or bool(problems)
+            print("  round trip %s" % ('FAILED' if problems else 'ok'))
+    sys.exit(1 if failed else 0)
@@ -14,13 +14,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-import argparse
 import json
 import os
 import sys
+import time
 
-from . import bmv2
-from . import helper
+from . import runtime_bin
+from .json_stream import JsonObjectStream
+from .tracing import span
+
+# bmv2 (grpc) and helper (protobuf) are imported by program_switch() only,
+# so that loading and checking runtime files stays cheap
 
 
 def error(msg):
@@ -35,6 +39,8 @@ class ConfException(Exception):
 
 
 def main():
+    import argparse
+
     parser = argparse.ArgumentParser(description='P4Runtime Simple Controller')
 
     parser.add_argument('-a', '--p4runtime-server-addr',
@@ -47,8 +53,17 @@ def main():
                         help='path to file where to dump protobuf messages sent to the switch',
                         type=str, action="store", required=True)
     parser.add_argument("-c", '--runtime-conf-file',
-                        help="path to input runtime configuration file (JSON)",
+                        help="path to input runtime configuration file (JSON, or compiled by runtime_bin.py)",
                         type=str, action="store", required=True)
+    parser.add_argument('-s', '--stream',
+                        help='parse table entries incrementally instead of loading the whole file',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('-q', '--quiet',
+                        help='do not print every entry',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('-b', '--batch-size',
+                        help='table entries sent per WriteRequest (default: switch.WRITE_BATCH_SIZE)',
+                        type=int, action="store", required=False, default=None)
 
     args = parser.parse_args()
 
@@ -60,7 +75,10 @@ def main():
                        device_id=args.device_id,
                        sw_conf_file=sw_conf_file,
                        workdir=workdir,
-                       proto_dump_fpath=args.proto_dump_file)
+                       proto_dump_fpath=args.proto_dump_file,
+                       stream=args.stream,
+                       verbose=not args.quiet,
+                       batch_size=args.batch_size)
 
 
 def check_switch_conf(sw_conf, workdir):
@@ -88,16 +106,76 @@ def check_switch_conf(sw_conf, workdir):
             raise ConfException("file does not exist %s" % real_path)
 
 
-def program_switch(addr, device_id, sw_conf_file, workdir, proto_dump_fpath):
+def load_switch_conf(sw_conf_file):
+    """ Returns (sw_conf, table_entries) for a runtime file read in one go.
+        table_entries is an iterable over the entries. """
     sw_conf = json_load_byteified(sw_conf_file)
+    return sw_conf, sw_conf.pop('table_entries', [])
+
+
+def stream_switch_conf(sw_conf_file):
+    """ Same as load_switch_conf(), but table_entries is an iterator that
+        parses one entry at a time from the file. Keys listed after
+        table_entries are found by reading the file once more. """
+    sw_conf = {}
+    table_entries = iter(())
+    pairs = JsonObjectStream(sw_conf_file).items(stream_keys=('table_entries',))
+    for key, value in pairs:
+        if key != 'table_entries':
+            sw_conf[key] = value
+        elif 'target' in sw_conf and 'p4info' in sw_conf and 'bmv2_json' in sw_conf:
+            # the entries are read while the caller consumes them
+            table_entries = _entries_then_rest(value, pairs, sw_conf)
+            break
+        else:
+            # skip the entries now, stream them again once the rest is known
+            table_entries = _entries_only(sw_conf_file)
+    return sw_conf, table_entries
+
+
+def _entries_then_rest(entries, pairs, sw_conf):
+    for entry in entries:
+        yield entry
+    for key, value in pairs:
+        sw_conf[key] = value
+
+
+def _entries_only(sw_conf_file):
+    sw_conf_file.seek(0)
+    for key, value in JsonObjectStream(sw_conf_file).items(stream_keys=('table_entries',)):
+        if key == 'table_entries':
+            for entry in value:
+                yield entry
+            return
+
+
+def program_switch(addr, device_id, sw_conf_file, workdir, proto_dump_fpath,
+                   stream=False, verbose=True, batch_size=None, clear=False):
+    from . import bmv2
+    from . import helper
+    from .switch import WRITE_BATCH_SIZE
+
+    if batch_size is None:
+        batch_size = WRITE_BATCH_SIZE
+    # files compiled by runtime_bin.py are recognised whatever the options
+    compiled = None
+    if runtime_bin.is_runtime_binary(sw_conf_file):
+        compiled = runtime_bin.RuntimeBinary(sw_conf_file)
+        sw_conf = compiled.conf
+    elif stream:
+        sw_conf, table_entries = stream_switch_conf(sw_conf_file)
+    else:
+        sw_conf, table_entries = load_switch_conf(sw_conf_file)
     try:
         check_switch_conf(sw_conf=sw_conf, workdir=workdir)
+        p4info_fpath = os.path.join(workdir, sw_conf['p4info'])
+        if compiled and sw_conf.get('p4info_sha1') != runtime_bin.p4info_digest(p4info_fpath):
+            raise ConfException("compiled for another version of %s, recompile it" % p4info_fpath)
     except ConfException as e:
         error("While parsing input runtime configuration: %s" % str(e))
         return
 
     info('Using P4Info file %s...' % sw_conf['p4info'])
-    p4info_fpath = os.path.join(workdir, sw_conf['p4info'])
     p4info_helper = helper.P4InfoHelper(p4info_fpath)
 
     target = sw_conf['target']
@@ -121,12 +199,30 @@ def program_switch(addr, device_id, sw_conf_file, workdir, proto_dump_fpath):
         else:
             raise Exception("Should not be here")
 
-        if 'table_entries' in sw_conf:
-            table_entries = sw_conf['table_entries']
+        if clear:
+            # a warm switch may keep entries across a pipeline push
+            info("Deleted %d table entries" % sw.ClearTableEntries(batch_size=batch_size))
+
+        if compiled:
+            info("Inserting %d compiled table entries..." % len(compiled))
+        elif stream:
+            info("Inserting table entries...")
+        else:
             info("Inserting %d table entries..." % len(table_entries))
-            for entry in table_entries:
-                info(tableEntryToString(entry))
-                insertTableEntry(sw, entry, p4info_helper)
+        start = time.time()
+        with span('program_switch.table_entries', address=addr) as entries_span:
+            if compiled:
+                count = sw.WriteEncodedTableEntries(compiled.encoded_entries(),
+                                                    batch_size=batch_size)
+            else:
+                count = sw.WriteTableEntries(
+                    buildTableEntries(table_entries, p4info_helper, verbose),
+                    batch_size=batch_size)
+            entries_span.set(entries=count)
+        elapsed = time.time() - start
+        if count:
+            info("Inserted %d table entries in %.2fs (%.0f entries/s)" % (
+                count, elapsed, count / elapsed if elapsed > 0 else 0))
 
         if 'multicast_group_entries' in sw_conf:
             group_entries = sw_conf['multicast_group_entries']
@@ -144,9 +240,20 @@ def program_switch(addr, device_id, sw_conf_file, workdir, proto_dump_fpath):
 
     finally:
         sw.shutdown()
+        if compiled:
+            compiled.close()
 
 
-def insertTableEntry(sw, flow, p4info_helper):
+def buildTableEntries(flows, p4info_helper, verbose=True):
+    """ Builds the protobuf of each entry only when the writer asks for
+        it, so no more than one batch is held at a time. """
+    for flow in flows:
+        if verbose:
+            info(tableEntryToString(flow))
+        yield buildTableEntry(flow, p4info_helper)
+
+
+def buildTableEntry(flow, p4info_helper):
     table_name = flow['table']
     match_fields = flow.get('match') # None if not found
     action_name = flow['action_name']
@@ -154,7 +261,7 @@ def insertTableEntry(sw, flow, p4info_helper):
     action_params = flow['action_params']
     priority = flow.get('priority')  # None if not found
 
-    table_entry = p4info_helper.buildTableEntry(
+    return p4info_helper.buildTableEntry(
         table_name=table_name,
         match_fields=match_fields,
         default_action=default_action,
@@ -162,7 +269,9 @@ def insertTableEntry(sw, flow, p4info_helper):
         action_params=action_params,
         priority=priority)
 
-    sw.WriteTableEntry(table_entry)
+
+def insertTableEntry(sw, flow, p4info_helper):
+    sw.WriteTableEntry(buildTableEntry(flow, p4info_helper))
 
 
 def json_load_byteified(file_handle):
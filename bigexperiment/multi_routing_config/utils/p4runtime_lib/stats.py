@@ -0,0 +1,181 @@
+#
+# Fixed-memory streaming statistics used by the telemetry collectors.
+#
+# Nothing in here allocates per sample: every structure is backed by an
+# array sized up front, so the collectors can run for as long as needed
+# without their memory growing with traffic.
+#
+from array import array
+
+
+class Histogram(object):
+    """ Log-linear histogram over non-negative integers, HDR style.
+
+        Values below 2 * 2**precision_bits are counted exactly; larger values
+        fall into buckets whose width keeps the relative error of any
+        reported quantile under 2**-precision_bits. Values above max_value
+        are clamped into the last bucket.
+    """
+
+    def __init__(self, max_value=(1 << 32) - 1, precision_bits=4):
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.max_value = max_value
+        self.counts = array('Q', bytes(8 * (self._index(max_value) + 1)))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.precision_bits - 1
+        if shift <= 0:
+            return value
+        return shift * self.sub_buckets + (value >> shift)
+
+    def _bounds(self, index):
+        """ Lowest and highest value counted in bucket `index`. """
+        if index < 2 * self.sub_buckets:
+            return index, index
+        shift = index // self.sub_buckets - 1
+        mantissa = index - shift * self.sub_buckets
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        if value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return float(self.total) / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """ Value at quantile `q` (0 <= q <= 1), or None when empty. """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            if seen > rank:
+                low, high = self._bounds(index)
+                return min(max((low + high) // 2, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        return dict((q, self.quantile(q)) for q in qs)
+
+    def summary(self, qs=(0.5, 0.9, 0.99)):
+        summary = {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean(),
+        }
+        for q in qs:
+            summary['p%g' % (q * 100)] = self.quantile(q)
+        return summary
+
+
+class RingBuffer(object):
+    """ Fixed-size time series of (timestamp, value) samples. Once full,
+        each new sample overwrites the oldest one. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.head = 0
+        self.size = 0
+
+    def append(self, timestamp, value):
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def last(self):
+        """ Most recent (timestamp, value) sample, or None when empty. """
+        if not self.size:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.times[i], self.values[i]
+
+    def samples(self):
+        """ Samples from the oldest to the most recent. """
+        start = (self.head - self.size) % self.capacity
+        for n in range(self.size):
+            i = (start + n) % self.capacity
+            yield self.times[i], self.values[i]
+
+    def mean(self):
+        if not self.size:
+            return 0.0
+        if self.size == self.capacity:
+            return sum(self.values) / self.size
+        return sum(v for _, v in self.samples()) / self.size
+
+
+class SlidingWindow(object):
+    """ Counts events and marked events over the last `span` seconds.
+
+        The span is split into `buckets` time slots kept in arrays; adding
+        an event only touches the current slot, and expired slots are
+        subtracted from the running sums as time moves on, so every update
+        is O(1) amortized whatever the event rate.
+    """
+
+    def __init__(self, span=1.0, buckets=10):
+        self.span = span
+        self.buckets = buckets
+        self.width = float(span) / buckets
+        self.totals = array('Q', bytes(8 * buckets))
+        self.marks = array('Q', bytes(8 * buckets))
+        self.total = 0
+        self.marked = 0
+        self.current = None
+
+    def _advance(self, now):
+        slot = int(now / self.width)
+        if self.current is None:
+            self.current = slot
+            return
+        for step in range(1, min(slot - self.current, self.buckets) + 1):
+            i = (self.current + step) % self.buckets
+            self.total -= self.totals[i]
+            self.marked -= self.marks[i]
+            self.totals[i] = 0
+            self.marks[i] = 0
+        if slot > self.current:
+            self.current = slot
+
+    def add(self, now, total=1, marked=0):
+        self._advance(now)
+        i = self.current % self.buckets
+        self.totals[i] += total
+        self.marks[i] += marked
+        self.total += total
+        self.marked += marked
+
+    def fraction(self, now=None):
+        """ Fraction of marked events in the window, 0.0 when empty. """
+        if now is not None:
+            self._advance(now)
+        return float(self.marked) / self.total if self.total else 0.0
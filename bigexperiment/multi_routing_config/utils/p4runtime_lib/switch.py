@@ -21,24 +21,44 @@ from p4.v1 import p4runtime_pb2
 from p4.v1 import p4runtime_pb2_grpc
 from p4.tmp import p4config_pb2
 
+from .metrics import METRICS, MetricsInterceptor
+from .tracing import traced
+
 MSG_LOG_MAX_LEN = 1024
+# Maximum number of updates packed into a single batched WriteRequest
+WRITE_BATCH_SIZE = 1024
 
 # List of all active connections
 connections = []
 
+def _switch_args(self, *args, **kwargs):
+    return {'switch': self.name}
+
+def _connect_args(self, name=None, address='127.0.0.1:50051', *args, **kwargs):
+    return {'switch': name, 'address': address}
+
+def _write_type(modify):
+    # default actions are always there and can only be modified
+    return p4runtime_pb2.Update.MODIFY if modify else p4runtime_pb2.Update.INSERT
+
 def ShutdownAllSwitchConnections():
     for c in connections:
         c.shutdown()
 
 class SwitchConnection(object):
 
+    @traced('SwitchConnection.connect', describe=_connect_args)
     def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
-                 proto_dump_file=None):
+                 proto_dump_file=None, metrics=METRICS):
         self.name = name
         self.address = address
         self.device_id = device_id
         self.p4info = None
         self.channel = grpc.insecure_channel(self.address)
+        # innermost, so the time spent logging is not counted as RPC latency
+        if metrics is not None:
+            self.channel = grpc.intercept_channel(
+                self.channel, MetricsInterceptor(metrics, name or address))
         if proto_dump_file is not None:
             interceptor = GrpcRequestLogger(proto_dump_file)
             self.channel = grpc.intercept_channel(self.channel, interceptor)
@@ -56,6 +76,7 @@ class SwitchConnection(object):
         self.requests_stream.close()
         self.stream_msg_resp.cancel()
 
+    @traced('SwitchConnection.MasterArbitrationUpdate', describe=_switch_args)
     def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
         request = p4runtime_pb2.StreamMessageRequest()
         request.arbitration.device_id = self.device_id
@@ -69,6 +90,7 @@ class SwitchConnection(object):
             for item in self.stream_msg_resp:
                 return item # just one
 
+    @traced('SwitchConnection.SetForwardingPipelineConfig', describe=_switch_args)
     def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
         device_config = self.buildDeviceConfig(**kwargs)
         request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
@@ -85,6 +107,7 @@ class SwitchConnection(object):
         else:
             self.client_stub.SetForwardingPipelineConfig(request)
 
+    @traced('SwitchConnection.WriteTableEntry', describe=_switch_args)
     def WriteTableEntry(self, table_entry, dry_run=False):
         request = p4runtime_pb2.WriteRequest()
         request.device_id = self.device_id
@@ -100,6 +123,77 @@ class SwitchConnection(object):
         else:
             self.client_stub.Write(request)
 
+    @traced('SwitchConnection.WriteTableEntries', describe=_switch_args)
+    def WriteTableEntries(self, table_entries, batch_size=WRITE_BATCH_SIZE,
+                          modify=False, dry_run=False):
+        """Writes the entries using one WriteRequest per `batch_size` updates
+        instead of one round trip per entry. Entries are inserted unless
+        `modify` is set. Returns the number of entries."""
+        return self._writeBatched(
+            ((_write_type(modify or table_entry.is_default_action), table_entry)
+             for table_entry in table_entries), batch_size, dry_run)
+
+    @traced('SwitchConnection.WriteEncodedTableEntries', describe=_switch_args)
+    def WriteEncodedTableEntries(self, records, batch_size=WRITE_BATCH_SIZE,
+                                 dry_run=False):
+        """Same as WriteTableEntries() for entries already serialized, given
+        as (is_default_action, TableEntry bytes) pairs, e.g. from a compiled
+        runtime file (runtime_bin.py)."""
+        return self._writeBatched(
+            ((_write_type(is_default_action), data) for is_default_action, data in records),
+            batch_size, dry_run)
+
+    @traced('SwitchConnection.DeleteTableEntries', describe=_switch_args)
+    def DeleteTableEntries(self, table_entries, batch_size=WRITE_BATCH_SIZE,
+                           dry_run=False):
+        """Deletes the entries, `batch_size` per WriteRequest. Returns the
+        number of entries."""
+        return self._writeBatched(
+            ((p4runtime_pb2.Update.DELETE, table_entry) for table_entry in table_entries),
+            batch_size, dry_run)
+
+    def _writeBatched(self, updates, batch_size=WRITE_BATCH_SIZE, dry_run=False):
+        """Sends (update type, TableEntry or its serialized bytes) `updates`,
+        `batch_size` per WriteRequest. Returns the number of updates."""
+        count = 0
+        request = None
+        for update_type, table_entry in updates:
+            if request is None:
+                request = p4runtime_pb2.WriteRequest()
+                request.device_id = self.device_id
+                request.election_id.low = 1
+            update = request.updates.add()
+            update.type = update_type
+            if isinstance(table_entry, bytes):
+                update.entity.table_entry.MergeFromString(table_entry)
+            else:
+                update.entity.table_entry.CopyFrom(table_entry)
+            count += 1
+            if len(request.updates) >= batch_size:
+                self._write(request, dry_run)
+                request = None
+        if request is not None:
+            self._write(request, dry_run)
+        return count
+
+    @traced('SwitchConnection.ClearTableEntries', describe=_switch_args)
+    def ClearTableEntries(self, batch_size=WRITE_BATCH_SIZE, dry_run=False):
+        """Deletes every entry of every table. Default actions are not
+        entries and stay. Returns the number of entries deleted."""
+        table_entries = [entity.table_entry
+                         for response in self.ReadTableEntries()
+                         for entity in response.entities
+                         if not entity.table_entry.is_default_action]
+        return self.DeleteTableEntries(table_entries, batch_size, dry_run)
+
+    @traced('SwitchConnection.Write', describe=_switch_args)
+    def _write(self, request, dry_run=False):
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            self.client_stub.Write(request)
+
+    @traced('SwitchConnection.ReadTableEntries', describe=_switch_args)
     def ReadTableEntries(self, table_id=None, dry_run=False):
         request = p4runtime_pb2.ReadRequest()
         request.device_id = self.device_id
@@ -115,6 +209,7 @@ class SwitchConnection(object):
             for response in self.client_stub.Read(request):
                 yield response
 
+    @traced('SwitchConnection.ReadCounters', describe=_switch_args)
     def ReadCounters(self, counter_id=None, index=None, dry_run=False):
         request = p4runtime_pb2.ReadRequest()
         request.device_id = self.device_id
@@ -132,7 +227,26 @@ class SwitchConnection(object):
             for response in self.client_stub.Read(request):
                 yield response
 
+    @traced('SwitchConnection.ReadRegisters', describe=_switch_args)
+    def ReadRegisters(self, register_id=None, index=None, dry_run=False):
+        request = p4runtime_pb2.ReadRequest()
+        request.device_id = self.device_id
+        entity = request.entities.add()
+        register_entry = entity.register_entry
+        if register_id is not None:
+            register_entry.register_id = register_id
+        else:
+            register_entry.register_id = 0
+        if index is not None:
+            register_entry.index.index = index
+        if dry_run:
+            print("P4Runtime Read:", request)
+        else:
+            for response in self.client_stub.Read(request):
+                yield response
+
 
+    @traced('SwitchConnection.WritePREEntry', describe=_switch_args)
     def WritePREEntry(self, pre_entry, dry_run=False):
         request = p4runtime_pb2.WriteRequest()
         request.device_id = self.device_id
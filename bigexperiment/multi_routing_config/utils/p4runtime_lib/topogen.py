@@ -0,0 +1,267 @@
+#
+# Synthetic topologies for scale testing.
+#
+# Generates the switch graph of a fat-tree, leaf-spine, ring, grid or
+# random regular network, attaches hosts to it and writes the result in the
+# topology.json format of run_exercise.py, together with one runtime JSON
+# per switch holding the IPv4 routes simple_controller installs.
+#
+# Address plan, for switch number N (sN) and host number J on that switch:
+#   host IP        10.<N / 256>.<N % 256>.<J>/24
+#   host MAC       08:00:0a followed by the last three bytes of the IP
+#   gateway IP     10.<N / 256>.<N % 256>.254
+#   switch port P  08:00:00:<N / 256>:<N % 256>:<P>
+# Each switch routes the /24 of every other switch to the next hop of a
+# shortest path (Topology.next_hops) and its own hosts by /32.
+#
+import json
+import os
+import random
+
+from .topology import Topology
+
+GATEWAY_HOST = 254
+MAX_HOSTS_PER_SWITCH = 253
+DEFAULT_TABLES = ('MyIngress.ipv4_lpm',)
+FORWARD_ACTION = 'MyIngress.ipv4_forward'
+
+
+class TopologyError(Exception):
+    pass
+
+
+def fat_tree(k):
+    """ k-ary fat-tree: k pods of k/2 edge and k/2 aggregation switches and
+        (k/2)^2 core switches. Returns (switch count, links, edge switches),
+        switches numbered from 1, edges first. """
+    if k < 2 or k % 2:
+        raise TopologyError('fat-tree needs an even k >= 2, got %d' % k)
+    half = k // 2
+    edge = lambda pod, i: 1 + pod * half + i
+    agg = lambda pod, i: 1 + k * half + pod * half + i
+    core = lambda i, j: 1 + k * k + i * half + j
+    links = []
+    for pod in range(k):
+        for i in range(half):
+            for j in range(half):
+                links.append((edge(pod, i), agg(pod, j)))
+                links.append((agg(pod, i), core(i, j)))
+    return k * k + half * half, links, [edge(pod, i) for pod in range(k) for i in range(half)]
+
+
+def leaf_spine(leaves, spines):
+    """ Every leaf (s1..) connected to every spine. """
+    links = [(leaf, leaves + spine)
+             for leaf in range(1, leaves + 1) for spine in range(1, spines + 1)]
+    return leaves + spines, links, list(range(1, leaves + 1))
+
+
+def ring(n):
+    if n < 3:
+        raise TopologyError('a ring needs at least 3 switches, got %d' % n)
+    links = [(i, i % n + 1) for i in range(1, n + 1)]
+    return n, links, list(range(1, n + 1))
+
+
+def grid(rows, cols):
+    number = lambda r, c: 1 + r * cols + c
+    links = []
+    for r in range(rows):
+        for c in range(cols):
+            if c + 1 < cols:
+                links.append((number(r, c), number(r, c + 1)))
+            if r + 1 < rows:
+                links.append((number(r, c), number(r + 1, c)))
+    return rows * cols, links, list(range(1, rows * cols + 1))
+
+
+def random_regular(n, degree, seed=0, attempts=100):
+    """ Connected random `degree`-regular graph on n switches, found by
+        pairing port stubs at random until the pairing is simple. """
+    if degree >= n or (n * degree) % 2:
+        raise TopologyError('no %d-regular graph on %d switches' % (degree, n))
+    rng = random.Random(seed)
+    for _ in range(attempts):
+        stubs = [sw for sw in range(1, n + 1) for _ in range(degree)]
+        rng.shuffle(stubs)
+        links = set()
+        for a, b in zip(stubs[::2], stubs[1::2]):
+            if a == b or (min(a, b), max(a, b)) in links:
+                break
+            links.add((min(a, b), max(a, b)))
+        else:
+            links = sorted(links)
+            if _connected(n, links):
+                return n, links, list(range(1, n + 1))
+    raise TopologyError('no connected %d-regular graph on %d switches after %d attempts'
+                        % (degree, n, attempts))
+
+
+def _connected(n, links):
+    neighbors = dict((sw, []) for sw in range(1, n + 1))
+    for a, b in links:
+        neighbors[a].append(b)
+        neighbors[b].append(a)
+    seen = set([1])
+    pending = [1]
+    while pending:
+        for neighbor in neighbors[pending.pop()]:
+            if neighbor not in seen:
+                seen.add(neighbor)
+                pending.append(neighbor)
+    return len(seen) == n
+
+
+GENERATORS = {
+    'fat-tree': fat_tree,
+    'leaf-spine': leaf_spine,
+    'ring': ring,
+    'grid': grid,
+    'random-regular': random_regular,
+}
+
+
+def switch_subnet(sw):
+    return '10.%d.%d' % (sw >> 8, sw & 0xff)
+
+
+def port_mac(sw, port):
+    return '08:00:00:%02x:%02x:%02x' % (sw >> 8, sw & 0xff, port)
+
+
+def host_mac(sw, index):
+    return '08:00:0a:%02x:%02x:%02x' % (sw >> 8, sw & 0xff, index)
+
+
+def build_topology(switch_count, links, edge_switches, hosts_per_switch=1,
+                   runtime_dir=None):
+    """ topology.json contents for the switch graph. Ports are numbered in
+        link order, switch links first, then hosts. With `runtime_dir`,
+        every switch refers to its <runtime_dir>/sN-runtime.json. """
+    if switch_count > 0xffff:
+        raise TopologyError('the address plan allows at most 65535 switches')
+    if hosts_per_switch > MAX_HOSTS_PER_SWITCH:
+        raise TopologyError('the address plan allows at most %d hosts per switch'
+                            % MAX_HOSTS_PER_SWITCH)
+    next_port = [1] * (switch_count + 1)
+
+    def port(sw):
+        next_port[sw] += 1
+        if next_port[sw] > 0x100:
+            raise TopologyError('s%d has more than 255 ports' % sw)
+        return next_port[sw] - 1
+
+    topo_links = [['s%d-p%d' % (a, port(a)), 's%d-p%d' % (b, port(b))] for a, b in links]
+    hosts = {}
+    n = 0
+    for sw in edge_switches:
+        subnet = switch_subnet(sw)
+        for index in range(1, hosts_per_switch + 1):
+            n += 1
+            host = 'h%d' % n
+            sw_port = port(sw)
+            gateway = '%s.%d' % (subnet, GATEWAY_HOST)
+            hosts[host] = {
+                'ip': '%s.%d/24' % (subnet, index),
+                'mac': host_mac(sw, index),
+                'commands': ['route add default gw %s dev eth0' % gateway,
+                             'arp -i eth0 -s %s %s' % (gateway, port_mac(sw, sw_port))],
+            }
+            topo_links.append([host, 's%d-p%d' % (sw, sw_port)])
+    switches = {}
+    for sw in range(1, switch_count + 1):
+        switches['s%d' % sw] = {}
+        if runtime_dir is not None:
+            switches['s%d' % sw]['runtime_json'] = os.path.join(runtime_dir, 's%d-runtime.json' % sw)
+    return {'hosts': hosts, 'switches': switches, 'links': topo_links}
+
+
+def switch_routes(topo, sw):
+    """ [(ip, prefix length, next hop MAC, port)] of switch `sw` (a
+        Topology), sorted by prefix. """
+    routes = []
+    for host in topo.hosts_on(sw):
+        _, port = topo.host_switch(host)
+        routes.append((topo.host_ip(host), 32, topo.host_mac(host), port))
+    edges = set(edge for edge, _ in topo.host_links.values())
+    for dst in topo.switches:
+        if dst == sw or dst not in edges:
+            continue
+        neighbor = topo.next_hops(dst).get(sw)
+        if neighbor is None:
+            continue
+        routes.append(('%s.0' % switch_subnet(int(dst[1:])), 24,
+                       port_mac(int(neighbor[1:]), topo.port_to(neighbor, sw)),
+                       topo.port_to(sw, neighbor)))
+    return sorted(routes)
+
+
+def runtime_config(topo, sw, p4info, bmv2_json, tables=DEFAULT_TABLES):
+    """ simple_controller runtime JSON contents installing the routes of
+        `sw` into each of `tables`. """
+    entries = []
+    routes = switch_routes(topo, sw)
+    for table in tables:
+        for ip, length, mac, port in routes:
+            entries.append({
+                'table': table,
+                'match': {'hdr.ipv4.dstAddr': [ip, length]},
+                'action_name': FORWARD_ACTION,
+                'action_params': {'dstAddr': mac, 'port': port},
+            })
+    return {'target': 'bmv2', 'p4info': p4info, 'bmv2_json': bmv2_json,
+            'table_entries': entries}
+
+
+def generate(kind, params, out_dir, hosts_per_switch=1, p4info='build/mrc.p4.p4info.txt',
+             bmv2_json='build/mrc.json', tables=DEFAULT_TABLES):
+    """ Writes <out_dir>/topology.json and one sN-runtime.json per switch
+        for the topology `kind` (a GENERATORS key) built from `params`.
+        Returns the topology.json path and the number of table entries. """
+    if kind not in GENERATORS:
+        raise TopologyError('unknown topology %r, expected one of %s'
+                            % (kind, ', '.join(sorted(GENERATORS))))
+    switch_count, links, edges = GENERATORS[kind](*params)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    conf = build_topology(switch_count, links, edges, hosts_per_switch, runtime_dir=out_dir)
+    topo_file = os.path.join(out_dir, 'topology.json')
+    with open(topo_file, 'w') as f:
+        json.dump(conf, f, indent=1)
+
+    topo = Topology(conf['hosts'], conf['switches'], conf['links'])
+    entries = 0
+    for sw, sw_conf in conf['switches'].items():
+        runtime = runtime_config(topo, sw, p4info, bmv2_json, tables)
+        entries += len(runtime['table_entries'])
+        with open(sw_conf['runtime_json'], 'w') as f:
+            json.dump(runtime, f, indent=1)
+    return topo_file, entries
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a topology.json and its runtime rules')
+    parser.add_argument('kind', help='topology type', type=str, choices=sorted(GENERATORS))
+    parser.add_argument('params', help='fat-tree: K; leaf-spine: LEAVES SPINES; ring: N; '
+                        'grid: ROWS COLS; random-regular: N DEGREE [SEED]',
+                        type=int, nargs='+')
+    parser.add_argument('-o', '--out-dir', help='directory the files are written to',
+                        type=str, action="store", required=False, default='.')
+    parser.add_argument('--hosts-per-switch', help='hosts attached to each edge switch',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--p4info', help='p4info file named in the runtime files',
+                        type=str, action="store", required=False, default='build/mrc.p4.p4info.txt')
+    parser.add_argument('--bmv2-json', help='BMv2 JSON file named in the runtime files',
+                        type=str, action="store", required=False, default='build/mrc.json')
+    parser.add_argument('--table', help='table the routes are written to, may be repeated',
+                        type=str, action="append", required=False, default=None)
+    args = parser.parse_args()
+
+    try:
+        topo_file, entries = generate(args.kind, args.params, args.out_dir, args.hosts_per_switch,
+                                      args.p4info, args.bmv2_json, args.table or DEFAULT_TABLES)
+    except (TopologyError, TypeError) as e:
+        parser.error(str(e))
+    print("Wrote %s and runtime files with %d table entries" % (topo_file, entries))
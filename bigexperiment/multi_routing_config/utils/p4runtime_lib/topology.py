@@ -0,0 +1,111 @@
+#
+# Topology helpers shared by the exercise controllers.
+#
+# Reads the same topology.json format as run_exercise.py (hosts, switches and
+# links written as "sX-pY" switch ports) and answers the questions a
+# controller needs to compute rules: which switch and port a host hangs off,
+# which port leads to a neighbouring switch, and the next hop towards any
+# destination switch.
+#
+import json
+from collections import deque
+
+
+def parse_switch_node(node):
+    """ Splits a "sX-pY" node description into ("sX", Y). """
+    sw_name, sw_port = node.split('-')
+    try:
+        return sw_name, int(sw_port[1:])
+    except ValueError:
+        raise Exception('Invalid switch node in topology file: {}'.format(node))
+
+
+class Topology(object):
+    """
+        Attributes:
+            hosts      : dict<string, dict> // host names and their properties
+            switches   : dict<string, dict> // switch names and their properties
+            host_links : dict<string, (string, int)> // host -> (switch, port)
+            sw_ports   : dict<string, dict<string, int>> // sw -> neighbor -> port
+    """
+
+    def __init__(self, hosts, switches, links):
+        self.hosts = hosts
+        self.switches = switches
+        self.host_links = {}
+        self.sw_ports = dict((sw, {}) for sw in switches)
+        self._next_hops = {}
+
+        for link in links:
+            s, t = link[0], link[1]
+            if s > t:
+                s, t = t, s
+            if s[0] == 'h':
+                # hosts are plain names, switches are "sX-pY"
+                self.host_links[s] = parse_switch_node(t)
+                continue
+            sw1, port1 = parse_switch_node(s)
+            sw2, port2 = parse_switch_node(t)
+            # keep the first link when two switches are connected twice
+            self.sw_ports.setdefault(sw1, {}).setdefault(sw2, port1)
+            self.sw_ports.setdefault(sw2, {}).setdefault(sw1, port2)
+
+    @classmethod
+    def from_file(cls, topo_file):
+        with open(topo_file, 'r') as f:
+            topo = json.load(f)
+        return cls(topo['hosts'], topo['switches'], topo['links'])
+
+    def host_ip(self, host):
+        """ Host address without the prefix length, e.g. "10.0.1.1". """
+        return self.hosts[host]['ip'].split('/')[0]
+
+    def host_mac(self, host):
+        return self.hosts[host]['mac']
+
+    def host_switch(self, host):
+        """ Returns the (switch, port) pair the host is attached to. """
+        return self.host_links[host]
+
+    def hosts_on(self, sw):
+        return sorted(h for h, (s, _) in self.host_links.items() if s == sw)
+
+    def neighbors(self, sw):
+        return sorted(self.sw_ports[sw])
+
+    def port_to(self, sw, neighbor):
+        """ Port on `sw` facing the neighbouring switch `neighbor`. """
+        return self.sw_ports[sw][neighbor]
+
+    def next_hops(self, dst_sw):
+        """ Returns a dict mapping every switch that can reach `dst_sw` to
+            the neighbour it should forward to (None for `dst_sw` itself).
+
+            The table is a BFS tree rooted at `dst_sw`, so paths read from it
+            are shortest and consistent hop by hop. It is computed once per
+            destination and cached.
+        """
+        if dst_sw in self._next_hops:
+            return self._next_hops[dst_sw]
+        hops = {dst_sw: None}
+        queue = deque([dst_sw])
+        while queue:
+            sw = queue.popleft()
+            for neighbor in self.neighbors(sw):
+                if neighbor not in hops:
+                    hops[neighbor] = sw
+                    queue.append(neighbor)
+        self._next_hops[dst_sw] = hops
+        return hops
+
+    def path(self, src_sw, dst_sw):
+        """ Shortest switch path from `src_sw` to `dst_sw`, both included.
+            Returns None when `dst_sw` cannot be reached.
+        """
+        hops = self.next_hops(dst_sw)
+        if src_sw not in hops:
+            return None
+        path = [src_sw]
+        while path[-1] != dst_sw:
+            path.append(hops[path[-1]])
+        return path
@@ -0,0 +1,161 @@
+#
+# Lightweight tracing of controller and network bring-up phases.
+#
+# Spans are recorded as Chrome trace-event "complete" events and exported
+# as JSON that chrome://tracing, Perfetto or speedscope show as a flame
+# view. Nesting follows from the timestamps of spans on the same thread.
+# Timestamps are CLOCK_MONOTONIC microseconds (time.perf_counter() on
+# Linux), the same in every process, so traces of run_exercise.py and of
+# the controllers it is used with can be concatenated.
+#
+# Tracing is off until enable() is called or P4RUNTIME_TRACE names the
+# file to write at exit; a disabled span costs one attribute test.
+#
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+ENV_VAR = 'P4RUNTIME_TRACE'
+# inspect.CO_GENERATOR, without importing inspect
+CO_GENERATOR = 0x20
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.complete(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+    def set(self, **args):
+        """ Adds arguments known only once the span has started, e.g. a
+            count of entries written. """
+        self.args.update(args)
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = set()
+        self.pid = os.getpid()
+
+    def enable(self, path=None):
+        """ Starts recording. With `path`, the trace is written there when
+            the process exits. """
+        if path and self.path is None:
+            atexit.register(self.export)
+        self.path = path or self.path
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, cat='p4', **args):
+        """ Context manager timing the enclosed block. """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def complete(self, name, cat, start, end, args=None):
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self.pid,
+                 'tid': thread.ident, 'ts': start * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        with self.lock:
+            if thread.ident not in self.threads:
+                self.threads.add(thread.ident)
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid,
+                                    'tid': thread.ident, 'args': {'name': thread.name}})
+            self.events.append(event)
+
+    def instant(self, name, cat='p4', **args):
+        if self.enabled:
+            self.complete(name, cat, time.perf_counter(), time.perf_counter(), args)
+
+    def export(self, path=None):
+        """ Writes the trace-event JSON to `path` (default: the one given
+            to enable()). Returns the number of events written. """
+        path = path or self.path
+        if path is None:
+            return 0
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+TRACER = Tracer()
+if os.environ.get(ENV_VAR):
+    TRACER.enable(os.environ[ENV_VAR])
+
+
+def span(name, cat='p4', **args):
+    return TRACER.span(name, cat, **args)
+
+
+def traced(name=None, cat='p4', describe=None):
+    """ Decorator running the function inside a span. `describe`, called
+        with the function's arguments, returns the span arguments. The span
+        of a generator function covers its whole iteration. """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        def open_span(args, kwargs):
+            return TRACER.span(span_name, cat, **(describe(*args, **kwargs) if describe else {}))
+
+        if function.__code__.co_flags & CO_GENERATOR:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not TRACER.enabled:
+                    return function(*args, **kwargs)
+                return _traced_generator(open_span(args, kwargs), function(*args, **kwargs))
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not TRACER.enabled:
+                    return function(*args, **kwargs)
+                with open_span(args, kwargs):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _traced_generator(span, generator):
+    with span:
+        for item in generator:
+            yield item
@@ -15,19 +15,18 @@
 #
 
 import sys, os, tempfile, socket
-from time import sleep
+from time import sleep, time
 
 from mininet.node import Switch
 from mininet.moduledeps import pathCheck
 from mininet.log import info, error, debug
 
 from p4_mininet import P4Switch, SWITCH_START_TIMEOUT
+from allocator import GRPC_BASE_PORT, THRIFT_BASE_PORT
 from netstat import check_listening_on_port
 
 class P4RuntimeSwitch(P4Switch):
     "BMv2 switch with gRPC support"
-    next_grpc_port = 50051
-    next_thrift_port = 9090
 
     def __init__(self, name, sw_path = None, json_path = None,
                  grpc_port = None,
@@ -54,25 +53,11 @@ class P4RuntimeSwitch(P4Switch):
         else:
             self.json_path = None
 
-        if grpc_port is not None:
-            self.grpc_port = grpc_port
-        else:
-            self.grpc_port = P4RuntimeSwitch.next_grpc_port
-            P4RuntimeSwitch.next_grpc_port += 1
-
-        if thrift_port is not None:
-            self.thrift_port = thrift_port
-        else:
-            self.thrift_port = P4RuntimeSwitch.next_thrift_port
-            P4RuntimeSwitch.next_thrift_port += 1
-
-        if check_listening_on_port(self.grpc_port):
-            error('%s cannot bind port %d because it is bound by another process\n' % (self.name, self.grpc_port))
-            exit(1)
+        # ports and device ids are reserved across concurrent runs
+        self.grpc_port = self.reserve_port(grpc_port, GRPC_BASE_PORT)
+        self.thrift_port = self.reserve_port(thrift_port, THRIFT_BASE_PORT)
 
         self.verbose = verbose
-        logfile = "/tmp/p4s.{}.log".format(self.name)
-        self.output = open(logfile, 'w')
         self.pcap_dump = pcap_dump
         self.enable_debugger = enable_debugger
         self.log_console = log_console
@@ -80,22 +65,20 @@ class P4RuntimeSwitch(P4Switch):
             self.log_file = log_file
         else:
             self.log_file = "/tmp/p4s.{}.log".format(self.name)
-        if device_id is not None:
-            self.device_id = device_id
-            P4Switch.device_id = max(P4Switch.device_id, device_id)
-        else:
-            self.device_id = P4Switch.device_id
-            P4Switch.device_id += 1
+        self.device_id = self.reserve_device_id(device_id)
         self.nanomsg = "ipc:///tmp/bm-{}-log.ipc".format(self.device_id)
 
 
     def check_switch_started(self, pid):
-        for _ in range(SWITCH_START_TIMEOUT * 2):
+        deadline = time() + SWITCH_START_TIMEOUT
+        while time() < deadline:
             if not os.path.exists(os.path.join("/proc", str(pid))):
                 return False
             if check_listening_on_port(self.grpc_port):
                 return True
-            sleep(0.5)
+            # a probe is one connect(), poll often so as not to wait for nothing
+            sleep(0.05)
+        return False
 
     def start(self, controllers):
         info("Starting P4 switch {}.\n".format(self.name))
@@ -108,7 +91,6 @@ class P4RuntimeSwitch(P4Switch):
         if self.nanomsg:
             args.extend(['--nanolog', self.nanomsg])
         args.extend(['--device-id', str(self.device_id)])
-        P4Switch.device_id += 1
         if self.json_path:
             args.append(self.json_path)
         else:
@@ -130,6 +112,7 @@ class P4RuntimeSwitch(P4Switch):
             self.cmd(cmd + ' >' + self.log_file + ' 2>&1 & echo $! >> ' + f.name)
             pid = int(f.read())
         debug("P4 switch {} PID is {}.\n".format(self.name, pid))
+        self.pid = pid
         if not self.check_switch_started(pid):
             error("P4 switch {} did not start correctly.\n".format(self.name))
             exit(1)
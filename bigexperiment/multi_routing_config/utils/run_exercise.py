@@ -19,10 +19,12 @@
 # We encourage you to dissect this script to better understand the BMv2/Mininet
 # environment used by the P4 tutorial.
 #
-import os, sys, json, subprocess, re, argparse
-from time import sleep
+import os, sys, io, json, subprocess, re, argparse, signal, contextlib
+from time import sleep, time
 
-from p4_mininet import P4Switch, P4Host
+from p4_mininet import P4Switch, P4Host, host_script, script_failures, teardown
+from p4_mininet import SWITCH_START_TIMEOUT
+from netstat import check_listening_on_port
 
 from mininet.net import Mininet
 from mininet.topo import Topo
@@ -30,7 +32,11 @@ from mininet.link import TCLink
 from mininet.cli import CLI
 
 from p4runtime_switch import P4RuntimeSwitch
+from exercise_session import SessionServer
+from allocator import write_switch_ports
+import scenario
 import p4runtime_lib.simple_controller
+from p4runtime_lib.tracing import TRACER, span
 
 def configureP4Switch(**switch_args):
     """ Helper class that is called by mininet to initialize
@@ -50,12 +56,8 @@ def configureP4Switch(**switch_args):
         return ConfiguredP4RuntimeSwitch
     else:
         class ConfiguredP4Switch(P4Switch):
-            next_thrift_port = 9090
             def __init__(self, *opts, **kwargs):
-                global next_thrift_port
                 kwargs.update(switch_args)
-                kwargs['thrift_port'] = ConfiguredP4Switch.next_thrift_port
-                ConfiguredP4Switch.next_thrift_port += 1
                 P4Switch.__init__(self, *opts, **kwargs)
 
             def describe(self):
@@ -67,7 +69,8 @@ def configureP4Switch(**switch_args):
 class ExerciseTopo(Topo):
     """ The mininet topology class for the P4 tutorial exercises.
     """
-    def __init__(self, hosts, switches, links, log_dir, bmv2_exe, pcap_dir, **opts):
+    def __init__(self, hosts, switches, links, log_dir, bmv2_exe, pcap_dir,
+                 log_console=True, **opts):
         Topo.__init__(self, **opts)
         host_links = []
         switch_links = []
@@ -84,7 +87,7 @@ class ExerciseTopo(Topo):
                 switchClass = configureP4Switch(
                         sw_path=bmv2_exe,
                         json_path=params["program"],
-                        log_console=True,
+                        log_console=log_console,
                         pcap_dump=pcap_dir)
             else:
                 # add default switch
@@ -131,7 +134,9 @@ class ExerciseRunner:
             links    : list<dict>         // list of mininet link properties
 
             switch_json : string // json of the compiled p4 example
+            p4info      : string // p4info of switch_json, for reload()
             bmv2_exe    : string // name or path of the p4 switch binary
+            log_console : bool   // switches write per-packet traces to their logs
 
             topo : Topo object   // The mininet topology instance
             net : Mininet object // The mininet instance
@@ -150,7 +155,8 @@ class ExerciseRunner:
 
 
     def __init__(self, topo_file, log_dir, pcap_dir,
-                       switch_json, bmv2_exe='simple_switch', quiet=False):
+                       switch_json, bmv2_exe='simple_switch', quiet=False, p4info=None,
+                       log_console=True):
         """ Initializes some attributes and reads the topology json. Does not
             actually run the exercise. Use run_exercise() for that.
 
@@ -162,6 +168,10 @@ class ExerciseRunner:
                 switch_json : string  // Path to a compiled p4 json for bmv2
                 bmv2_exe    : string  // Path to the p4 behavioral binary
                 quiet : bool          // Enable/disable script debug messages
+                p4info : string       // p4info of switch_json (default: the
+                                         build/<prog>.p4.p4info.txt next to it)
+                log_console : bool    // Pass --log-console to the switches; without
+                                         it, watch them with event_collector.py
         """
 
         self.quiet = quiet
@@ -181,29 +191,102 @@ class ExerciseRunner:
         self.log_dir = log_dir
         self.pcap_dir = pcap_dir
         self.switch_json = switch_json
+        self.p4info = p4info
         self.bmv2_exe = bmv2_exe
+        self.log_console = log_console
+        # seconds each step of the run took, see phase()
+        self.timings = {}
+        # simple_switch_CLI processes still programming switches
+        self.cli_procs = []
 
 
-    def run_exercise(self):
+    def run_exercise(self, session=None):
         """ Sets up the mininet instance, programs the switches,
             and starts the mininet CLI. This is the main method to run after
-            initializing the object.
+            initializing the object. With `session`, a Unix socket path, the
+            network is kept up and serves exercise_session.py requests
+            instead of the CLI until one of them stops it.
         """
-        # Initialize mininet with the topology specified by the config
-        self.create_network()
-        self.net.start()
-        sleep(1)
-
-        # some programming that must happen after the net has started
-        self.program_hosts()
-        self.program_switches()
-
-        # wait for that to finish. Not sure how to do this better
-        sleep(1)
-
-        self.do_net_cli()
+        self.bring_up()
+
+        if session:
+            self.logger('Serving session requests on %s' % session)
+            try:
+                SessionServer(self, session).serve()
+            except KeyboardInterrupt:
+                pass
+        else:
+            self.do_net_cli()
         # stop right after the CLI is exited
-        self.net.stop()
+        teardown(self.net)
+
+    def run_headless(self, checks):
+        """ Same as run_exercise() without any interaction: runs the checks
+            of a scenario file (see scenario.py) once the network is up,
+            tears it down, even when interrupted, and returns their results.
+            Bring-up and check times are in self.timings.
+        """
+        try:
+            self.bring_up()
+            with self.phase('checks'):
+                return scenario.run_checks(self, checks)
+        finally:
+            if getattr(self, 'net', None) is not None:
+                with self.phase('stop_network'):
+                    teardown(self.net)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Traces and times one step of the run into self.timings. """
+        start = time()
+        with span('ExerciseRunner.' + name):
+            yield
+        self.timings[name] = time() - start
+
+    def bring_up(self):
+        """ Creates and starts the network and programs hosts and switches,
+            returning once all of it is ready. """
+        with span('ExerciseRunner.bringup'):
+            # Initialize mininet with the topology specified by the config
+            with self.phase('create_network'):
+                self.create_network()
+            # switches are ready when start() returns, they wait for their
+            # servers to listen
+            with self.phase('start_network'):
+                self.net.start()
+            # the switches get the first free ports, not necessarily 50051...
+            write_switch_ports(os.path.join(self.log_dir, 'switches.json'), self.net.switches)
+
+            # some programming that must happen after the net has started
+            with self.phase('program_hosts'):
+                self.program_hosts()
+            with self.phase('program_switches'):
+                self.program_switches()
+            with self.phase('wait_ready'):
+                self.wait_ready()
+        if TRACER.path:
+            self.logger('Bring-up trace written to %s' % TRACER.path)
+            TRACER.export()
+
+    def wait_ready(self, timeout=SWITCH_START_TIMEOUT):
+        """ Waits for the switch programming that runs in the background,
+            the simple_switch_CLI processes, and checks that every switch
+            still accepts connections. Raises if that takes over `timeout`
+            seconds.
+        """
+        deadline = time() + timeout
+        for proc in self.cli_procs:
+            try:
+                proc.wait(timeout=max(deadline - time(), 0))
+            except subprocess.TimeoutExpired:
+                raise Exception('simple_switch_CLI did not finish within %ds' % timeout)
+        self.cli_procs = []
+        for sw in self.net.switches:
+            port = getattr(sw, 'grpc_port', None) or getattr(sw, 'thrift_port', None)
+            while port and not check_listening_on_port(port):
+                if time() > deadline:
+                    raise Exception('%s does not accept connections on port %d' % (sw.name, port))
+                sleep(0.05)
 
 
     def parse_links(self, unparsed_links):
@@ -246,10 +329,11 @@ class ExerciseRunner:
         defaultSwitchClass = configureP4Switch(
                                 sw_path=self.bmv2_exe,
                                 json_path=self.switch_json,
-                                log_console=True,
+                                log_console=self.log_console,
                                 pcap_dump=self.pcap_dir)
 
-        self.topo = ExerciseTopo(self.hosts, self.switches, self.links, self.log_dir, self.bmv2_exe, self.pcap_dir)
+        self.topo = ExerciseTopo(self.hosts, self.switches, self.links, self.log_dir, self.bmv2_exe, self.pcap_dir,
+                                 self.log_console)
 
         self.net = Mininet(topo = self.topo,
                       link = TCLink,
@@ -257,23 +341,47 @@ class ExerciseRunner:
                       switch = defaultSwitchClass,
                       controller = None)
 
-    def program_switch_p4runtime(self, sw_name, sw_dict):
+    def program_switch_p4runtime(self, sw_name, sw_dict, clear=False):
         """ This method will use P4Runtime to program the switch using the
-            content of the runtime JSON file as input.
+            content of the runtime JSON file as input. With `clear`, entries
+            left from earlier programming are deleted first.
         """
         sw_obj = self.net.get(sw_name)
         grpc_port = sw_obj.grpc_port
         device_id = sw_obj.device_id
         runtime_json = sw_dict['runtime_json']
         self.logger('Configuring switch %s using P4Runtime with file %s' % (sw_name, runtime_json))
-        with open(runtime_json, 'r') as sw_conf_file:
+        with span('ExerciseRunner.program_switch', switch=sw_name, file=runtime_json), \
+                open(runtime_json, 'r') as sw_conf_file:
             outfile = '%s/%s-p4runtime-requests.txt' %(self.log_dir, sw_name)
             p4runtime_lib.simple_controller.program_switch(
                 addr='127.0.0.1:%d' % grpc_port,
                 device_id=device_id,
                 sw_conf_file=sw_conf_file,
                 workdir=os.getcwd(),
-                proto_dump_fpath=outfile)
+                proto_dump_fpath=outfile,
+                stream=True,
+                verbose=not self.quiet,
+                clear=clear)
+
+    def reset_switch_p4runtime(self, sw_name):
+        """ Pushes self.switch_json to a switch without a runtime JSON file
+            and deletes its table entries, so that it starts over like a
+            freshly started switch.
+        """
+        sw_obj = self.net.get(sw_name)
+        p4info = self.p4info or os.path.splitext(self.switch_json)[0] + '.p4.p4info.txt'
+        sw_conf = {'target': 'bmv2', 'p4info': p4info, 'bmv2_json': self.switch_json,
+                   'table_entries': []}
+        self.logger('Resetting switch %s to %s' % (sw_name, self.switch_json))
+        p4runtime_lib.simple_controller.program_switch(
+            addr='127.0.0.1:%d' % sw_obj.grpc_port,
+            device_id=sw_obj.device_id,
+            sw_conf_file=io.StringIO(json.dumps(sw_conf)),
+            workdir=os.getcwd(),
+            proto_dump_fpath='%s/%s-p4runtime-requests.txt' % (self.log_dir, sw_name),
+            verbose=not self.quiet,
+            clear=True)
 
     def program_switch_cli(self, sw_name, sw_dict):
         """ This method will start up the CLI and use the contents of the
@@ -289,8 +397,9 @@ class ExerciseRunner:
         with open(cli_input_commands, 'r') as fin:
             cli_outfile = '%s/%s_cli_output.log'%(self.log_dir, sw_name)
             with open(cli_outfile, 'w') as fout:
-                subprocess.Popen([cli, '--thrift-port', str(thrift_port)],
-                                 stdin=fin, stdout=fout)
+                # waited for by wait_ready()
+                self.cli_procs.append(subprocess.Popen([cli, '--thrift-port', str(thrift_port)],
+                                                       stdin=fin, stdout=fout))
 
     def program_switches(self):
         """ This method will program each switch using the BMv2 CLI and/or
@@ -303,14 +412,55 @@ class ExerciseRunner:
             if 'runtime_json' in sw_dict:
                 self.program_switch_p4runtime(sw_name, sw_dict)
 
+    def reload(self, switch_json=None, p4info=None):
+        """ Brings the running switches to a new program and their rules
+            without restarting anything: each P4Runtime switch gets the
+            pipeline pushed again (switch_json, if given, replaces the one
+            the network was started with), its table entries wiped and its
+            runtime JSON or CLI commands applied again. Hosts are untouched.
+        """
+        start = time()
+        if switch_json:
+            self.switch_json = switch_json
+            self.p4info = p4info
+        elif p4info:
+            self.p4info = p4info
+        with span('ExerciseRunner.reload'):
+            for sw_name, sw_dict in self.switches.items():
+                if 'runtime_json' in sw_dict:
+                    self.program_switch_p4runtime(sw_name, sw_dict, clear=True)
+                elif hasattr(self.net.get(sw_name), 'grpc_port'):
+                    self.reset_switch_p4runtime(sw_name)
+                if 'cli_input' in sw_dict:
+                    self.program_switch_cli(sw_name, sw_dict)
+            self.wait_ready()
+        self.logger('Reloaded %d switches in %.2fs' % (len(self.switches), time() - start))
+
     def program_hosts(self):
-        """ Execute any commands provided in the topology.json file on each Mininet host
+        """ Execute any commands provided in the topology.json file on each Mininet host.
+            Each host gets its commands as one script and all hosts run theirs
+            at the same time; failed commands, including those of the P4Host
+            setup, are reported together at the end.
         """
+        failures = []
+        for h in self.net.hosts:
+            if isinstance(h, P4Host):
+                failures.extend((h.name, cmd, status) for cmd, status in h.finish_setup())
+
+        running = []
         for host_name, host_info in list(self.hosts.items()):
             h = self.net.get(host_name)
-            if "commands" in host_info:
-                for cmd in host_info["commands"]:
-                    h.cmd(cmd)
+            if host_info.get("commands"):
+                h.sendCmd(host_script(host_info["commands"]))
+                running.append((h, host_info["commands"]))
+        for h, commands in running:
+            output = h.waitOutput()
+            failures.extend((h.name, cmd, status) for cmd, status in script_failures(commands, output))
+
+        if failures:
+            print("%d host command(s) failed:" % len(failures))
+            for host_name, cmd, status in failures:
+                print("  %s: %s (exit status %d)" % (host_name, cmd, status))
 
 
     def do_net_cli(self):
@@ -369,16 +519,63 @@ def get_args():
     parser.add_argument('-j', '--switch_json', type=str, required=False)
     parser.add_argument('-b', '--behavioral-exe', help='Path to behavioral executable',
                                 type=str, required=False, default='simple_switch')
+    parser.add_argument('--trace', help='write a Chrome trace-event JSON of the bring-up to this file',
+                        type=str, required=False, default=None)
+    parser.add_argument('--p4info', help='p4info of the switch json (default: next to it)',
+                        type=str, required=False, default=None)
+    parser.add_argument('--session', help='keep the network up and serve exercise_session.py '
+                        'requests on this Unix socket instead of starting the CLI',
+                        type=str, required=False, default=None)
+    parser.add_argument('--no-log-console', help='start the switches without per-packet text '
+                        'traces in their logs; utils/event_collector.py reads their event log instead',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('--checks', help='run headless: run the checks of this scenario file instead '
+                        'of the CLI and exit with status 1 if one fails, 2 if the network did not come up',
+                        type=str, required=False, default=None)
+    parser.add_argument('--report', help='write the results and step timings of --checks to this JSON file',
+                        type=str, required=False, default=None)
     return parser.parse_args()
 
 
+def headless(exercise, scenario_file, report_file=None):
+    """ Runs the checks of a scenario file with ExerciseRunner.run_headless()
+        and prints (and writes to report_file) their results and the time of
+        each step. Returns the exit status: 0 if every check passed, 1 if
+        one failed and 2 if the network did not come up.
+    """
+    checks = scenario.load_scenario(scenario_file)['checks']
+    # run_suite.py stops scenarios that time out with SIGTERM; exit
+    # through the teardown instead of leaving the switches behind
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    report = {'checks': [], 'timings': exercise.timings}
+    try:
+        report['checks'] = exercise.run_headless(checks)
+        failed = [r for r in report['checks'] if not r['ok']]
+        status = 1 if failed else 0
+        print('%d of %d checks passed' % (len(report['checks']) - len(failed), len(report['checks'])))
+    except Exception as e:
+        report['error'] = '%s: %s' % (type(e).__name__, e)
+        status = 2
+        print('Bring-up failed: %s' % report['error'])
+    for name, seconds in exercise.timings.items():
+        print('  %-16s %8.3fs' % (name, seconds))
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return status
+
+
 if __name__ == '__main__':
     # from mininet.log import setLogLevel
     # setLogLevel("info")
 
     args = get_args()
+    if args.trace:
+        TRACER.enable(args.trace)
     exercise = ExerciseRunner(args.topo, args.log_dir, args.pcap_dir,
-                              args.switch_json, args.behavioral_exe, args.quiet)
-
-    exercise.run_exercise()
+                              args.switch_json, args.behavioral_exe, args.quiet,
+                              args.p4info, not args.no_log_console)
 
+    if args.checks:
+        sys.exit(headless(exercise, args.checks, args.report))
+    exercise.run_exercise(args.session)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Runs exercise scenarios side by side and reports on all of them.
+#
+# Each scenario (see scenario.py) is brought up by its own run_exercise.py
+# --checks process, in its own network namespace (unshare --net) so that the
+# switch interfaces of two scenarios, s1-eth1 in both, do not clash, with its
+# own log and pcap directories, ports and device ids (allocator.py). Up to
+# --jobs scenarios run at once, so with enough cores the suite takes as long
+# as its slowest scenario. The checks of every scenario, their pass/fail
+# and the time of each bring-up step and check are gathered into one JSON
+# report.
+#
+# Needs root, Mininet, BMv2 and the compiled programs, like run_exercise.py.
+#
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scenario import load_scenario, ScenarioError
+
+RUN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_exercise.py')
+# time a scenario that timed out gets to tear its network down
+STOP_TIMEOUT = 30
+
+
+def scenarioCommand(scenario, out_dir, netns):
+    command = [sys.executable, RUN_SCRIPT, '--quiet',
+               '-t', scenario['topology'],
+               '-j', scenario['switch_json'],
+               '-b', scenario['behavioral_exe'],
+               '-l', os.path.join(out_dir, 'logs'),
+               '-p', os.path.join(out_dir, 'pcaps'),
+               '--checks', scenario['path'],
+               '--report', os.path.join(out_dir, 'checks.json')]
+    if scenario['p4info']:
+        command += ['--p4info', scenario['p4info']]
+    if netns:
+        # a new namespace only has a loopback interface, and it is down
+        command = ['unshare', '--net', '--', 'sh', '-c',
+                   'ip link set lo up && exec "$@"', scenario['name']] + command
+    return command
+
+
+def runScenario(scenario, out_dir, netns):
+    result = {'name': scenario['name'], 'scenario': scenario['path'], 'out_dir': out_dir}
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    report = os.path.join(out_dir, 'checks.json')
+    start = time.time()
+    with open(os.path.join(out_dir, 'run.log'), 'wb') as log:
+        proc = subprocess.Popen(scenarioCommand(scenario, out_dir, netns),
+                                cwd=scenario['directory'], stdout=log, stderr=subprocess.STDOUT)
+        try:
+            proc.wait(timeout=scenario['timeout'])
+        except subprocess.TimeoutExpired:
+            result['error'] = 'timed out after %ds' % scenario['timeout']
+            # run_exercise.py tears the network down on SIGTERM
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+    result['elapsed'] = time.time() - start
+    result['returncode'] = proc.returncode
+    result['checks'] = []
+    if os.path.exists(report):
+        with open(report) as f:
+            report = json.load(f)
+        result['checks'] = report['checks']
+        result['timings'] = report['timings']
+        if 'error' in report:
+            result.setdefault('error', report['error'])
+    elif 'error' not in result:
+        result['error'] = 'exited with status %d before the checks, see %s' % (
+            proc.returncode, os.path.join(out_dir, 'run.log'))
+    result['ok'] = (proc.returncode == 0 and 'error' not in result
+                    and all(check['ok'] for check in result['checks']))
+    return result
+
+
+def printResult(result):
+    passed = sum(1 for check in result['checks'] if check['ok'])
+    print("%-4s %-24s %3d/%-3d %8.1fs  %s" % (
+        'PASS' if result['ok'] else 'FAIL', result['name'], passed, len(result['checks']),
+        result['elapsed'], result.get('error', '')))
+    for check in result['checks']:
+        if not check['ok']:
+            print("       %s: %s" % (check['name'], check['detail']))
+
+
+def main(args):
+    try:
+        scenarios = [load_scenario(path) for path in args.scenarios]
+    except (IOError, ValueError, ScenarioError) as e:
+        print(e)
+        return 2
+    names = [scenario['name'] for scenario in scenarios]
+    if len(set(names)) != len(names):
+        print("scenario names must be unique, they name the output directories")
+        return 2
+    if args.timeout:
+        for scenario in scenarios:
+            scenario['timeout'] = args.timeout
+    # without namespaces, scenarios with the same switch names cannot run together
+    jobs = args.jobs if args.netns else 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(runScenario, scenario,
+                               os.path.join(os.path.abspath(args.out_dir), scenario['name']),
+                               args.netns)
+                   for scenario in scenarios]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            printResult(results[-1])
+    elapsed = time.time() - start
+
+    failed = [result['name'] for result in results if not result['ok']]
+    print("%d of %d scenarios passed in %.1fs (slowest %.1fs)" % (
+        len(results) - len(failed), len(results), elapsed,
+        max(result['elapsed'] for result in results) if results else 0))
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'jobs': jobs,
+        'elapsed': elapsed,
+        'failed': failed,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Report written to %s" % args.output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run exercise scenarios in parallel')
+    parser.add_argument('scenarios', help='scenario files', type=str, nargs='+')
+    parser.add_argument('-j', '--jobs', help='scenarios run at once',
+                        type=int, action="store", required=False, default=os.cpu_count() or 1)
+    parser.add_argument('--out-dir', help='directory for the logs and pcaps of each scenario',
+                        type=str, action="store", required=False, default='suite')
+    parser.add_argument('--timeout', help='seconds a scenario may take (default: its own, or 600)',
+                        type=int, action="store", required=False, default=None)
+    parser.add_argument('--no-netns', help='run in the root network namespace, one at a time',
+                        dest='netns', action="store_false", required=False, default=True)
+    parser.add_argument('--output', help='JSON file the report is written to',
+                        type=str, action="store", required=False, default='suite.json')
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# Scale harness for the run_exercise.py startup path.
+#
+# For each size, a synthetic topology and its runtime rules are generated
+# (p4runtime_lib.topogen) and brought up with ExerciseRunner in a fresh
+# process, timing each phase: Mininet network creation and start, host
+# programming, switch programming over P4Runtime, and the time until the
+# first host can ping the last one. Sizes are run in increasing order and
+# the run stops at the first size that fails or times out, which is where
+# the current startup path stops scaling.
+#
+# Needs root, Mininet, BMv2 and the compiled program, like run_exercise.py.
+# --generate-only just times the generator and needs none of them.
+#
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from p4runtime_lib import topogen
+
+
+def topologyParams(args, size):
+    """ Generator arguments for `size`, the one number that grows. """
+    if args.kind == 'leaf-spine':
+        return (size, args.spines)
+    if args.kind == 'grid':
+        return (size, size)
+    if args.kind == 'random-regular':
+        return (size, args.degree, args.seed)
+    return (size,)
+
+
+def firstPing(src, dst_ip, timeout):
+    """ Seconds until `src` gets an answer from `dst_ip`, and the number of
+        pings sent; None for the time when there was none within `timeout`. """
+    start = time.perf_counter()
+    attempts = 0
+    while time.perf_counter() - start < timeout:
+        attempts += 1
+        if ' 0% packet loss' in src.cmd('ping -c 1 -W 1 %s' % dst_ip):
+            return time.perf_counter() - start, attempts
+    return None, attempts
+
+
+def measure(args):
+    """ Brings up --measure's topology once and prints the phase times as
+        JSON. Runs in its own process, so that the Mininet and switch port
+        state of one size does not leak into the next. """
+    from p4_mininet import teardown
+    from run_exercise import ExerciseRunner
+
+    phases = {}
+
+    def phase(name, function):
+        start = time.perf_counter()
+        function()
+        phases[name] = time.perf_counter() - start
+
+    workdir = os.path.dirname(args.measure)
+    runner = ExerciseRunner(args.measure, os.path.join(workdir, 'logs'),
+                            os.path.join(workdir, 'pcaps'), args.switch_json,
+                            args.behavioral_exe, quiet=True)
+    try:
+        phase('create_network', runner.create_network)
+        phase('start_network', runner.net.start)
+        phase('program_hosts', runner.program_hosts)
+        phase('program_switches', runner.program_switches)
+        hosts = sorted(runner.hosts, key=lambda h: int(h[1:]))
+        dst_ip = runner.hosts[hosts[-1]]['ip'].split('/')[0]
+        phases['first_ping'], phases['ping_attempts'] = firstPing(
+            runner.net.get(hosts[0]), dst_ip, args.ping_timeout)
+    finally:
+        if getattr(runner, 'net', None) is not None:
+            start = time.perf_counter()
+            teardown(runner.net)
+            phases['stop_network'] = time.perf_counter() - start
+    print(json.dumps(phases))
+
+
+def runSize(args, size, workdir):
+    params = topologyParams(args, size)
+    start = time.perf_counter()
+    topo_file, entries = topogen.generate(args.kind, params, workdir, args.hosts_per_switch,
+                                          os.path.abspath(args.p4info),
+                                          os.path.abspath(args.switch_json))
+    with open(topo_file) as f:
+        topo = json.load(f)
+    result = {
+        'size': size,
+        'params': params,
+        'switches': len(topo['switches']),
+        'hosts': len(topo['hosts']),
+        'links': len(topo['links']),
+        'table_entries': entries,
+        'generate': time.perf_counter() - start,
+    }
+    if args.generate_only:
+        return result
+
+    command = [sys.executable, os.path.abspath(__file__), '--measure', topo_file,
+               '--switch-json', os.path.abspath(args.switch_json),
+               '--behavioral-exe', args.behavioral_exe,
+               '--ping-timeout', str(args.ping_timeout)]
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(command, stdout=subprocess.PIPE, cwd=os.getcwd(),
+                              timeout=args.timeout, check=False)
+    except subprocess.TimeoutExpired:
+        result['error'] = 'timed out after %ds' % args.timeout
+        subprocess.call(['mn', '-c'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result
+    result['total'] = time.perf_counter() - start
+    lines = proc.stdout.decode('utf-8', 'replace').strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        result['error'] = 'bring-up exited with status %d' % proc.returncode
+        return result
+    result.update(json.loads(lines[-1]))
+    if result['first_ping'] is None:
+        result['error'] = 'no ping answer within %ds' % args.ping_timeout
+    return result
+
+
+def printRow(result):
+    def ms(name):
+        value = result.get(name)
+        return '%9.0f' % (value * 1000) if value is not None else '%9s' % '-'
+    print("%6d %6d %6d %8d %s %s %s %s %s %s  %s" % (
+        result['size'], result['switches'], result['hosts'], result['table_entries'],
+        ms('generate'), ms('create_network'), ms('start_network'), ms('program_hosts'),
+        ms('program_switches'), ms('first_ping'), result.get('error', '')))
+
+
+def main(args):
+    print("%s, %d host(s) per edge switch; times in ms" % (args.kind, args.hosts_per_switch))
+    print("%6s %6s %6s %8s %9s %9s %9s %9s %9s %9s" % (
+        'size', 'sw', 'hosts', 'entries', 'generate', 'create', 'start', 'hosts',
+        'switches', 'ping'))
+    results = []
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='p4scale-')
+        try:
+            result = runSize(args, size, workdir)
+        except topogen.TopologyError as e:
+            print("size %d: %s" % (size, e))
+            return 1
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        if args.keep:
+            result['workdir'] = workdir
+        results.append(result)
+        printRow(result)
+        if 'error' in result:
+            print("Stopped at size %d: %s" % (size, result['error']))
+            break
+
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': dict((k, v) for k, v in vars(args).items() if k not in ('output', 'measure')),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Results written to %s" % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time run_exercise bring-up on growing topologies')
+    parser.add_argument('--kind', help='topology type',
+                        type=str, action="store", required=False, default='leaf-spine',
+                        choices=sorted(topogen.GENERATORS))
+    parser.add_argument('--sizes', help='sizes to run: k for fat-tree, leaves for leaf-spine, '
+                        'switches for ring and random-regular, side for grid',
+                        type=int, nargs='+', required=False, default=[2, 4, 8, 16, 32])
+    parser.add_argument('--spines', help='spine switches of leaf-spine topologies',
+                        type=int, action="store", required=False, default=2)
+    parser.add_argument('--degree', help='degree of random-regular topologies',
+                        type=int, action="store", required=False, default=3)
+    parser.add_argument('--seed', help='seed of random-regular topologies',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--hosts-per-switch', help='hosts attached to each edge switch',
+                        type=int, action="store", required=False, default=1)
+    parser.add_argument('--p4info', help='p4info file of the program',
+                        type=str, action="store", required=False, default='build/mrc.p4.p4info.txt')
+    parser.add_argument('-j', '--switch-json', help='BMv2 JSON file of the program',
+                        type=str, action="store", required=False, default='build/mrc.json')
+    parser.add_argument('-b', '--behavioral-exe', help='BMv2 target',
+                        type=str, action="store", required=False, default='simple_switch_grpc')
+    parser.add_argument('--timeout', help='seconds one bring-up may take',
+                        type=int, action="store", required=False, default=600)
+    parser.add_argument('--ping-timeout', help='seconds to wait for the first ping answer',
+                        type=int, action="store", required=False, default=30)
+    parser.add_argument('--generate-only', help='only time the topology and rule generator',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--keep', help='keep the generated topologies and logs',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--output', help='JSON file the results are written to',
+                        type=str, action="store", required=False, default='scale.json')
+    parser.add_argument('--measure', help=argparse.SUPPRESS,
+                        type=str, action="store", required=False, default=None)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args)
+        sys.exit(0)
+    sys.exit(main(args))
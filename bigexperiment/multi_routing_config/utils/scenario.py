@@ -0,0 +1,286 @@
+#
+# Scripted checks for an exercise network.
+#
+# A scenario file names an exercise and what must hold once its network is
+# up, so that it can be validated without the Mininet CLI:
+#
+#   {
+#     "name": "mrc",
+#     "directory": "..",
+#     "topology": "topo/topology.json",
+#     "switch_json": "build/mrc.json",
+#     "behavioral_exe": "simple_switch_grpc",
+#     "checks": [
+#       {"type": "command", "run": "python3 controller.py --switch-ports {log_dir}/switches.json"},
+#       {"type": "ping"},
+#       {"type": "ping", "pairs": [["h1", "h4"]], "expect": "fail"},
+#       {"type": "counter", "switch": "s1", "counter": "MyEgress.c", "index": 1, "min": 1},
+#       {"type": "hosts", "run": [
+#         {"host": "h1", "cmd": "ip route", "expect": "default via 10.0.1.10"},
+#         {"host": "h2", "cmd": "ping -c 5 10.0.1.1", "expect": " 0% packet loss", "timeout": 10}
+#       ]}
+#     ]
+#   }
+#
+# The exercise runs in `directory`, relative to the scenario file and by
+# default the one it is in, and the other paths are relative to it.
+# `run_exercise.py --checks FILE` runs the checks in place of the CLI,
+# run_suite.py runs many scenarios side by side.
+#
+import json
+import os
+import re
+import shlex
+import subprocess
+import time
+
+DEFAULTS = {
+    'p4info': None,
+    'behavioral_exe': 'simple_switch_grpc',
+    'timeout': 600,
+    'checks': [],
+}
+PATHS = ('topology', 'switch_json', 'p4info')
+
+# printed by the ping scripts of ping_pairs()
+PING_MARK = '__ping__'
+# brackets the output of each command of a steps_script()
+STEP_MARK = '__step__'
+# seconds a host command may take by default
+STEP_TIMEOUT = 10
+COUNTER_VALUE = re.compile(r'BmCounterValue\(packets=(\d+), bytes=(\d+)\)')
+
+
+class ScenarioError(Exception):
+    pass
+
+
+def load_scenario(path):
+    """ Reads a scenario file, fills in the defaults and makes its paths
+        absolute. """
+    with open(path) as f:
+        scenario = json.load(f)
+    for key in ('topology', 'switch_json'):
+        if key not in scenario:
+            raise ScenarioError('%s: missing "%s"' % (path, key))
+    for key, value in DEFAULTS.items():
+        scenario.setdefault(key, value)
+    scenario.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    scenario['path'] = os.path.abspath(path)
+    scenario['directory'] = os.path.normpath(os.path.join(
+        os.path.dirname(scenario['path']), scenario.get('directory', '.')))
+    for key in PATHS:
+        if scenario[key] is not None:
+            scenario[key] = os.path.join(scenario['directory'], scenario[key])
+    for n, check in enumerate(scenario['checks']):
+        if check.get('type') not in CHECKS:
+            raise ScenarioError('%s: check %d has unknown type %r, expected one of %s'
+                                % (path, n, check.get('type'), ', '.join(sorted(CHECKS))))
+    return scenario
+
+
+def ping_pairs(net, pairs, count=1, timeout=1):
+    """ Pings every (source, destination) host pair and returns the set of
+        pairs that got an answer. All sources ping at once and each pings
+        its destinations in parallel. """
+    by_src = {}
+    for src, dst in pairs:
+        by_src.setdefault(src, []).append(dst)
+    for src, dsts in by_src.items():
+        pings = ['(ping -c %d -W %d %s >/dev/null 2>&1 && echo "%s %s ok" || echo "%s %s fail") &'
+                 % (count, timeout, net.get(dst).IP(), PING_MARK, dst, PING_MARK, dst)
+                 for dst in dsts]
+        net.get(src).sendCmd(' '.join(pings) + ' wait')
+    answered = set()
+    for src in by_src:
+        for line in net.get(src).waitOutput().splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == PING_MARK and fields[2] == 'ok':
+                answered.add((src, fields[1]))
+    return answered
+
+
+def check_ping(runner, check, variables):
+    """ All pairs of `hosts` (default: every host), or the given `pairs`,
+        can (expect "pass") or cannot (expect "fail") reach each other.
+        Pairs that fail are pinged again up to `attempts` times. """
+    if 'pairs' in check:
+        pairs = [tuple(pair) for pair in check['pairs']]
+    else:
+        hosts = check.get('hosts') or sorted(runner.hosts)
+        pairs = [(src, dst) for src in hosts for dst in hosts if src != dst]
+    expect_pass = check.get('expect', 'pass') == 'pass'
+    count = check.get('count', 1)
+    timeout = check.get('timeout', 1)
+    answered = set()
+    remaining = pairs
+    for _ in range(check.get('attempts', 3) if expect_pass else 1):
+        answered |= ping_pairs(runner.net, remaining, count, timeout)
+        remaining = [pair for pair in pairs if pair not in answered]
+        if not remaining:
+            break
+    wrong = remaining if expect_pass else [pair for pair in pairs if pair in answered]
+    detail = '%d/%d pairs answered' % (len(answered), len(pairs))
+    if wrong:
+        detail += '; %s: %s' % ('no answer' if expect_pass else 'answered',
+                                ' '.join('%s->%s' % pair for pair in wrong[:10]))
+    return not wrong, detail
+
+
+def read_counter(thrift_port, counter, index):
+    """ (packets, bytes) of a counter cell, read with simple_switch_CLI. """
+    cli = subprocess.run(['simple_switch_CLI', '--thrift-port', str(thrift_port)],
+                         input=('counter_read %s %d\n' % (counter, index)).encode(),
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    match = COUNTER_VALUE.search(cli.stdout.decode('utf-8', 'replace'))
+    if match is None:
+        raise ScenarioError('cannot read %s[%d]: %s' % (
+            counter, index, cli.stdout.decode('utf-8', 'replace').strip()[-200:]))
+    return int(match.group(1)), int(match.group(2))
+
+
+def check_counter(runner, check, variables):
+    """ A counter cell of a switch holds at least `min` and at most `max`
+        packets, or bytes with "unit": "bytes". """
+    sw = runner.net.get(check['switch'])
+    packets, nbytes = read_counter(sw.thrift_port, check['counter'], check.get('index', 0))
+    value = nbytes if check.get('unit') == 'bytes' else packets
+    low, high = check.get('min'), check.get('max')
+    ok = (low is None or value >= low) and (high is None or value <= high)
+    return ok, '%s %s[%d] = %d %s' % (check['switch'], check['counter'], check.get('index', 0),
+                                      value, check.get('unit', 'packets'))
+
+
+def check_command(runner, check, variables):
+    """ A shell command run in the exercise directory, e.g. a controller,
+        exits with `status` (default 0). {log_dir}, {pcap_dir},
+        {switch_json} and {p4info} are replaced in it. """
+    command = check['run'].format(**variables)
+    proc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          timeout=check.get('timeout'))
+    output = proc.stdout.decode('utf-8', 'replace').strip()
+    detail = 'exit status %d' % proc.returncode
+    if proc.returncode != check.get('status', 0) and output:
+        detail += ': ' + output[-500:]
+    return proc.returncode == check.get('status', 0), detail
+
+
+def steps_script(steps):
+    """ One shell command line running the (n, step) `steps` of a host in
+        order, each under `timeout` and with its output bracketed by
+        STEP_MARK lines holding its index, start and end time and exit
+        status, see parse_steps(). """
+    parts = []
+    for n, step in steps:
+        # $? is saved first, the $(date) of the echo would reset it
+        parts.append('echo "%s begin %d $(date +%%s%%N)"; '
+                     'timeout %d sh -c %s </dev/null 2>&1; step_status=$?; '
+                     'echo "%s end %d $(date +%%s%%N) $step_status"'
+                     % (STEP_MARK, n, step.get('timeout', STEP_TIMEOUT),
+                        shlex.quote(step['cmd']), STEP_MARK, n))
+    return '; '.join(parts)
+
+
+def parse_steps(output):
+    """ {n: (exit status, seconds, output)} of the output of a steps_script(). """
+    steps = {}
+    current = None
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[:2] == [STEP_MARK, 'begin']:
+            current, begin, lines = int(fields[2]), int(fields[3]), []
+        elif len(fields) == 5 and fields[:2] == [STEP_MARK, 'end'] and current is not None:
+            steps[current] = (int(fields[4]), (int(fields[3]) - begin) / 1e9,
+                              '\n'.join(lines))
+            current = None
+        elif current is not None:
+            lines.append(line.rstrip('\r'))
+    return steps
+
+
+def check_hosts(runner, check, variables):
+    """ Shell commands run on hosts. The hosts run theirs at the same time,
+        each host its own in order. A command passes if it exits with
+        `status` (default 0) within `timeout` seconds and its output
+        matches the regular expression `expect`, if given. """
+    by_host = {}
+    for n, step in enumerate(check['run']):
+        by_host.setdefault(step['host'], []).append((n, step))
+    for host, steps in by_host.items():
+        runner.net.get(host).sendCmd(steps_script(steps))
+    outputs = {}
+    for host in by_host:
+        outputs.update(parse_steps(runner.net.get(host).waitOutput()))
+
+    results = []
+    for n, step in enumerate(check['run']):
+        status, elapsed, output = outputs.get(n, (None, None, ''))
+        timeout = step.get('timeout', STEP_TIMEOUT)
+        if status is None:
+            error = 'no output'
+        elif status == 124:
+            # the exit status of timeout(1) for a command it stopped
+            error = 'timed out after %ds' % timeout
+        elif status != step.get('status', 0):
+            error = 'exit status %d' % status
+        elif 'expect' in step and not re.search(step['expect'], output):
+            error = 'output does not match %r' % step['expect']
+        else:
+            error = None
+        results.append({
+            'host': step['host'],
+            'cmd': step['cmd'],
+            'ok': error is None,
+            'status': status,
+            'elapsed': elapsed,
+            'error': error,
+            'output': output[-2000:],
+        })
+    failed = [result for result in results if not result['ok']]
+    detail = '%d/%d commands passed' % (len(results) - len(failed), len(results))
+    if failed:
+        detail += '; ' + '; '.join('%s: %s (%s)' % (result['host'], result['cmd'], result['error'])
+                                   for result in failed[:5])
+    return not failed, detail, results
+
+
+CHECKS = {
+    'ping': check_ping,
+    'counter': check_counter,
+    'command': check_command,
+    'hosts': check_hosts,
+}
+
+
+def run_checks(runner, checks):
+    """ Runs the checks in order against the network of an ExerciseRunner
+        and returns one result per check. A check that raises fails. The
+        result of a hosts check also has one entry per command in 'steps'. """
+    variables = {
+        'log_dir': os.path.abspath(runner.log_dir),
+        'pcap_dir': os.path.abspath(runner.pcap_dir),
+        'switch_json': runner.switch_json,
+        'p4info': runner.p4info or os.path.splitext(runner.switch_json)[0] + '.p4.p4info.txt',
+    }
+    results = []
+    for n, check in enumerate(checks):
+        start = time.time()
+        steps = None
+        try:
+            outcome = CHECKS[check['type']](runner, check, variables)
+            ok, detail = outcome[:2]
+            if len(outcome) > 2:
+                steps = outcome[2]
+        except Exception as e:
+            ok, detail = False, '%s: %s' % (type(e).__name__, e)
+        results.append({
+            'check': n,
+            'name': check.get('name', check['type']),
+            'ok': ok,
+            'detail': detail,
+            'elapsed': time.time() - start,
+        })
+        if steps is not None:
+            results[-1]['steps'] = steps
+        runner.logger('%s %s: %s' % ('PASS' if ok else 'FAIL', results[-1]['name'], detail))
+    return results
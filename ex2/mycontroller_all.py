@@ -15,105 +15,9 @@ import p4runtime_lib.bmv2
 import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from p4runtime_lib.topology import Topology
 
-SWITCH_TO_HOST_PORT = 1
-SWITCH_TO_SWITCH_PORT = 2
-
-
-def writeTunnelRules(p4info_helper, ingress_sw, egress_sw, tunnel_id,
-                     dst_eth_addr, dst_ip_addr):
-    """
-    Installs three rules:
-    1) An tunnel ingress rule on the ingress switch in the ipv4_lpm table that
-       encapsulates traffic into a tunnel with the specified ID
-    2) A transit rule on the ingress switch that forwards traffic based on
-       the specified ID
-    3) An tunnel egress rule on the egress switch that decapsulates traffic
-       with the specified ID and sends it to the host
-    :param p4info_helper: the P4Info helper
-    :param ingress_sw: the ingress switch connection
-    :param egress_sw: the egress switch connection
-    :param tunnel_id: the specified tunnel ID
-    :param dst_eth_addr: the destination IP to match in the ingress rule
-    :param dst_ip_addr: the destination Ethernet address to write in the
-                        egress rule
-    """
-    # 1) Tunnel Ingress Rule
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm",
-        match_fields={
-            "hdr.ipv4.dstAddr": (dst_ip_addr, 32)
-        },
-        action_name="MyIngress.myTunnel_ingress",
-        action_params={
-            "dst_id": tunnel_id,
-        })
-    ingress_sw.WriteTableEntry(table_entry)
-    print("Installed ingress tunnel rule on %s" % ingress_sw.name)
-
-    # 2) Tunnel Transit Rule
-    # The rule will need to be added to the myTunnel_exact table and match on
-    # the tunnel ID (hdr.myTunnel.dst_id). Traffic will need to be forwarded
-    # using the myTunnel_forward action on the port connected to the next switch.
-    #
-    # For our simple topology, switch 1 and switch 2 are connected using a
-    # link attached to port 2 on both switches. We have defined a variable at
-    # the top of the file, SWITCH_TO_SWITCH_PORT, that you can use as the output
-    # port for this action.
-    #
-    # We will only need a transit rule on the ingress switch because we are
-    # using a simple topology. In general, you'll need on transit rule for
-    # each switch in the path (except the last switch, which has the egress rule),
-    # and you will need to select the port dynamically for each switch based on
-    # your topology.
-
-    # TODO build the transit rule
-    # TODO install the transit rule on the ingress switch
-    # 定义一个简单的转发逻辑
-    forward_id = None
-    if tunnel_id == 100:
-        forward_id = 2
-    if tunnel_id == 200:
-        forward_id = 2
-    if tunnel_id == 300:
-        forward_id = 3
-    if tunnel_id == 400:
-        forward_id = 3
-    if tunnel_id == 500:
-        forward_id = 3
-    if tunnel_id == 600:
-        forward_id = 2
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.myTunnel_exact",
-        match_fields={
-            # 匹配tunnel_id
-            "hdr.myTunnel.dst_id": tunnel_id
-        },
-        action_name="MyIngress.myTunnel_forward",
-        action_params={
-            # 从交换机之间连接的端口发送出去
-            "port": forward_id
-        })
-    ingress_sw.WriteTableEntry(table_entry)
-    print("Installed ingress tunnel rule on %s" % ingress_sw.name)
-
-    # 3) Tunnel Egress Rule
-    # For our simple topology, the host will always be located on the
-    # SWITCH_TO_HOST_PORT (port 1).
-    # In general, you will need to keep track of which port the host is
-    # connected to.
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.myTunnel_exact",
-        match_fields={
-            "hdr.myTunnel.dst_id": tunnel_id
-        },
-        action_name="MyIngress.myTunnel_egress",
-        action_params={
-            "dstAddr": dst_eth_addr,
-            "port": SWITCH_TO_HOST_PORT
-        })
-    egress_sw.WriteTableEntry(table_entry)
-    print("Installed egress tunnel rule on %s" % egress_sw.name)
+from tunnels import TunnelProvisioner
 
 
 def readTableRules(p4info_helper, sw):
@@ -162,90 +66,64 @@ def printCounter(p4info_helper, sw, counter_name, index):
                 counter.data.packet_count, counter.data.byte_count
             ))
 
-def main(p4info_file_path, bmv2_file_path):
+def connectSwitches(topology):
+    """
+    Creates a connection for every switch of the topology. Switch sN is
+    expected on gRPC port 50050+N with device id N-1, as started by
+    run_exercise.py.
+    :param topology: the Topology the switches are read from
+    :return: a dict mapping switch names to their connections
+    """
+    switches = {}
+    for sw_name in sorted(topology.switches, key=lambda sw: int(sw[1:])):
+        sw_num = int(sw_name[1:])
+        switches[sw_name] = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+            name=sw_name,
+            address='127.0.0.1:%d' % (50050 + sw_num),
+            device_id=sw_num - 1,
+            proto_dump_file='logs/%s-p4runtime-requests.txt' % sw_name)
+    return switches
+
+
+def main(p4info_file_path, bmv2_file_path, topo_file_path):
     # Instantiate a P4Runtime helper from the p4info file
     p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    topology = Topology.from_file(topo_file_path)
 
     try:
-        # Create a switch connection object for s1 and s2;
+        # Create a switch connection object for every switch in the topology;
         # this is backed by a P4Runtime gRPC connection.
         # Also, dump all P4Runtime messages sent to switch to given txt files.
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+        switches = connectSwitches(topology)
 
         # Send master arbitration update message to establish this controller as
         # master (required by P4Runtime before performing any other write operation)
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
+        for sw in switches.values():
+            sw.MasterArbitrationUpdate()
 
         # Install the P4 program on the switches
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
+        for sw in switches.values():
+            sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=bmv2_file_path)
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s" % sw.name)
 
         # 配置隧道转发逻辑
-        # Write the rules that tunnel traffic from h1 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s2, tunnel_id=100,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2")
-        # Write the rules that tunnel traffic from h2 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s1, tunnel_id=200,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1")
-
-        # Write the rules that tunnel traffic from h2 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s2, egress_sw=s3, tunnel_id=300,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3")
-        # Write the rules that tunnel traffic from h3 to h2
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s2, tunnel_id=400,
-                         dst_eth_addr="08:00:00:00:02:22", dst_ip_addr="10.0.2.2")
-
-        # Write the rules that tunnel traffic from h1 to h3
-        writeTunnelRules(p4info_helper, ingress_sw=s1, egress_sw=s3, tunnel_id=500,
-                         dst_eth_addr="08:00:00:00:03:33", dst_ip_addr="10.0.3.3")
-        # Write the rules that tunnel traffic from h3 to h1
-        writeTunnelRules(p4info_helper, ingress_sw=s3, egress_sw=s1, tunnel_id=600,
-                         dst_eth_addr="08:00:00:00:01:11", dst_ip_addr="10.0.1.1")
+        # Write the rules of a full mesh of tunnels between all hosts
+        provisioner = TunnelProvisioner(p4info_helper, topology)
+        provisioner.install(switches)
 
-        # TODO Uncomment the following two lines to read table entries from s1 and s2
-        readTableRules(p4info_helper, s1)
-        readTableRules(p4info_helper, s2)
-        readTableRules(p4info_helper, s3)
+        for sw in switches.values():
+            readTableRules(p4info_helper, sw)
 
         # Print the tunnel counters every 2 seconds
         while True:
             sleep(2)
             print('\n----- Reading tunnel counters -----')
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 100)
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 200)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 200)
-            printCounter(p4info_helper, s2, "MyIngress.ingressTunnelCounter", 300)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 300)
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 400)
-            printCounter(p4info_helper, s2, "MyIngress.egressTunnelCounter", 400)
-            printCounter(p4info_helper, s1, "MyIngress.ingressTunnelCounter", 500)
-            printCounter(p4info_helper, s3, "MyIngress.egressTunnelCounter", 500)
-            printCounter(p4info_helper, s3, "MyIngress.ingressTunnelCounter", 600)
-            printCounter(p4info_helper, s1, "MyIngress.egressTunnelCounter", 600)
+            for tunnel in provisioner.tunnels:
+                printCounter(p4info_helper, switches[tunnel.ingress_sw],
+                             "MyIngress.ingressTunnelCounter", tunnel.tunnel_id)
+                printCounter(p4info_helper, switches[tunnel.egress_sw],
+                             "MyIngress.egressTunnelCounter", tunnel.tunnel_id)
 
     except KeyboardInterrupt:
         print(" Shutting down.")
@@ -262,6 +140,9 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/advanced_tunnel.json')
+    parser.add_argument('--topo', help='Topology JSON file used by run_exercise.py',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -272,4 +153,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    if not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.topo)
\ No newline at end of file
@@ -0,0 +1,136 @@
+#
+# Tunnel provisioning for the advanced_tunnel program.
+#
+# Every (ingress switch, destination host) pair gets its own tunnel id. The
+# ingress switch encapsulates traffic for the host in ipv4_lpm, every switch
+# on the shortest path forwards it in myTunnel_exact, and the switch the host
+# is attached to decapsulates it.
+#
+import heapq
+
+# myTunnel.dst_id is a bit<16> field; id 0 is left unused.
+MIN_TUNNEL_ID = 1
+MAX_TUNNEL_ID = (1 << 16) - 1
+
+
+class TunnelIdAllocator(object):
+    """ Hands out the smallest free tunnel id, so ids stay dense and can be
+        used directly as indexes into the tunnel counters. """
+
+    def __init__(self, first=MIN_TUNNEL_ID, last=MAX_TUNNEL_ID):
+        self.last = last
+        self.next_id = first
+        self.free = []
+        self.ids = {}
+
+    def allocate(self, key):
+        if key in self.ids:
+            return self.ids[key]
+        if self.free:
+            tunnel_id = heapq.heappop(self.free)
+        elif self.next_id <= self.last:
+            tunnel_id = self.next_id
+            self.next_id += 1
+        else:
+            raise Exception("No tunnel ids left for %r" % (key,))
+        self.ids[key] = tunnel_id
+        return tunnel_id
+
+    def release(self, key):
+        heapq.heappush(self.free, self.ids.pop(key))
+
+    def items(self):
+        return sorted(self.ids.items(), key=lambda item: item[1])
+
+
+class Tunnel(object):
+    def __init__(self, tunnel_id, dst_host, path):
+        self.tunnel_id = tunnel_id
+        self.dst_host = dst_host
+        self.path = path
+
+    @property
+    def ingress_sw(self):
+        return self.path[0]
+
+    @property
+    def egress_sw(self):
+        return self.path[-1]
+
+
+class TunnelProvisioner(object):
+    """ Computes the tunnels of a full mesh between all hosts of a topology
+        and the myTunnel_exact / ipv4_lpm entries that implement them. """
+
+    def __init__(self, p4info_helper, topology, allocator=None):
+        self.p4info_helper = p4info_helper
+        self.topo = topology
+        self.allocator = allocator or TunnelIdAllocator()
+        self.tunnels = []
+
+    def plan(self):
+        """ Computes one tunnel per (ingress switch, destination host) pair.
+            Ingress switches are the switches with at least one host. """
+        ingress_switches = sorted(set(sw for sw, _ in self.topo.host_links.values()))
+        self.tunnels = []
+        for dst_host in sorted(self.topo.host_links):
+            dst_sw, _ = self.topo.host_switch(dst_host)
+            for src_sw in ingress_switches:
+                path = self.topo.path(src_sw, dst_sw)
+                if path is None:
+                    continue
+                tunnel_id = self.allocator.allocate((src_sw, dst_host))
+                self.tunnels.append(Tunnel(tunnel_id, dst_host, path))
+        return self.tunnels
+
+    def build_entries(self):
+        """ Returns a dict mapping each switch name to the table entries it
+            needs, in the order they have to be installed. """
+        if not self.tunnels:
+            self.plan()
+        entries = dict((sw, []) for sw in self.topo.switches)
+        for tunnel in self.tunnels:
+            path = tunnel.path
+            # 1) Tunnel ingress: encapsulate traffic for the destination host
+            entries[tunnel.ingress_sw].append(self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.ipv4_lpm",
+                match_fields={
+                    "hdr.ipv4.dstAddr": (self.topo.host_ip(tunnel.dst_host), 32)
+                },
+                action_name="MyIngress.myTunnel_ingress",
+                action_params={
+                    "dst_id": tunnel.tunnel_id,
+                }))
+            # 2) Tunnel transit: one rule on every switch but the last one
+            for sw, next_sw in zip(path, path[1:]):
+                entries[sw].append(self.p4info_helper.buildTableEntry(
+                    table_name="MyIngress.myTunnel_exact",
+                    match_fields={
+                        "hdr.myTunnel.dst_id": tunnel.tunnel_id
+                    },
+                    action_name="MyIngress.myTunnel_forward",
+                    action_params={
+                        "port": self.topo.port_to(sw, next_sw)
+                    }))
+            # 3) Tunnel egress: decapsulate and send to the host
+            _, host_port = self.topo.host_switch(tunnel.dst_host)
+            entries[tunnel.egress_sw].append(self.p4info_helper.buildTableEntry(
+                table_name="MyIngress.myTunnel_exact",
+                match_fields={
+                    "hdr.myTunnel.dst_id": tunnel.tunnel_id
+                },
+                action_name="MyIngress.myTunnel_egress",
+                action_params={
+                    "dstAddr": self.topo.host_mac(tunnel.dst_host),
+                    "port": host_port
+                }))
+        return entries
+
+    def install(self, switches):
+        """ Writes the entries of every switch in batched requests.
+            `switches` maps switch names to their connections. """
+        for sw_name, table_entries in sorted(self.build_entries().items()):
+            if not table_entries:
+                continue
+            count = switches[sw_name].WriteTableEntries(table_entries)
+            print("Installed %d tunnel rules on %s" % (count, sw_name))
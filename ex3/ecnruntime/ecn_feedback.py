@@ -0,0 +1,350 @@
+#
+# ECN congestion feedback loop for the ecn program.
+#
+# Samples how many ECN capable packets leave each port CE marked, either
+# from the ecn_capable_counter / ecn_marked_counter counters or from packet
+# taps on switch interfaces, and the queue those packets met, from the
+# ecn_qdepth_sum / ecn_qdelay_sum registers. The per-port ecn_threshold is
+# set from the measured queue depth and delay to hold a target queueing
+# delay, and routes leaving a heavily marked port are moved to a less
+# loaded neighbour until the port recovers.
+#
+import os
+import re
+import struct
+import threading
+import time
+
+from p4runtime_lib.lpm_routes import forward_entry
+from p4runtime_lib.stats import SlidingWindow
+
+TYPE_IPV4 = 0x800
+ETH_HDR_LEN = 14
+# version/ihl, tos/ecn ... protocol at 9, addresses at 12 and 16
+IPV4_HDR = struct.Struct('!BB7xB2xII')
+CE = 3
+
+DEFAULT_THRESHOLD = 10  # ECN_THRESHOLD in ecn.p4
+DEFAULT_TARGET_DELAY = 0.005
+MAX_THRESHOLD = (1 << 19) - 1
+MAX_FLOWS = 4096
+
+tap_pattern = re.compile(r'(s\d+)-eth(\d+)')
+
+
+def tap_port(tap):
+    """ Maps a tap source, an interface such as "s1-eth3" or a BMv2 pcap
+        such as "pcaps/s1-eth3_out.pcap", to the ("s1", 3) port it watches. """
+    m = tap_pattern.search(os.path.basename(tap))
+    if m is None:
+        raise Exception("Cannot tell which switch port %s taps" % tap)
+    return m.group(1), int(m.group(2))
+
+
+def parse_ecn(buf, length):
+    """ Returns (flow, ecn) for an IPv4 packet, None otherwise. The flow is
+        a (src, dst, protocol) tuple of integers. """
+    if length < ETH_HDR_LEN + IPV4_HDR.size:
+        return None
+    if struct.unpack_from('!H', buf, 12)[0] != TYPE_IPV4:
+        return None
+    _, tos, proto, src, dst = IPV4_HDR.unpack_from(buf, ETH_HDR_LEN)
+    return (src, dst, proto), tos & 0x03
+
+
+def flow_name(flow):
+    src, dst, proto = flow
+    return '%s->%s/%d' % (socket_ntoa(src), socket_ntoa(dst), proto)
+
+
+def socket_ntoa(addr):
+    return '.'.join(str((addr >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
+
+class EcnFeedbackLoop(object):
+    """
+        Attributes:
+            switches : dict<string, SwitchConnection> // connections by switch name
+            routes   : dict<string, dict>  // sw -> (ip, prefix_len) -> ipv4_forward params
+            ports    : dict<(string, int), SlidingWindow> // CE marking per port
+            flows    : dict<tuple, SlidingWindow>  // CE marking per tapped flow
+            queues   : dict<(string, int), (float, float)> // mean queue depth
+                                                       // (packets) and delay (s)
+
+        Thresholds follow the queue, not the marking rate they cause: a port
+        draining at a steady rate serves depth / delay packets a second
+        (Little's law), so senders backing off at `threshold` packets keep
+        about threshold * delay / depth seconds of queue. Every step moves
+        the threshold `gain` of the way to the value giving `target_delay`,
+        inside [min_threshold, max_threshold]; it goes down while packets
+        wait longer than that and up while they wait less. Ports are
+        reported congested above `high` of their packets marked and cleared
+        below `low`. Routes are moved off a port once `reroute` of its
+        packets are marked, and put back after the port stayed below `low`
+        for `hold` seconds.
+    """
+
+    def __init__(self, p4info_helper, switches, topology, routes,
+                 window=5.0, low=0.01, high=0.1, reroute=0.5,
+                 target_delay=DEFAULT_TARGET_DELAY, gain=0.5, min_threshold=1, max_threshold=MAX_THRESHOLD, hold=None):
+        self.p4info_helper = p4info_helper
+        self.switches = switches
+        self.topo = topology
+        self.routes = routes
+        self.window = window
+        self.low = low
+        self.high = high
+        self.reroute = reroute
+        self.target_delay = target_delay
+        self.gain = gain
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.hold = hold if hold is not None else 3 * window
+
+        self.ports = {}
+        self.flows = {}
+        self.flows_dropped = 0
+        self.tapped = set()
+        self.thresholds = {}
+        self.queues = {}
+        self.congested = set()
+        # (sw, prefix) -> (original port, time the original port got quiet)
+        self.rerouted = {}
+        self.last_counters = {}
+        self.lock = threading.Lock()
+
+        self.capable_id = p4info_helper.get_counters_id("MyEgress.ecn_capable_counter")
+        self.marked_id = p4info_helper.get_counters_id("MyEgress.ecn_marked_counter")
+        self.qdepth_id = p4info_helper.get_registers_id("MyEgress.ecn_qdepth_sum")
+        self.qdelay_id = p4info_helper.get_registers_id("MyEgress.ecn_qdelay_sum")
+
+    def port_window(self, key):
+        window = self.ports.get(key)
+        if window is None:
+            window = self.ports[key] = SlidingWindow(self.window)
+        return window
+
+    # ---- sampling ----
+
+    def read_counter(self, sw, counter_id):
+        values = {}
+        for response in sw.ReadCounters(counter_id):
+            for entity in response.entities:
+                counter = entity.counter_entry
+                values[counter.index.index] = counter.data.packet_count
+        return values
+
+    def read_register(self, sw, register_id):
+        values = {}
+        for response in sw.ReadRegisters(register_id):
+            for entity in response.entities:
+                register = entity.register_entry
+                values[register.index.index] = int.from_bytes(register.data.bitstring, 'big')
+        return values
+
+    def sample_counters(self, now):
+        """ Feeds the counter deltas since the last sample into the port
+            windows, and records the mean queue depth and delay the packets
+            sent since then met. Ports watched by a tap get their marking
+            from the tap, their queue still comes from here. """
+        for sw_name, sw in self.switches.items():
+            capable = self.read_counter(sw, self.capable_id)
+            marked = self.read_counter(sw, self.marked_id)
+            qdepth = self.read_register(sw, self.qdepth_id)
+            qdelay = self.read_register(sw, self.qdelay_id)
+            with self.lock:
+                for port, total in capable.items():
+                    key = (sw_name, port)
+                    last = self.last_counters.get(key)
+                    sample = (total, marked.get(port, 0), qdepth.get(port, 0), qdelay.get(port, 0))
+                    self.last_counters[key] = sample
+                    if last is None:
+                        continue
+                    d_total, d_marked, d_depth, d_delay = [
+                        value - last_value for value, last_value in zip(sample, last)]
+                    # counters and registers restart when the pipeline is pushed again
+                    if min(d_total, d_marked, d_depth, d_delay) < 0 or not d_total:
+                        continue
+                    # deq_timedelta is in microseconds
+                    self.queues[key] = (float(d_depth) / d_total, d_delay * 1e-6 / d_total)
+                    if key not in self.tapped:
+                        self.port_window(key).add(now, d_total, d_marked)
+
+    def add_packet(self, key, buf, length, now=None):
+        """ Accounts one packet seen by the tap on port `key`. """
+        parsed = parse_ecn(buf, length)
+        if parsed is None:
+            return
+        flow, ecn = parsed
+        if not ecn:
+            return
+        now = time.time() if now is None else now
+        marked = 1 if ecn == CE else 0
+        with self.lock:
+            self.port_window(key).add(now, 1, marked)
+            window = self.flows.get(flow)
+            if window is None:
+                if len(self.flows) >= MAX_FLOWS:
+                    self.flows_dropped += 1
+                    return
+                window = self.flows[flow] = SlidingWindow(self.window)
+            window.add(now, 1, marked)
+
+    def run_tap(self, key, source):
+        self.tapped.add(key)
+        for buf, length in source:
+            self.add_packet(key, buf, length)
+
+    # ---- control ----
+
+    def threshold_entry(self, port, threshold):
+        return self.p4info_helper.buildTableEntry(
+            table_name="MyEgress.ecn_threshold",
+            match_fields={
+                "standard_metadata.egress_port": port
+            },
+            action_name="MyEgress.set_ecn_threshold",
+            action_params={
+                "threshold": threshold
+            })
+
+    def route_entry(self, prefix, dst_addr, port):
+        return forward_entry(self.p4info_helper, "MyIngress.ipv4_lpm", prefix,
+                             {"dstAddr": dst_addr, "port": port})
+
+    def neighbor_on(self, sw, port):
+        for neighbor, p in self.topo.sw_ports.get(sw, {}).items():
+            if p == port:
+                return neighbor
+        return None
+
+    def detour(self, sw, prefix, port, now):
+        """ Picks the least marked port of `sw` leading to a neighbour that
+            does not send `prefix` straight back to `sw`. """
+        best = None
+        for neighbor in self.topo.neighbors(sw):
+            alt_port = self.topo.port_to(sw, neighbor)
+            if alt_port == port:
+                continue
+            back = self.routes.get(neighbor, {}).get(prefix)
+            if back is not None and back['port'] == self.topo.port_to(neighbor, sw):
+                continue
+            window = self.ports.get((sw, alt_port))
+            fraction = window.fraction(now) if window else 0.0
+            if fraction >= self.reroute:
+                continue
+            if best is None or fraction < best[0]:
+                best = (fraction, alt_port)
+        return best[1] if best else None
+
+    def step_once(self, now=None):
+        """ Runs one control step and pushes the resulting changes, batched
+            per switch. Returns the number of entries written. """
+        now = time.time() if now is None else now
+        inserts, modifies = {}, {}
+        with self.lock:
+            for (sw, port), window in sorted(self.ports.items()):
+                fraction = window.fraction(now)
+                self.update_alert(sw, port, fraction)
+                self.adjust_routes(sw, port, fraction, now, modifies)
+            for sw, port in sorted(self.queues):
+                self.adjust_threshold(sw, port, inserts, modifies)
+        written = 0
+        for sw_name in sorted(set(inserts) | set(modifies)):
+            sw = self.switches[sw_name]
+            if inserts.get(sw_name):
+                written += sw.WriteTableEntries(inserts[sw_name])
+            if modifies.get(sw_name):
+                written += sw.WriteTableEntries(modifies[sw_name], modify=True)
+        return written
+
+    def update_alert(self, sw, port, fraction):
+        key = (sw, port)
+        if fraction >= self.high and key not in self.congested:
+            self.congested.add(key)
+            print("Congestion on %s-p%d: %.1f%% of packets CE marked" % (sw, port, fraction * 100))
+        elif fraction < self.low and key in self.congested:
+            self.congested.discard(key)
+            print("Congestion cleared on %s-p%d" % (sw, port))
+
+    def adjust_threshold(self, sw, port, inserts, modifies):
+        key = (sw, port)
+        depth, delay = self.queues[key]
+        # without a queue there is no telling how fast the port drains
+        if depth <= 0 or delay <= 0:
+            return
+        current = self.thresholds.get(key, DEFAULT_THRESHOLD)
+        target = self.target_delay * depth / delay
+        threshold = int(round(current + self.gain * (target - current)))
+        threshold = max(self.min_threshold, min(threshold, self.max_threshold))
+        if threshold == current:
+            return
+        updates = modifies if key in self.thresholds else inserts
+        updates.setdefault(sw, []).append(self.threshold_entry(port, threshold))
+        self.thresholds[key] = threshold
+
+    def adjust_routes(self, sw, port, fraction, now, modifies):
+        if self.neighbor_on(sw, port) is None:
+            return
+        routes = self.routes.get(sw, {})
+        if fraction >= self.reroute:
+            for prefix, params in sorted(routes.items()):
+                if params['port'] != port:
+                    continue
+                alt_port = self.detour(sw, prefix, port, now)
+                if alt_port is None:
+                    continue
+                # a route moved again still goes back to where it started
+                self.rerouted.setdefault((sw, prefix), (port, None))
+                params['port'] = alt_port
+                modifies.setdefault(sw, []).append(
+                    self.route_entry(prefix, params['dstAddr'], alt_port))
+                print("Moved %s/%d on %s from port %d to port %d" % (
+                    prefix[0], prefix[1], sw, port, alt_port))
+            return
+        # put routes back once their original port has been quiet long enough
+        for (r_sw, prefix), (orig_port, quiet_since) in list(self.rerouted.items()):
+            if r_sw != sw or orig_port != port:
+                continue
+            if fraction >= self.low:
+                self.rerouted[(r_sw, prefix)] = (orig_port, None)
+            elif quiet_since is None:
+                self.rerouted[(r_sw, prefix)] = (orig_port, now)
+            elif now - quiet_since >= self.hold:
+                del self.rerouted[(r_sw, prefix)]
+                params = routes[prefix]
+                params['port'] = orig_port
+                modifies.setdefault(sw, []).append(
+                    self.route_entry(prefix, params['dstAddr'], orig_port))
+                print("Restored %s/%d on %s to port %d" % (
+                    prefix[0], prefix[1], sw, orig_port))
+
+    def run(self, interval=1.0):
+        while True:
+            now = time.time()
+            self.sample_counters(now)
+            self.step_once(now)
+            time.sleep(interval)
+
+    # ---- metrics ----
+
+    def metrics(self):
+        """ Per-port and per-flow congestion figures, ready to alert on. """
+        now = time.time()
+        with self.lock:
+            ports = {}
+            for (sw, port), window in sorted(self.ports.items()):
+                ports['%s-p%d' % (sw, port)] = {
+                    'ce_fraction': window.fraction(now),
+                    'packets': window.total,
+                    'marked': window.marked,
+                    'threshold': self.thresholds.get((sw, port), DEFAULT_THRESHOLD),
+                    'queue_depth': self.queues.get((sw, port), (0.0, 0.0))[0],
+                    'queue_delay': self.queues.get((sw, port), (0.0, 0.0))[1],
+                    'congested': (sw, port) in self.congested,
+                    'rerouted_prefixes': sum(1 for (r_sw, _), (p, _) in self.rerouted.items()
+                                             if r_sw == sw and p == port),
+                }
+            flows = dict((flow_name(flow), window.fraction(now))
+                         for flow, window in self.flows.items())
+        return {'ports': ports, 'flows': flows, 'flows_dropped': self.flows_dropped}
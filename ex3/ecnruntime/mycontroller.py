@@ -2,7 +2,7 @@
 import argparse
 import os
 import sys
-from time import sleep
+import threading
 
 import grpc
 
@@ -14,82 +14,70 @@ sys.path.append(
 import p4runtime_lib.bmv2
 import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.capture import read_iface, read_pcap
+from p4runtime_lib.http_api import serve
+from p4runtime_lib.lpm_routes import (TRIANGLE_ROUTES as ROUTES, aggregate_forward_routes,
+                                      forward_entry)
+from p4runtime_lib.metrics import METRICS
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
+from p4runtime_lib.topology import Topology
 
-def writeForwardRules(p4info_helper, ingress_sw, egress_sw,
-                        match_fields, action_params):
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm",
-        match_fields={
-            "hdr.ipv4.dstAddr": match_fields
-        },
-        action_name="MyIngress.ipv4_forward",
-        action_params=action_params
-    )
-    ingress_sw.WriteTableEntry(table_entry)
+from ecn_feedback import DEFAULT_TARGET_DELAY, EcnFeedbackLoop, tap_port
 
-def main(p4info_file_path, bmv2_file_path):
+def startTaps(loop, taps):
+    for tap in taps:
+        key = tap_port(tap)
+        if os.path.isfile(tap):
+            source = read_pcap(tap)
+        else:
+            source = read_iface(tap, outgoing_only=True)
+        t = threading.Thread(target=loop.run_tap, args=(key, source))
+        t.daemon = True
+        t.start()
+
+def main(p4info_file_path, bmv2_file_path, args):
     p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
 
     try:
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
+        switches = {}
+        for n, name in enumerate(sorted(ROUTES, key=lambda sw: int(sw[1:]))):
+            switches[name] = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+                name=name,
+                address='127.0.0.1:%d' % (50051 + n),
+                device_id=n,
+                proto_dump_file='logs/%s-p4runtime-requests.txt' % name)
 
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
+        for sw in switches.values():
+            sw.MasterArbitrationUpdate()
 
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-        # s1 流规则下发
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.1.1", 32], {"dstAddr": "08:00:00:00:01:01", "port": 2})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.1.11", 32], {"dstAddr": "08:00:00:00:01:11", "port": 1})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.2.0", 24], {"dstAddr": "08:00:00:00:02:00", "port": 3})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.3.0", 24], {"dstAddr": "08:00:00:00:03:00", "port": 4})
-        
-        # s2 流规则下发
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.2.2", 32], {"dstAddr": "08:00:00:00:02:02", "port": 2})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.2.22", 32], {"dstAddr": "08:00:00:00:02:22", "port": 1})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.1.0", 24], {"dstAddr": "08:00:00:00:01:00", "port": 3})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.3.0", 24], {"dstAddr": "08:00:00:00:03:00", "port": 4})
-        
-        # s3 流规则下发
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.3.3", 32], {"dstAddr": "08:00:00:00:01:01", "port": 1})
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.1.0", 32], {"dstAddr": "08:00:00:00:01:11", "port": 2})
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.2.0", 24], {"dstAddr": "08:00:00:00:02:00", "port": 3})
+        for name, sw in switches.items():
+            sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=bmv2_file_path)
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s" % name)
 
+        installed = {}
+        for name, sw in switches.items():
+            installed[name] = aggregate_forward_routes(ROUTES[name], args.aggregate)
+            # ecn.p4 has no NoAction, drop is what a miss of ipv4_lpm does
+            count = sw.WriteTableEntries(
+                forward_entry(p4info_helper, "MyIngress.ipv4_lpm", prefix, params,
+                              miss_action="MyIngress.drop")
+                for prefix, params in installed[name].items())
+            print("Installed %d route entries on %s (%d routes)" % (
+                count, name, len(ROUTES[name])))
 
+        if args.feedback or args.tap:
+            topology = Topology.from_file(args.topo)
+            routes = dict((name, dict((prefix, params) for prefix, params in sw_routes.items()
+                                      if params is not None))
+                          for name, sw_routes in installed.items())
+            loop = EcnFeedbackLoop(p4info_helper, switches, topology, routes,
+                                   window=args.window, target_delay=args.target_delay)
+            startTaps(loop, args.tap)
+            if args.http_port:
+                serve({'/': loop.metrics, '/rpc': METRICS.snapshot,
+                       '/metrics': METRICS.prometheus}, args.http_port)
+            loop.run(args.interval)
 
     except KeyboardInterrupt:
         print(" Shutting down.")
@@ -106,6 +94,26 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/ecn.json')
+    parser.add_argument('--topo', help='Topology JSON file used by run_exercise.py',
+                        type=str, action="store", required=False,
+                        default='./topology.json')
+    parser.add_argument('--feedback', help='keep running and adapt ECN thresholds and routes to CE marking',
+                        action="store_true", required=False, default=False)
+    parser.add_argument('--tap', help='switch interface or pcap (e.g. pcaps/s1-eth3_out.pcap) to sample per flow; repeatable',
+                        type=str, action="append", required=False, default=[])
+    parser.add_argument('--interval', help='seconds between control steps',
+                        type=float, action="store", required=False, default=1.0)
+    parser.add_argument('--window', help='seconds of history the CE marking rate is computed over',
+                        type=float, action="store", required=False, default=5.0)
+    parser.add_argument('--target-delay', help='queueing delay in seconds the ECN thresholds are set to hold',
+                        type=float, action="store", required=False, default=DEFAULT_TARGET_DELAY)
+    parser.add_argument('--http-port', help='serve congestion metrics as JSON on this localhost port, '
+                        'P4Runtime RPC metrics on /rpc and /metrics (Prometheus)',
+                        type=int, action="store", required=False, default=0)
+    parser.add_argument('--aggregate', help='merge routes before installing them: exact keeps every '
+                        'lookup result, loose also lets addresses without a route match any route',
+                        type=str, action="store", required=False, default='exact',
+                        choices=['off', 'exact', 'loose'])
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -116,4 +124,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    if (args.feedback or args.tap) and not os.path.exists(args.topo):
+        parser.print_help()
+        print("\nTopology file not found: %s" % args.topo)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args)
\ No newline at end of file
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# MRI telemetry collector.
+#
+# Reads packets carrying the MRI IPv4 option pushed by mri.p4, either live
+# from a host interface or from a pcap file, and keeps per-switch queue
+# depth percentiles in fixed-memory histograms. The figures are printed
+# periodically and served as JSON over HTTP on localhost.
+#
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+
+# Import P4Runtime lib from parent utils dir
+# Probably there's a better way of doing this.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../utils/'))
+from p4runtime_lib.capture import read_iface, read_pcap
+from p4runtime_lib.http_api import serve
+from p4runtime_lib.stats import Histogram
+
+TYPE_IPV4 = 0x800
+IPV4_OPTION_MRI = 31
+MAX_HOPS = 9
+
+ETH_HDR_LEN = 14
+IPV4_HDR_LEN = 20
+
+U8 = struct.Struct('!B')
+U16 = struct.Struct('!H')
+SWTRACE = struct.Struct('!II')  # swid, qdepth
+
+
+def parse_swtraces(buf, length):
+    """ Yields the (swid, qdepth) pairs of an MRI packet held in the first
+        `length` bytes of `buf`. Nothing is copied: fields are unpacked in
+        place from the buffer. Non-MRI packets yield nothing. """
+    if length < ETH_HDR_LEN + IPV4_HDR_LEN + 4:
+        return
+    if U16.unpack_from(buf, 12)[0] != TYPE_IPV4:
+        return
+    ihl = U8.unpack_from(buf, ETH_HDR_LEN)[0] & 0x0f
+    if ihl <= 5:
+        return
+    offset = ETH_HDR_LEN + IPV4_HDR_LEN
+    if U8.unpack_from(buf, offset)[0] & 0x1f != IPV4_OPTION_MRI:
+        return
+    count = U16.unpack_from(buf, offset + 2)[0]
+    # never trust count beyond what the header and the capture hold
+    end = min(ETH_HDR_LEN + ihl * 4, length)
+    offset += 4
+    for _ in range(min(count, MAX_HOPS)):
+        if offset + SWTRACE.size > end:
+            return
+        yield SWTRACE.unpack_from(buf, offset)
+        offset += SWTRACE.size
+
+
+class MriCollector(object):
+    """ Aggregates MRI switch traces into per-switch queue depth histograms.
+
+        Updates happen on the capture thread and reads on the HTTP thread;
+        a snapshot may be a few packets behind, which is fine for
+        monitoring and keeps the per-packet path free of locks.
+    """
+
+    def __init__(self, quantiles=(0.5, 0.9, 0.99)):
+        self.quantiles = quantiles
+        self.qdepth = {}
+        self.packets = 0
+        self.mri_packets = 0
+        self.started = time.time()
+
+    def add_packet(self, buf, length):
+        self.packets += 1
+        hops = 0
+        for swid, qdepth in parse_swtraces(buf, length):
+            hist = self.qdepth.get(swid)
+            if hist is None:
+                hist = self.qdepth[swid] = Histogram()
+            hist.record(qdepth)
+            hops += 1
+        if hops:
+            self.mri_packets += 1
+
+    def run(self, source):
+        for buf, length in source:
+            self.add_packet(buf, length)
+
+    def snapshot(self):
+        elapsed = time.time() - self.started
+        return {
+            'packets': self.packets,
+            'mri_packets': self.mri_packets,
+            'packets_per_second': self.packets / elapsed if elapsed else 0.0,
+            'switches': dict(('%d' % swid, hist.summary(self.quantiles))
+                             for swid, hist in sorted(self.qdepth.items())),
+        }
+
+    def hotspots(self, quantile=0.99, limit=5):
+        """ Switches with the deepest queues at the given quantile. """
+        ranked = sorted(((hist.quantile(quantile), swid)
+                         for swid, hist in self.qdepth.items()), reverse=True)
+        return [{'swid': swid, 'qdepth': qdepth} for qdepth, swid in ranked[:limit]]
+
+    def print_summary(self):
+        snapshot = self.snapshot()
+        print('\n----- MRI queue depth (%d packets, %d with MRI) -----' % (
+            snapshot['packets'], snapshot['mri_packets']))
+        for swid, summary in snapshot['switches'].items():
+            print('s%s: %s' % (swid, ', '.join(
+                '%s=%s' % (k, summary[k]) for k in sorted(summary))))
+
+
+def main(args):
+    collector = MriCollector()
+    if args.http_port:
+        serve({'/': collector.snapshot, '/hotspots': collector.hotspots},
+              args.http_port)
+        print("Serving MRI figures on http://127.0.0.1:%d/" % args.http_port)
+
+    if args.pcap:
+        collector.run(read_pcap(args.pcap))
+        collector.print_summary()
+        return
+
+    def report():
+        while True:
+            time.sleep(args.interval)
+            collector.print_summary()
+    reporter = threading.Thread(target=report)
+    reporter.daemon = True
+    reporter.start()
+    try:
+        collector.run(read_iface(args.iface))
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    collector.print_summary()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MRI telemetry collector')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--iface', help='host interface to capture from',
+                        type=str, action="store")
+    source.add_argument('-r', '--pcap', help='pcap file to read instead of capturing',
+                        type=str, action="store")
+    parser.add_argument('--http-port', help='serve figures on this localhost port (0 disables)',
+                        type=int, action="store", default=0)
+    parser.add_argument('--interval', help='seconds between printed summaries',
+                        type=float, action="store", default=2.0)
+    args = parser.parse_args()
+    main(args)
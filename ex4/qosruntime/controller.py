@@ -2,7 +2,6 @@
 import argparse
 import os
 import sys
-from time import sleep
 
 import grpc
 
@@ -14,82 +13,51 @@ sys.path.append(
 import p4runtime_lib.bmv2
 import p4runtime_lib.helper
 from p4runtime_lib.error_utils import printGrpcError
+from p4runtime_lib.lpm_routes import (TRIANGLE_ROUTES as ROUTES, aggregate_forward_routes,
+                                      forward_entry)
 from p4runtime_lib.switch import ShutdownAllSwitchConnections
 
-def writeForwardRules(p4info_helper, ingress_sw, egress_sw,
-                        match_fields, action_params):
-    table_entry = p4info_helper.buildTableEntry(
-        table_name="MyIngress.ipv4_lpm",
-        match_fields={
-            "hdr.ipv4.dstAddr": match_fields
-        },
-        action_name="MyIngress.ipv4_forward",
-        action_params=action_params
-    )
-    ingress_sw.WriteTableEntry(table_entry)
+from qos_policy import PolicyCompiler
 
-def main(p4info_file_path, bmv2_file_path):
+def compilePolicy(policy_file):
+    compiler = PolicyCompiler.from_file(policy_file).compile()
+    print("Compiled %d QoS classes into %d qos_classify and %d qos_dst_lpm entries"
+          " (%d without merging)" % (len(compiler.classes), len(compiler.ternary),
+                                     len(compiler.lpm), compiler.naive_size()))
+    return compiler
+
+def main(p4info_file_path, bmv2_file_path, policy_file, args):
     p4info_helper = p4runtime_lib.helper.P4InfoHelper(p4info_file_path)
+    policy = compilePolicy(policy_file) if policy_file else None
 
     try:
-        s1 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s1',
-            address='127.0.0.1:50051',
-            device_id=0,
-            proto_dump_file='logs/s1-p4runtime-requests.txt')
-        s2 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s2',
-            address='127.0.0.1:50052',
-            device_id=1,
-            proto_dump_file='logs/s2-p4runtime-requests.txt')
-        s3 = p4runtime_lib.bmv2.Bmv2SwitchConnection(
-            name='s3',
-            address='127.0.0.1:50053',
-            device_id=2,
-            proto_dump_file='logs/s3-p4runtime-requests.txt')
-
-        s1.MasterArbitrationUpdate()
-        s2.MasterArbitrationUpdate()
-        s3.MasterArbitrationUpdate()
+        switches = {}
+        for n, name in enumerate(sorted(ROUTES, key=lambda sw: int(sw[1:]))):
+            switches[name] = p4runtime_lib.bmv2.Bmv2SwitchConnection(
+                name=name,
+                address='127.0.0.1:%d' % (50051 + n),
+                device_id=n,
+                proto_dump_file='logs/%s-p4runtime-requests.txt' % name)
 
-        s1.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s1")
-        s2.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s2")
-        s3.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
-                                       bmv2_json_file_path=bmv2_file_path)
-        print("Installed P4 Program using SetForwardingPipelineConfig on s3")
-        # s1 流规则下发
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.1.1", 32], {"dstAddr": "08:00:00:00:01:01", "port": 2})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.1.11", 32], {"dstAddr": "08:00:00:00:01:11", "port": 1})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.2.0", 24], {"dstAddr": "08:00:00:00:02:00", "port": 3})
-        writeForwardRules(p4info_helper, s1, s1, 
-        ["10.0.3.0", 24], {"dstAddr": "08:00:00:00:03:00", "port": 4})
-        
-        # s2 流规则下发
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.2.2", 32], {"dstAddr": "08:00:00:00:02:02", "port": 2})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.2.22", 32], {"dstAddr": "08:00:00:00:02:22", "port": 1})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.1.0", 24], {"dstAddr": "08:00:00:00:01:00", "port": 3})
-        writeForwardRules(p4info_helper, s2, s2, 
-        ["10.0.3.0", 24], {"dstAddr": "08:00:00:00:03:00", "port": 4})
-        
-        # s3 流规则下发
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.3.3", 32], {"dstAddr": "08:00:00:00:01:01", "port": 1})
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.1.0", 32], {"dstAddr": "08:00:00:00:01:11", "port": 2})
-        writeForwardRules(p4info_helper, s3, s3, 
-        ["10.0.2.0", 24], {"dstAddr": "08:00:00:00:02:00", "port": 3})
+        for sw in switches.values():
+            sw.MasterArbitrationUpdate()
 
+        for name, sw in switches.items():
+            sw.SetForwardingPipelineConfig(p4info=p4info_helper.p4info,
+                                           bmv2_json_file_path=bmv2_file_path)
+            print("Installed P4 Program using SetForwardingPipelineConfig on %s" % name)
 
+        installed = {}
+        for name, sw in switches.items():
+            installed[name] = aggregate_forward_routes(ROUTES[name], args.aggregate)
+            count = sw.WriteTableEntries(
+                forward_entry(p4info_helper, "MyIngress.ipv4_lpm", prefix, params)
+                for prefix, params in installed[name].items())
+            print("Installed %d route entries on %s (%d routes)" % (
+                count, name, len(ROUTES[name])))
+            if policy is not None:
+                sw.WriteTableEntries(policy.build_entries(p4info_helper))
+                print("Installed QoS policy on %s" % name)
 
     except KeyboardInterrupt:
         print(" Shutting down.")
@@ -106,6 +74,14 @@ if __name__ == '__main__':
     parser.add_argument('--bmv2-json', help='BMv2 JSON file from p4c',
                         type=str, action="store", required=False,
                         default='./build/qos.json')
+    parser.add_argument('--policy', help='QoS policy JSON file; empty to skip the QoS tables. '
+                        'Its queues need switches started with --priority-queues',
+                        type=str, action="store", required=False,
+                        default='./qos_policy.json')
+    parser.add_argument('--aggregate', help='merge routes before installing them: exact keeps every '
+                        'lookup result, loose also lets addresses without a route match any route',
+                        type=str, action="store", required=False, default='exact',
+                        choices=['off', 'exact', 'loose'])
     args = parser.parse_args()
 
     if not os.path.exists(args.p4info):
@@ -116,4 +92,8 @@ if __name__ == '__main__':
         parser.print_help()
         print("\nBMv2 JSON file not found: %s\nHave you run 'make'?" % args.bmv2_json)
         parser.exit(1)
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    if args.policy and not os.path.exists(args.policy):
+        parser.print_help()
+        print("\nQoS policy file not found: %s" % args.policy)
+        parser.exit(1)
+    main(args.p4info, args.bmv2_json, args.policy, args)
\ No newline at end of file
@@ -0,0 +1,305 @@
+#
+# QoS policy compiler for the qos program.
+#
+# A policy is a list of traffic classes, each mapping some of protocol,
+# source/destination prefixes and destination ports to a DSCP value and a
+# priority queue:
+#
+#   {"classes": [
+#       {"name": "voice", "protocol": "udp", "dst_ports": ["16384-32767"],
+#        "dscp": 46, "queue": 7},
+#       {"name": "web", "protocol": "tcp", "dst_ports": [80, 443],
+#        "dscp": 26, "queue": 3},
+#       {"name": "to-h3", "dst_prefixes": ["10.0.3.0/24"], "dscp": 10, "queue": 1}
+#   ]}
+#
+# Classes that only name destination prefixes become MyIngress.qos_dst_lpm
+# entries, where the longest prefix wins. All other classes become
+# MyIngress.qos_classify ternary entries, earlier classes taking
+# precedence, and are looked up before the LPM table. Traffic matching no
+# class keeps the protocol based marking of the program.
+#
+# The queue only takes effect on switches that have priority queues.
+# set_qos writes it to standard_metadata.priority, which simple_switch and
+# simple_switch_grpc schedule on only when started with the target option
+# --priority-queues 8 (after "--", e.g. simple_switch_grpc ... --
+# --priority-queues 8). With the default single queue per port the
+# entries still set the DSCP, but every class shares the same FIFO.
+#
+import json
+import socket
+import struct
+
+PROTOCOLS = {
+    'icmp': 1,
+    'tcp': 6,
+    'udp': 17,
+    'gre': 47,
+    'esp': 50,
+    'ah': 51,
+    'ospf': 89,
+}
+# protocols whose headers start with a source and destination port
+PORT_PROTOCOLS = (6, 17)
+
+MAX_DSCP = 63
+MAX_QUEUE = 7
+FULL_MASK = 0xffffffff
+PORT_MASK = 0xffff
+
+
+def parse_prefix(prefix):
+    """ "10.0.1.0/24" -> (0x0a000100, 24), a bare address is a /32. """
+    addr, _, length = prefix.partition('/')
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise Exception("Bad prefix length in %s" % prefix)
+    value = struct.unpack('!I', socket.inet_aton(addr))[0]
+    return value & prefix_mask(length), length
+
+
+def prefix_mask(length):
+    return (FULL_MASK << (32 - length)) & FULL_MASK
+
+
+def format_prefix(value, length):
+    return '%s/%d' % (socket.inet_ntoa(struct.pack('!I', value)), length)
+
+
+def parse_ports(ports):
+    """ Port numbers and "low-high" strings -> sorted, merged (low, high)
+        ranges. """
+    ranges = []
+    for port in ports:
+        if isinstance(port, int):
+            low = high = port
+        else:
+            low, _, high = str(port).partition('-')
+            low = int(low)
+            high = int(high) if high else low
+        if not 0 <= low <= high <= PORT_MASK:
+            raise Exception("Bad port range %r" % port)
+        ranges.append((low, high))
+    ranges.sort()
+    merged = []
+    for low, high in ranges:
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def range_to_masks(low, high, bits=16):
+    """ Smallest set of (value, mask) pairs matching exactly low..high. """
+    masks = []
+    full = (1 << bits) - 1
+    while low <= high:
+        # largest aligned block starting at low that fits in the range
+        size = low & -low if low else 1 << bits
+        while size > high - low + 1:
+            size >>= 1
+        masks.append((low, full & ~(size - 1)))
+        low += size
+    return masks
+
+
+class PrefixTrie(object):
+    """ Binary trie over IPv4 prefixes. Each node is a [data, zero, one]
+        list; data is None where no prefix ends. """
+
+    def __init__(self):
+        self.root = [None, None, None]
+        self.size = 0
+
+    def insert(self, value, length, data):
+        """ Adds value/length -> data. The first data given for a prefix
+            is kept. """
+        node = self.root
+        for depth in range(length):
+            bit = 1 + ((value >> (31 - depth)) & 1)
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[0] is None:
+            node[0] = data
+            self.size += 1
+
+    def compress(self):
+        """ Rewrites the trie into the fewest prefixes giving every address
+            the same longest-prefix-match result: sibling prefixes carrying
+            the same data are replaced by their parent, and prefixes whose
+            data equals the data of the closest covering prefix are dropped.
+            Each node is visited once. """
+        self._compress(self.root, None)
+        self.size = sum(1 for _ in self.items())
+
+    def _compress(self, node, inherited):
+        effective = node[0] if node[0] is not None else inherited
+        for bit in (1, 2):
+            child = node[bit]
+            if child is not None:
+                self._compress(child, effective)
+                if child[0] is None and child[1] is None and child[2] is None:
+                    node[bit] = None
+        zero, one = node[1], node[2]
+        if (zero is not None and one is not None and
+                zero[1] is None and zero[2] is None and
+                one[1] is None and one[2] is None and zero[0] == one[0]):
+            # the two halves cover the whole prefix with the same data
+            node[0] = zero[0]
+            node[1] = node[2] = None
+        if node[0] is not None and node[0] == inherited:
+            node[0] = None
+
+    def items(self):
+        """ Yields (value, length, data) for every prefix, shortest first
+            along each branch. """
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, value, length = stack.pop()
+            if node[0] is not None:
+                yield value, length, node[0]
+            if node[2] is not None:
+                stack.append((node[2], value | (1 << (31 - length)), length + 1))
+            if node[1] is not None:
+                stack.append((node[1], value, length + 1))
+
+
+def merge_prefixes(prefixes):
+    """ Smallest list of (value, length) prefixes covering the same
+        addresses as `prefixes`. """
+    trie = PrefixTrie()
+    for prefix in prefixes:
+        value, length = parse_prefix(prefix)
+        trie.insert(value, length, True)
+    trie.compress()
+    return sorted((value, length) for value, length, _ in trie.items())
+
+
+class TrafficClass(object):
+
+    def __init__(self, spec, index):
+        self.name = spec.get('name', 'class%d' % index)
+        self.dscp = int(spec['dscp'])
+        self.queue = int(spec.get('queue', 0))
+        if not 0 <= self.dscp <= MAX_DSCP:
+            raise Exception("%s: dscp must be between 0 and %d" % (self.name, MAX_DSCP))
+        if not 0 <= self.queue <= MAX_QUEUE:
+            raise Exception("%s: queue must be between 0 and %d" % (self.name, MAX_QUEUE))
+        protocols = spec.get('protocol', [])
+        if not isinstance(protocols, list):
+            protocols = [protocols]
+        self.protocols = sorted(set(PROTOCOLS[p] if p in PROTOCOLS else int(p)
+                                    for p in protocols))
+        self.src_prefixes = spec.get('src_prefixes', [])
+        self.dst_prefixes = spec.get('dst_prefixes', [])
+        self.dst_ports = spec.get('dst_ports', [])
+        if self.dst_ports and not self.protocols:
+            self.protocols = list(PORT_PROTOCOLS)
+        if self.dst_ports and any(p not in PORT_PROTOCOLS for p in self.protocols):
+            raise Exception("%s: ports only apply to tcp and udp" % self.name)
+
+    def prefix_only(self):
+        return not (self.protocols or self.src_prefixes or self.dst_ports)
+
+    def naive_size(self):
+        """ Entries needed without merging: one per protocol, prefix and
+            single port combination. """
+        ports = sum(high - low + 1 for low, high in parse_ports(self.dst_ports))
+        return (max(len(self.protocols), 1) * max(len(self.src_prefixes), 1) *
+                max(len(self.dst_prefixes), 1) * max(ports, 1))
+
+
+class PolicyCompiler(object):
+    """ Compiles a policy into qos_classify (ternary) and qos_dst_lpm
+        entries. After compile(), `ternary` holds (match, dscp, queue,
+        priority) tuples, with match mapping field names to (value, mask),
+        and `lpm` holds ((value, length), dscp, queue) tuples. """
+
+    def __init__(self, classes):
+        self.classes = [TrafficClass(spec, i) for i, spec in enumerate(classes)]
+        self.ternary = []
+        self.lpm = []
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f)['classes'])
+
+    def compile(self):
+        self.ternary = []
+        seen = set()
+        lpm_trie = PrefixTrie()
+        for tc in self.classes:
+            if tc.prefix_only():
+                for prefix in tc.dst_prefixes:
+                    value, length = parse_prefix(prefix)
+                    lpm_trie.insert(value, length, (tc.dscp, tc.queue))
+                continue
+            srcs = merge_prefixes(tc.src_prefixes) or [None]
+            dsts = merge_prefixes(tc.dst_prefixes) or [None]
+            ports = [m for low, high in parse_ports(tc.dst_ports)
+                     for m in range_to_masks(low, high)]
+            if (0, 0) in ports:
+                ports = []
+            for proto in tc.protocols or [None]:
+                for src in srcs:
+                    for dst in dsts:
+                        for port in ports or [None]:
+                            key = (proto, src, dst, port)
+                            # an identical match of an earlier class wins
+                            if key in seen:
+                                continue
+                            seen.add(key)
+                            self.ternary.append((self._match(*key), tc.dscp, tc.queue))
+        # earlier classes get higher priorities
+        count = len(self.ternary)
+        self.ternary = [(match, dscp, queue, count - i)
+                        for i, (match, dscp, queue) in enumerate(self.ternary)]
+        lpm_trie.compress()
+        self.lpm = [((value, length), dscp, queue)
+                    for value, length, (dscp, queue) in lpm_trie.items()]
+        return self
+
+    def _match(self, proto, src, dst, port):
+        # wildcard fields are left out, as P4Runtime requires
+        match = {}
+        if proto is not None:
+            match['hdr.ipv4.protocol'] = (proto, 0xff)
+        if src is not None and src[1]:
+            match['hdr.ipv4.srcAddr'] = (src[0], prefix_mask(src[1]))
+        if dst is not None and dst[1]:
+            match['hdr.ipv4.dstAddr'] = (dst[0], prefix_mask(dst[1]))
+        if port is not None:
+            match['meta.l4_dst_port'] = port
+        return match
+
+    def naive_size(self):
+        return sum(tc.naive_size() for tc in self.classes)
+
+    def size(self):
+        return len(self.ternary) + len(self.lpm)
+
+    def build_entries(self, p4info_helper):
+        for match, dscp, queue, priority in self.ternary:
+            yield p4info_helper.buildTableEntry(
+                table_name="MyIngress.qos_classify",
+                match_fields=match,
+                action_name="MyIngress.set_qos",
+                action_params={
+                    "dscp": dscp,
+                    "queue": queue
+                },
+                priority=priority)
+        for (value, length), dscp, queue in self.lpm:
+            yield p4info_helper.buildTableEntry(
+                table_name="MyIngress.qos_dst_lpm",
+                match_fields={
+                    "hdr.ipv4.dstAddr": (socket.inet_ntoa(struct.pack('!I', value)), length)
+                },
+                action_name="MyIngress.set_qos",
+                action_params={
+                    "dscp": dscp,
+                    "queue": queue
+                })
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#
+# Probe engine for the link_monitor program.
+#
+# Plans a small set of source-routed probes that together cross every
+# switch-to-switch link of the topology, sends them from one host at a
+# bounded rate, and decodes the probe_data stack the switches push onto
+# returning probes into per-link utilization time series.
+#
+# Switch sN is expected to stamp swid N (set_swid default action of the
+# swid table), as the other exercise controllers do.
+#
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+
+# Import P4Runtime lib from parent utils dir
+# Probably there's a better way of doing this.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../../utils/'))
+from p4runtime_lib.capture import open_raw_socket, read_iface
+from p4runtime_lib.stats import RingBuffer
+from p4runtime_lib.topology import Topology
+
+TYPE_PROBE = 0x812
+MAX_HOPS = 10
+
+ETH_HDR_LEN = 14
+ETH_HDR = struct.Struct('!6s6sH')
+PROBE_HDR = struct.Struct('!B')  # hop_cnt
+# bos + swid, port, byte_cnt, last_time (48 bits), cur_time (48 bits)
+PROBE_DATA = struct.Struct('!BBIHIHI')
+BROADCAST_MAC = b'\xff' * 6
+
+
+def switch_distances(topo):
+    """ Hop distance between every pair of switches, one BFS per switch. """
+    dist = {}
+    for sw in topo.switches:
+        hops = topo.next_hops(sw)
+        d = dist[sw] = {sw: 0}
+        # the BFS tree is built in distance order, walk it in that order
+        for node in hops:
+            if hops[node] is not None:
+                d[node] = d[hops[node]] + 1
+    return dist
+
+
+def plan_probes(topo, root_host, max_hops=MAX_HOPS):
+    """ Plans source-routed probes that start and end at `root_host` and
+        cross every switch-to-switch link in both directions.
+
+        Each probe is built greedily: it keeps taking the closest link not
+        covered yet for as long as it can still get back to the host within
+        `max_hops` switches, then returns home. Returns the list of egress
+        port lists (one port per hop) and the links no probe can reach.
+    """
+    root, host_port = topo.host_switch(root_host)
+    dist = switch_distances(topo)
+    uncovered = set()
+    for sw in topo.switches:
+        for neighbor in topo.neighbors(sw):
+            uncovered.add((sw, neighbor))
+    unreachable = set(link for link in uncovered
+                      if link[0] not in dist[root] or
+                      dist[root][link[0]] + 1 + dist[link[1]][root] + 1 > max_hops)
+    uncovered -= unreachable
+
+    def walk(path, ports):
+        for sw, next_sw in zip(path, path[1:]):
+            ports.append(topo.port_to(sw, next_sw))
+            uncovered.discard((sw, next_sw))
+
+    probes = []
+    while uncovered:
+        cur, ports = root, []
+        while True:
+            # hops left once the host port at the end is accounted for
+            budget = max_hops - 1 - len(ports)
+            fits = lambda link: (dist[cur][link[0]] + 1 + dist[link[1]][root]
+                                 <= budget)
+            local = [(cur, n) for n in topo.neighbors(cur) if (cur, n) in uncovered]
+            candidates = [link for link in local if fits(link)]
+            if not candidates:
+                candidates = sorted(link for link in uncovered if fits(link))
+            if not candidates:
+                break
+            u, v = min(candidates, key=lambda link: dist[cur][link[0]])
+            walk(topo.path(cur, u) + [v], ports)
+            cur = v
+        walk(topo.path(cur, root), ports)
+        ports.append(host_port)
+        probes.append(ports)
+    return probes, sorted(unreachable)
+
+
+def build_probe(src_mac, ports):
+    """ Ethernet + probe_t(hop_cnt=0) + one probe_fwd_t per hop. """
+    src = bytes.fromhex(src_mac.replace(':', ''))
+    return (ETH_HDR.pack(BROADCAST_MAC, src, TYPE_PROBE) +
+            PROBE_HDR.pack(0) + bytes(ports))
+
+
+def parse_probe(buf, length):
+    """ Yields (swid, port, byte_cnt, last_time, cur_time) for every hop
+        recorded in a returning probe, unpacked in place. """
+    if length < ETH_HDR_LEN + PROBE_HDR.size:
+        return
+    if struct.unpack_from('!H', buf, 12)[0] != TYPE_PROBE:
+        return
+    hop_cnt = PROBE_HDR.unpack_from(buf, ETH_HDR_LEN)[0]
+    offset = ETH_HDR_LEN + PROBE_HDR.size
+    for _ in range(min(hop_cnt, MAX_HOPS)):
+        if offset + PROBE_DATA.size > length:
+            return
+        (bos_swid, port, byte_cnt, last_hi, last_lo,
+         cur_hi, cur_lo) = PROBE_DATA.unpack_from(buf, offset)
+        yield (bos_swid & 0x7f, port, byte_cnt,
+               (last_hi << 32) | last_lo, (cur_hi << 32) | cur_lo)
+        if bos_swid & 0x80:
+            return
+        offset += PROBE_DATA.size
+
+
+class LinkMonitor(object):
+    """ Keeps a utilization time series, in Mbps, for every egress port
+        seen in returning probes. Memory is bounded by `history` samples
+        per port. """
+
+    def __init__(self, topo, history=128):
+        self.topo = topo
+        self.history = history
+        self.series = {}
+        self.probes_received = 0
+        # (swid, port) -> "sX-sY" for switch links, "sX-hY" for host ports
+        self.names = {}
+        for sw, ports in topo.sw_ports.items():
+            for neighbor, port in ports.items():
+                self.names[(int(sw[1:]), port)] = '%s-%s' % (sw, neighbor)
+        for host, (sw, port) in topo.host_links.items():
+            self.names[(int(sw[1:]), port)] = '%s-%s' % (sw, host)
+
+    def add_packet(self, buf, length):
+        hops = 0
+        for swid, port, byte_cnt, last_time, cur_time in parse_probe(buf, length):
+            hops += 1
+            # the first probe through a port has no previous timestamp
+            if not last_time or cur_time <= last_time:
+                continue
+            series = self.series.get((swid, port))
+            if series is None:
+                series = self.series[(swid, port)] = RingBuffer(self.history)
+            # BMv2 timestamps are in microseconds: bits per us == Mbps
+            series.append(cur_time / 1e6, byte_cnt * 8.0 / (cur_time - last_time))
+        if hops:
+            self.probes_received += 1
+
+    def link_name(self, swid, port):
+        return self.names.get((swid, port), 's%d-p%d' % (swid, port))
+
+    def snapshot(self):
+        links = {}
+        for (swid, port), series in sorted(self.series.items()):
+            _, mbps = series.last()
+            links[self.link_name(swid, port)] = {
+                'mbps': mbps,
+                'mean_mbps': series.mean(),
+                'samples': len(series),
+            }
+        return links
+
+    def print_summary(self):
+        print('\n----- Link utilization (%d probes received) -----' % self.probes_received)
+        for name, link in self.snapshot().items():
+            print('%s: %.3f Mbps (mean %.3f over %d samples)' % (
+                name, link['mbps'], link['mean_mbps'], link['samples']))
+
+
+def send_probes(sock, packets, rate):
+    """ Sends the probe set forever, `rate` probes per second overall. """
+    interval = 1.0 / rate
+    while True:
+        for packet in packets:
+            sock.send(packet)
+            time.sleep(interval)
+
+
+def report(monitor, interval):
+    while True:
+        time.sleep(interval)
+        monitor.print_summary()
+
+
+def main(args):
+    topo = Topology.from_file(args.topo)
+    probes, unreachable = plan_probes(topo, args.host, args.max_hops)
+    for sw, neighbor in unreachable:
+        print("Link %s-%s cannot be probed within %d hops from %s" % (
+            sw, neighbor, args.max_hops, args.host))
+    print("Covering %d links with %d probes:" % (
+        sum(len(p) for p in topo.sw_ports.values()) - len(unreachable), len(probes)))
+    for ports in probes:
+        print('  ports %s' % ' '.join(str(p) for p in ports))
+    if args.dry_run:
+        return
+
+    monitor = LinkMonitor(topo, args.history)
+    packets = [build_probe(topo.host_mac(args.host), ports) for ports in probes]
+    sock = open_raw_socket(args.iface, TYPE_PROBE)
+    sender = threading.Thread(target=send_probes, args=(sock, packets, args.rate))
+    sender.daemon = True
+    sender.start()
+    reporter = threading.Thread(target=report, args=(monitor, args.interval))
+    reporter.daemon = True
+    reporter.start()
+    try:
+        for buf, length in read_iface(args.iface, sock):
+            monitor.add_packet(buf, length)
+    except KeyboardInterrupt:
+        print(" Shutting down.")
+    monitor.print_summary()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Link monitor probe engine')
+    parser.add_argument('--topo', help='Topology JSON file used by run_exercise.py',
+                        type=str, action="store", required=False, default='./topology.json')
+    parser.add_argument('--host', help='host the probes are sent from and return to',
+                        type=str, action="store", required=False, default='h1')
+    parser.add_argument('--iface', help='interface of that host',
+                        type=str, action="store", required=False, default='eth0')
+    parser.add_argument('--rate', help='probes sent per second',
+                        type=float, action="store", required=False, default=10.0)
+    parser.add_argument('--max-hops', help='maximum switches a probe may cross',
+                        type=int, action="store", required=False, default=MAX_HOPS)
+    parser.add_argument('--history', help='utilization samples kept per link',
+                        type=int, action="store", required=False, default=128)
+    parser.add_argument('--interval', help='seconds between printed summaries',
+                        type=float, action="store", required=False, default=2.0)
+    parser.add_argument('--dry-run', help='only print the planned probes',
+                        action="store_true", required=False, default=False)
+    args = parser.parse_args()
+    if not 0 < args.max_hops <= MAX_HOPS:
+        parser.error("--max-hops must be between 1 and %d (MAX_HOPS in link_monitor)" % MAX_HOPS)
+    main(args)